@@ -0,0 +1,162 @@
+"""
+Write-behind buffer for append-only telemetry tables
+
+Rows for ai_usage_log, ai_learning_log and ai_training are queued here instead
+of being inserted on the request path. A background thread flushes them as
+multi-row inserts whenever a table's batch fills up or the flush interval
+elapses. The queue is bounded: when it is full, enqueue() waits briefly and
+then drops the row, counting it in `dropped`. A failed insert is retried a
+few times with backoff before its rows are counted as `failed`. on_flush()
+lets a module hear when a table's queued rows have been written, or given up
+on (the callback is told which).
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("CovalynceBatchWriter")
+
+BATCH_MAX_ROWS = 100  # flush a table once this many rows are pending
+BATCH_FLUSH_INTERVAL = 2.0  # seconds between time-based flushes
+BATCH_QUEUE_SIZE = 10000  # bounded queue for backpressure
+BATCH_ENQUEUE_TIMEOUT = 0.05  # how long a producer waits on a full queue before dropping
+BATCH_INSERT_ATTEMPTS = 3  # tries per batch insert before its rows are given up on
+BATCH_RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled per attempt
+
+
+class BatchWriter:
+    """Buffers rows per table and inserts them in batches from a worker thread"""
+
+    def __init__(self, max_rows: int = BATCH_MAX_ROWS, flush_interval: float = BATCH_FLUSH_INTERVAL,
+                 queue_size: int = BATCH_QUEUE_SIZE, enqueue_timeout: float = BATCH_ENQUEUE_TIMEOUT):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._listeners: dict[str, list] = {}
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, table: str, row: dict) -> bool:
+        """Queue a row for insertion; returns False if it had to be dropped"""
+        if self._stopping.is_set():
+            self.dropped += 1
+            return False
+        self.start()
+        try:
+            self._queue.put((table, row), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Batch writer queue full, dropped {table} row (dropped={self.dropped})")
+            return False
+
+    def enqueue_many(self, table: str, rows: list) -> int:
+        """Queue several rows for one table; returns how many were accepted"""
+        return sum(1 for row in rows if self.enqueue(table, row))
+
+    def on_flush(self, table: str, callback):
+        """Call callback(rows, written) from the writer thread once queued rows for table leave the buffer
+
+        written is False when the rows were given up on and are not in the DB.
+        """
+        self._listeners.setdefault(table, []).append(callback)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def close(self, timeout: float = 10.0):
+        """Stop accepting rows and drain everything still queued"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        # Anything left (e.g. the worker never started) is flushed inline
+        self._flush(self._drain_queue())
+        logger.info(f"Batch writer closed: {self.stats()}")
+
+    def _drain_queue(self) -> dict:
+        pending: dict[str, list] = {}
+        while True:
+            try:
+                table, row = self._queue.get_nowait()
+            except queue.Empty:
+                return pending
+            pending.setdefault(table, []).append(row)
+
+    def _run(self):
+        pending: dict[str, list] = {}
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                table, row = self._queue.get(timeout=timeout)
+                rows = pending.setdefault(table, [])
+                rows.append(row)
+                if len(rows) >= self.max_rows:
+                    self._flush({table: pending.pop(table)})
+            except queue.Empty:
+                pass
+
+            if time.monotonic() >= deadline:
+                self._flush(pending)
+                pending = {}
+                deadline = time.monotonic() + self.flush_interval
+
+            if self._stopping.is_set() and self._queue.empty():
+                self._flush(pending)
+                return
+
+    def _flush(self, pending: dict):
+        if not pending:
+            return
+        from app.database import supabase
+        for table, rows in pending.items():
+            if not rows:
+                continue
+            if not supabase:
+                self.dropped += len(rows)
+                written = False
+            else:
+                written = self._insert(supabase, table, rows)
+            for callback in self._listeners.get(table, ()):
+                try:
+                    callback(rows, written)
+                except Exception as e:
+                    logger.error(f"Batch flush listener for {table} failed: {e}")
+
+    def _insert(self, supabase, table: str, rows: list) -> bool:
+        """Insert one batch, retrying with backoff; False once every attempt has failed"""
+        for attempt in range(1, BATCH_INSERT_ATTEMPTS + 1):
+            try:
+                supabase.table(table).insert(rows).execute()
+                self.written += len(rows)
+                return True
+            except Exception as e:
+                if attempt == BATCH_INSERT_ATTEMPTS:
+                    self.failed += len(rows)
+                    logger.error(f"Batch insert into {table} failed ({len(rows)} rows, {attempt} attempts): {e}")
+                    return False
+                delay = BATCH_RETRY_BACKOFF * (2 ** (attempt - 1))
+                logger.warning(f"Batch insert into {table} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+batch_writer = BatchWriter()
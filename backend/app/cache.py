@@ -0,0 +1,194 @@
+"""
+Read-through TTL + LRU cache for per-user settings and integration rows
+
+user_settings and user_integrations are read on almost every request but only
+change on settings saves, OAuth connects and plan upgrades. Reads go through
+user_cache.get_or_load(); the write paths in database.py call
+user_cache.invalidate() so a worker never serves its own stale data. A load
+that an invalidation overtakes is returned but not cached, so a value read
+before a write can't outlive it.
+
+With several workers, set CACHE_INVALIDATION_REDIS_URL (and install `redis`)
+to broadcast invalidations to the other processes. Without it each worker
+relies on the TTL to pick up writes made elsewhere.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger("CovalynceCache")
+
+USER_CACHE_MAXSIZE = int(os.getenv("USER_CACHE_MAXSIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))  # seconds
+CACHE_INVALIDATION_REDIS_URL = os.getenv("CACHE_INVALIDATION_REDIS_URL")
+CACHE_INVALIDATION_CHANNEL = "covalynce:cache-invalidate"
+
+
+class UserCache:
+    """LRU of (user_id, field) -> value with a TTL and per-user invalidation"""
+
+    def __init__(self, maxsize: int = USER_CACHE_MAXSIZE, ttl: int = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # (user_id, field) -> (expires_at, value)
+        self._by_user: dict[str, set] = {}
+        self._loading: dict[tuple, int] = {}  # key -> loads in flight
+        self._generations: dict[tuple, int] = {}  # key -> invalidations seen while loading
+        self._lock = threading.Lock()
+        self._publish = None
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, user_id: str, field: str, default=None):
+        """The cached value, or default on a miss (never loads)"""
+        with self._lock:
+            entry = self._entries.get((user_id, field))
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+        return default
+
+    def get_or_load(self, user_id: str, field: str, loader, cache_none: bool = True, ttl=None):
+        """Return the cached value or call loader() and cache its result
+
+        ttl overrides the default lifetime: seconds, or a function of the
+        loaded value returning seconds (None for the default).
+        """
+        key = (user_id, field)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            self._loading[key] = self._loading.get(key, 0) + 1
+            generation = self._generations.get(key, 0)
+        loaded = False
+        try:
+            value = loader()
+            loaded = True
+        finally:
+            with self._lock:
+                # Skip caching if the key was invalidated while loader() ran
+                fresh = loaded and self._generations.get(key, 0) == generation
+                self._loading[key] -= 1
+                if not self._loading[key]:
+                    del self._loading[key]
+                    self._generations.pop(key, None)
+                if fresh and (value is not None or cache_none):
+                    self._set(key, value, ttl(value) if callable(ttl) else ttl)
+        return value
+
+    def _set(self, key: tuple, value, ttl: float = None):
+        # Caller holds self._lock
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        self._by_user.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.maxsize:
+            old_key, _ = self._entries.popitem(last=False)
+            self._unindex(old_key)
+
+    def _bump(self, keys):
+        # Caller holds self._lock; loads of these keys in flight won't be cached
+        for key in keys:
+            if key in self._loading:
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _unindex(self, key: tuple):
+        keys = self._by_user.get(key[0])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def invalidate(self, user_id: str, *fields: str, broadcast: bool = True):
+        """Drop the given fields for a user, or everything cached for them if none are given"""
+        with self._lock:
+            if fields:
+                keys = [(user_id, f) for f in fields]
+            else:
+                keys = list(self._by_user.get(user_id, ())) + [k for k in self._loading if k[0] == user_id]
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._unindex(key)
+            self._bump(keys)
+        if broadcast and self._publish:
+            self._publish([user_id], list(fields))
+
+    def adjust(self, user_ids, field: str, delta: int = None, value=None, broadcast: bool = True):
+        """Update a cached counter for many users in one pass (only where already cached)
+
+        Either adds delta or sets value. Other workers cannot apply the same
+        delta reliably, so they are told to drop the field instead.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                key = (user_id, field)
+                self._bump((key,))
+                entry = self._entries.get(key)
+                if not entry or entry[0] <= now:
+                    continue
+                new_value = value if delta is None else max(0, (entry[1] or 0) + delta)
+                self._entries[key] = (entry[0], new_value)
+        if broadcast and self._publish and user_ids:
+            self._publish(list(user_ids), [field])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._bump(list(self._loading))
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
+
+
+def start_invalidation_channel(cache: UserCache = user_cache) -> bool:
+    """Wire cross-worker invalidation over Redis pub/sub if configured"""
+    if not CACHE_INVALIDATION_REDIS_URL:
+        return False
+    try:
+        import redis
+    except ImportError:
+        logger.warning("CACHE_INVALIDATION_REDIS_URL is set but redis is not installed; using TTL only")
+        return False
+
+    origin = uuid.uuid4().hex
+    client = redis.Redis.from_url(CACHE_INVALIDATION_REDIS_URL)
+
+    def publish(user_ids: list, fields: list):
+        try:
+            client.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({"origin": origin, "user_ids": user_ids, "fields": fields}))
+        except Exception as e:
+            logger.warning(f"Cache invalidation publish failed: {e}")
+
+    def listen():
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    if data.get("origin") != origin:
+                        for user_id in data["user_ids"]:
+                            cache.invalidate(user_id, *data.get("fields", []), broadcast=False)
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error, reconnecting: {e}")
+                # Anything published while disconnected is lost; flush rather than trust it
+                cache.clear()
+                time.sleep(5)
+
+    cache._publish = publish
+    threading.Thread(target=listen, name="cache-invalidation", daemon=True).start()
+    logger.info("Cross-worker cache invalidation enabled")
+    return True
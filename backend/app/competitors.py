@@ -0,0 +1,392 @@
+"""
+Competitor post crawling
+
+A background worker keeps competitor_posts filled so the competitor views
+and learn_from_competitor read stored rows instead of a platform API:
+
+- every competitor has its own schedule (fetch_interval/next_fetch_at).
+  The interval shortens while a competitor keeps posting and stretches
+  while it is quiet; failures back off exponentially;
+- fetches are incremental: each adapter keeps a cursor on the competitor
+  row (since_id for APIs, ETag/Last-Modified for feeds), so a poll only
+  transfers what is new;
+- posts are deduplicated by a hash of their normalized text and written in
+  one upsert per fetch, together with a snapshot of their engagement;
+- fetches run under a per-platform concurrency limit, and a short database
+  lease per competitor keeps several workers from polling the same one.
+
+Adapters are chosen by platform. Setting COMPETITOR_FIXTURE_PATH (e.g. to
+app/fixtures/competitor_posts.json) replaces them all with a JSON-file
+adapter, for local development and tests.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app.database import claim_competitor_fetch, finish_competitor_fetch, get_due_competitors, save_competitor_posts
+from app.outbound import get_public
+
+logger = logging.getLogger("CovalynceCompetitors")
+
+COMPETITOR_FIXTURE_PATH = os.getenv("COMPETITOR_FIXTURE_PATH")  # fake every platform from this JSON file
+TWITTER_BEARER_TOKEN = os.getenv("TWITTER_BEARER_TOKEN")
+COMPETITOR_SCAN_INTERVAL = 60  # seconds between scans for due competitors
+COMPETITOR_BATCH = 200  # due competitors picked up per scan
+COMPETITOR_LEASE = 300  # seconds one worker holds a competitor's fetch
+COMPETITOR_MIN_INTERVAL = 900
+COMPETITOR_MAX_INTERVAL = 6 * 3600
+COMPETITOR_UNSUPPORTED_RETRY = 24 * 3600  # platforms without an adapter are looked at again daily
+COMPETITOR_FETCH_TIMEOUT = 20.0
+COMPETITOR_MAX_POSTS = 50  # posts taken per fetch
+COMPETITOR_FIRST_FETCH_WAIT = 8.0  # seconds a first look at a new competitor waits for its first fetch
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(text.lower().split()).encode()).hexdigest()
+
+
+def _iso(moment: datetime | None) -> str | None:
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat()
+
+
+class CompetitorSource:
+    """
+    Fetches a competitor's posts newer than its cursor. fetch() returns
+    {"posts": [{id, content, url, engagement, posted_at}], "cursor": dict}.
+    """
+
+    platform = "source"
+    concurrency = 2  # fetches in flight for this platform
+
+    async def fetch(self, http: httpx.AsyncClient, competitor: dict, cursor: dict) -> dict:
+        raise NotImplementedError
+
+
+class FixtureSource(CompetitorSource):
+    """
+    Posts from a JSON file of {handle: [posts, oldest first]} ("*" for any
+    handle). The file's mtime plays the ETag and the last post id the since_id.
+    """
+
+    platform = "fixture"
+    concurrency = 4
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read(self) -> tuple:
+        etag = str(os.stat(self.path).st_mtime_ns)
+        with open(self.path) as f:
+            return json.load(f), etag
+
+    async def fetch(self, http: httpx.AsyncClient, competitor: dict, cursor: dict) -> dict:
+        data, etag = await asyncio.to_thread(self._read)
+        if cursor.get("etag") == etag:
+            return {"posts": [], "cursor": cursor}
+        handle = (competitor.get("handle") or "").lower().lstrip("@")
+        posts = data.get(handle) or data.get("*") or []
+        ids = [str(p["id"]) for p in posts]
+        since_id = cursor.get("since_id")
+        if since_id in ids:
+            posts = posts[ids.index(since_id) + 1:]
+        now = time.time()
+        return {
+            "posts": [
+                {
+                    "id": str(p["id"]),
+                    "content": p["content"],
+                    "url": p.get("url"),
+                    "engagement": p.get("engagement") or {},
+                    "posted_at": p.get("posted_at") or _iso(datetime.fromtimestamp(now - 60 * p.get("age_minutes", 0), timezone.utc)),
+                }
+                for p in posts
+            ],
+            "cursor": {"since_id": ids[-1] if ids else since_id, "etag": etag},
+        }
+
+
+class FeedSource(CompetitorSource):
+    """RSS or Atom feed at the competitor's url, polled with conditional GETs"""
+
+    platform = "feed"
+    concurrency = 4
+
+    async def fetch(self, http: httpx.AsyncClient, competitor: dict, cursor: dict) -> dict:
+        url = competitor.get("url") or competitor.get("handle") or ""
+        if not url.startswith("http"):
+            raise ValueError("Feed competitors need a feed URL")
+        headers = {}
+        if cursor.get("etag"):
+            headers["If-None-Match"] = cursor["etag"]
+        if cursor.get("last_modified"):
+            headers["If-Modified-Since"] = cursor["last_modified"]
+        # The feed URL is user-supplied: only public hosts, redirects checked hop by hop
+        resp = await get_public(http, url, headers, schemes=("http", "https"))
+        if resp.status_code == 304:
+            return {"posts": [], "cursor": cursor}
+        resp.raise_for_status()
+        latest = cursor.get("latest")
+        posts = [p for p in self._parse(resp.content) if not latest or not p["posted_at"] or p["posted_at"] > latest]
+        dates = [p["posted_at"] for p in posts if p["posted_at"]]
+        return {
+            "posts": posts,
+            "cursor": {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "latest": max(dates + ([latest] if latest else []), default=None),
+            },
+        }
+
+    @staticmethod
+    def _parse(body: bytes) -> list:
+        root = ET.fromstring(body)
+        posts = []
+        for item in root.iter("item"):  # RSS
+            published = item.findtext("pubDate")
+            try:
+                posted_at = _iso(parsedate_to_datetime(published)) if published else None
+            except (TypeError, ValueError):
+                posted_at = None
+            posts.append({
+                "id": item.findtext("guid") or item.findtext("link"),
+                "content": "\n\n".join(filter(None, (item.findtext("title"), item.findtext("description")))),
+                "url": item.findtext("link"),
+                "engagement": {},
+                "posted_at": posted_at,
+            })
+        for entry in root.iter(f"{_ATOM}entry"):  # Atom
+            link = entry.find(f"{_ATOM}link")
+            published = entry.findtext(f"{_ATOM}published") or entry.findtext(f"{_ATOM}updated")
+            try:
+                posted_at = _iso(datetime.fromisoformat(published.replace("Z", "+00:00"))) if published else None
+            except ValueError:
+                posted_at = None
+            posts.append({
+                "id": entry.findtext(f"{_ATOM}id"),
+                "content": "\n\n".join(filter(None, (
+                    entry.findtext(f"{_ATOM}title"),
+                    entry.findtext(f"{_ATOM}summary") or entry.findtext(f"{_ATOM}content"),
+                ))),
+                "url": link.get("href") if link is not None else None,
+                "engagement": {},
+                "posted_at": posted_at,
+            })
+        return posts
+
+
+class TwitterSource(CompetitorSource):
+    """Recent original tweets via the X API v2, incremental on since_id"""
+
+    platform = "twitter"
+    concurrency = 1  # the per-app rate limit is tight
+
+    async def fetch(self, http: httpx.AsyncClient, competitor: dict, cursor: dict) -> dict:
+        headers = {"Authorization": f"Bearer {TWITTER_BEARER_TOKEN}"}
+        cursor = dict(cursor)
+        if not cursor.get("user_id"):
+            handle = (competitor.get("handle") or "").rstrip("/").rsplit("/", 1)[-1].lstrip("@")
+            resp = await http.get(f"https://api.twitter.com/2/users/by/username/{handle}", headers=headers)
+            resp.raise_for_status()
+            cursor["user_id"] = resp.json()["data"]["id"]
+        params = {
+            "max_results": COMPETITOR_MAX_POSTS,
+            "tweet.fields": "created_at,public_metrics",
+            "exclude": "retweets,replies",
+        }
+        if cursor.get("since_id"):
+            params["since_id"] = cursor["since_id"]
+        resp = await http.get(f"https://api.twitter.com/2/users/{cursor['user_id']}/tweets", headers=headers, params=params)
+        resp.raise_for_status()
+        body = resp.json()
+        cursor["since_id"] = body.get("meta", {}).get("newest_id") or cursor.get("since_id")
+        posts = []
+        for tweet in reversed(body.get("data", [])):
+            metrics = tweet.get("public_metrics") or {}
+            posts.append({
+                "id": tweet["id"],
+                "content": tweet.get("text") or "",
+                "url": f"https://x.com/i/status/{tweet['id']}",
+                "engagement": {
+                    "likes": metrics.get("like_count", 0),
+                    "comments": metrics.get("reply_count", 0),
+                    "shares": metrics.get("retweet_count", 0) + metrics.get("quote_count", 0),
+                },
+                "posted_at": tweet.get("created_at"),
+            })
+        return {"posts": posts, "cursor": cursor}
+
+
+_twitter, _feed = TwitterSource(), FeedSource()
+SOURCES: dict[str, CompetitorSource] = {
+    "twitter": _twitter, "x": _twitter,
+    "rss": _feed, "feed": _feed, "blog": _feed, "substack": _feed, "medium": _feed,
+}
+_fixture = FixtureSource(COMPETITOR_FIXTURE_PATH) if COMPETITOR_FIXTURE_PATH else None
+
+
+def register_source(name: str, source: CompetitorSource):
+    SOURCES[name.lower()] = source
+
+
+def source_for(competitor: dict) -> CompetitorSource | None:
+    if _fixture is not None:
+        return _fixture
+    source = SOURCES.get((competitor.get("platform") or "").strip().lower())
+    if source is _twitter and not TWITTER_BEARER_TOKEN:
+        return None
+    return source
+
+
+class CompetitorCrawler:
+    """Polls due competitors into competitor_posts"""
+
+    def __init__(self):
+        self._task = None
+        self._http: httpx.AsyncClient | None = None
+        self._slots: dict[str, asyncio.Semaphore] = {}
+        self._running: dict[str, asyncio.Task] = {}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._scan_loop())
+
+    async def stop(self):
+        tasks = ([self._task] if self._task else []) + list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def crawl(self, competitor: dict) -> asyncio.Task:
+        """Fetch one competitor now, joining a fetch of it that is already running"""
+        task = self._running.get(competitor["id"])
+        if task is None:
+            task = asyncio.create_task(self._crawl(competitor))
+            self._running[competitor["id"]] = task
+            task.add_done_callback(lambda _: self._running.pop(competitor["id"], None))
+        return task
+
+    async def crawl_due(self) -> int:
+        """One scan: fetch every competitor whose turn has come; returns how many posts were stored"""
+        now = datetime.now(timezone.utc).isoformat()
+        rows = await asyncio.to_thread(get_due_competitors, now, COMPETITOR_BATCH)
+        return sum(await asyncio.gather(*(self.crawl(row) for row in rows)))
+
+    async def _scan_loop(self):
+        while True:
+            try:
+                stored = await self.crawl_due()
+                if stored:
+                    logger.info(f"Stored {stored} competitor posts")
+            except Exception as e:
+                logger.error(f"Competitor scan error: {e}")
+            await asyncio.sleep(COMPETITOR_SCAN_INTERVAL)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=COMPETITOR_FETCH_TIMEOUT)
+        return self._http
+
+    def _slot(self, source: CompetitorSource) -> asyncio.Semaphore:
+        slot = self._slots.get(source.platform)
+        if slot is None:
+            slot = self._slots[source.platform] = asyncio.Semaphore(source.concurrency)
+        return slot
+
+    async def _crawl(self, competitor: dict) -> int:
+        source = source_for(competitor)
+        if source is None:
+            if await asyncio.to_thread(claim_competitor_fetch, competitor["id"], COMPETITOR_LEASE):
+                await asyncio.to_thread(finish_competitor_fetch, competitor["id"], {
+                    "next_fetch_at": _iso(datetime.fromtimestamp(time.time() + COMPETITOR_UNSUPPORTED_RETRY, timezone.utc)),
+                    "last_error": f"No crawler for platform {competitor.get('platform')}",
+                })
+            return 0
+
+        # Claimed only once a platform slot is free, so the lease is not spent waiting
+        async with self._slot(source):
+            if not await asyncio.to_thread(claim_competitor_fetch, competitor["id"], COMPETITOR_LEASE):
+                return 0
+            interval = competitor.get("fetch_interval") or COMPETITOR_MIN_INTERVAL
+            try:
+                result = await asyncio.wait_for(
+                    source.fetch(self._client(), competitor, competitor.get("fetch_cursor") or {}), COMPETITOR_FETCH_TIMEOUT
+                )
+                posts, snapshots = self._rows(competitor, result["posts"][-COMPETITOR_MAX_POSTS:])
+                await asyncio.to_thread(save_competitor_posts, posts, snapshots)
+            except Exception as e:
+                failures = (competitor.get("fetch_failures") or 0) + 1
+                delay = min(COMPETITOR_MAX_INTERVAL, interval * 2 ** failures)
+                logger.warning(f"Competitor {competitor['id']} ({source.platform}) fetch failed: {e}")
+                await asyncio.to_thread(finish_competitor_fetch, competitor["id"], {
+                    "fetch_failures": failures,
+                    "next_fetch_at": _iso(datetime.fromtimestamp(time.time() + delay, timezone.utc)),
+                    "last_error": str(e)[:500],
+                })
+                return 0
+
+        # Poll active competitors more often, quiet ones less
+        interval = interval / 2 if posts else interval * 1.5
+        interval = int(min(COMPETITOR_MAX_INTERVAL, max(COMPETITOR_MIN_INTERVAL, interval)))
+        now = time.time()
+        await asyncio.to_thread(finish_competitor_fetch, competitor["id"], {
+            "fetch_cursor": result["cursor"],
+            "fetch_interval": interval,
+            "fetch_failures": 0,
+            "next_fetch_at": _iso(datetime.fromtimestamp(now + interval, timezone.utc)),
+            "last_fetched_at": _iso(datetime.fromtimestamp(now, timezone.utc)),
+            "last_error": None,
+        })
+        return len(posts)
+
+    @staticmethod
+    def _rows(competitor: dict, fetched: list) -> tuple:
+        now = datetime.now(timezone.utc).isoformat()
+        posts: dict[str, dict] = {}
+        for post in fetched:
+            if not post.get("content"):
+                continue
+            digest = content_hash(post["content"])
+            posts[digest] = {
+                "competitor_id": competitor["id"],
+                "user_id": competitor["user_id"],
+                "platform": competitor.get("platform"),
+                "external_id": post.get("id"),
+                "content": post["content"],
+                "content_hash": digest,
+                "url": post.get("url"),
+                "engagement_metrics": post.get("engagement") or {},
+                "posted_at": post.get("posted_at"),
+                "fetched_at": now,
+            }
+        snapshots = [
+            {
+                "competitor_id": competitor["id"],
+                "user_id": competitor["user_id"],
+                "content_hash": digest,
+                "engagement_metrics": row["engagement_metrics"],
+                "captured_at": now,
+            }
+            for digest, row in posts.items() if row["engagement_metrics"]
+        ]
+        return list(posts.values()), snapshots
+
+
+competitor_crawler = CompetitorCrawler()
@@ -1,54 +1,138 @@
 import os
-from supabase import create_client, Client
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, TypedDict
 from dotenv import load_dotenv
+from app.cache import user_cache
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+class _LazySupabase:
+    """Stands in for the Supabase client and builds it on first use (the SDK is slow to import)"""
+
+    def __init__(self, url: str, key: str):
+        self._url, self._key = url, key
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get(self) -> "Client":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from supabase import create_client
+                    self._client = create_client(self._url, self._key)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+supabase: "Client" = _LazySupabase(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+
+# --- Column projections per use case (never ship token blobs or unused columns) ---
+USER_PROFILE_COLUMNS = "user_id, plan, cards_used, card_limit, daily_ai_limit, monthly_ai_limit"
+CARD_SUMMARY_COLUMNS = "id, source_id, category, type, title, subtitle, content, tags, color_class, created_at"
+CARD_HISTORY_COLUMNS = "id, source_id, category, type, title, content, status, image_url, created_at"
+INTEGRATION_SUMMARY_COLUMNS = "provider, permissions, consent_given, consent_timestamp, metadata, created_at"
+NOTIFICATION_COLUMNS = "id, type, title, message, severity, read, action_url, metadata, created_at"
+POST_ANALYTICS_COLUMNS = "id, card_id, platform, post_id, status, engagement_metrics, posted_at, created_at"
+
+class UserProfile(TypedDict, total=False):
+    user_id: str
+    plan: str
+    cards_used: int
+    card_limit: int
+    daily_ai_limit: int
+    monthly_ai_limit: int
+
+class CardSummary(TypedDict):
+    id: str
+    source_id: str
+    category: str
+    type: str
+    title: str
+    subtitle: str
+    content: str
+    tags: list
+    color_class: str
+    created_at: str
+
+class IntegrationSummary(TypedDict):
+    provider: str
+    permissions: list
+    consent_given: bool
+    consent_timestamp: str | None
+    metadata: dict | None
+    created_at: str
 
 def get_user_token(user_id: str, provider: str) -> str | None:
     if not supabase: return None
     try:
-        from app.encryption import decrypt_token
-        response = supabase.table("user_integrations").select("access_token").eq("user_id", user_id).eq("provider", provider).execute()
-        if response.data and len(response.data) > 0:
-            encrypted_token = response.data[0]['access_token']
-            return decrypt_token(encrypted_token)
-        return None
+        return user_cache.get_or_load(user_id, f"token:{provider}", lambda: _load_user_token(user_id, provider))
     except Exception as e:
         print(f"DB Error (Tokens): {e}")
         return None
 
-def save_user_token(user_id: str, provider: str, token: str):
+def _load_user_token(user_id: str, provider: str) -> str | None:
+    from app.encryption import decrypt_token
+    response = supabase.table("user_integrations").select("access_token").eq("user_id", user_id).eq("provider", provider).execute()
+    if response.data and len(response.data) > 0:
+        encrypted_token = response.data[0]['access_token']
+        return decrypt_token(encrypted_token)
+    return None
+
+def save_user_token(user_id: str, provider: str, token: str, refresh_token: str = None, expires_at: str = None):
     if not supabase: return
     from app.encryption import encrypt_token
     encrypted_token = encrypt_token(token)
     data = {"user_id": user_id, "provider": provider, "access_token": encrypted_token}
+    if refresh_token:
+        data["refresh_token"] = encrypt_token(refresh_token)
+    if expires_at:
+        data["token_expires_at"] = expires_at
+    # A fresh connect starts refresh over, whatever happened to the old token
+    data["token_refresh_failures"] = 0
+    data["token_next_refresh_at"] = None
     supabase.table("user_integrations").upsert(data).execute()
     supabase.table("user_settings").upsert({"user_id": user_id}, on_conflict="user_id").execute()
+    invalidate_user_integrations(user_id, provider)
 
-def get_user_profile(user_id: str):
+def get_user_profile(user_id: str) -> UserProfile | None:
     if not supabase: return None
     try:
-        res = supabase.table("user_settings").select("*").eq("user_id", user_id).execute()
-        if res.data: return res.data[0]
-        default_profile = {"user_id": user_id, "plan": "SOLO", "cards_used": 0, "card_limit": 5}
-        supabase.table("user_settings").insert(default_profile).execute()
-        return default_profile
+        return user_cache.get_or_load(user_id, "profile", lambda: _load_user_profile(user_id), cache_none=False)
     except: return None
 
+def _load_user_profile(user_id: str) -> UserProfile:
+    res = supabase.table("user_settings").select(USER_PROFILE_COLUMNS).eq("user_id", user_id).execute()
+    if res.data: return res.data[0]
+    default_profile = {"user_id": user_id, "plan": "SOLO", "cards_used": 0, "card_limit": 5}
+    supabase.table("user_settings").insert(default_profile).execute()
+    return default_profile
+
 def upgrade_user_plan(user_id: str, plan: str = "PRO"):
     if not supabase: return
     supabase.table("user_settings").update({"plan": plan, "card_limit": 9999}).eq("user_id", user_id).execute()
+    user_cache.invalidate(user_id, "profile")
 
 def increment_usage(user_id: str):
+    """Add one to cards_used in the DB itself, so concurrent workers don't overwrite each other"""
     if not supabase: return
     try:
-        current = get_user_profile(user_id)
-        new_count = (current.get('cards_used', 0) or 0) + 1
-        supabase.table("user_settings").update({"cards_used": new_count}).eq("user_id", user_id).execute()
+        try:
+            supabase.rpc("increment_cards_used", {"p_user_id": user_id}).execute()
+        except Exception as e:
+            if getattr(e, "code", None) != "PGRST202":  # function not found
+                raise
+            # Not installed: read-modify-write against the row, never the cached profile
+            res = supabase.table("user_settings").select("cards_used").eq("user_id", user_id).execute()
+            new_count = ((res.data[0].get("cards_used") if res.data else 0) or 0) + 1
+            supabase.table("user_settings").update({"cards_used": new_count}).eq("user_id", user_id).execute()
+        user_cache.invalidate(user_id, "profile")
     except: pass
 
 def check_limit_reached(user_id: str) -> bool:
@@ -57,11 +141,17 @@ def check_limit_reached(user_id: str) -> bool:
     return profile['cards_used'] >= profile['card_limit']
 
 def get_user_openai_key(user_id: str) -> str | None:
-    profile = get_user_profile(user_id)
-    if not profile or not profile.get('openai_key'):
+    if not supabase: return None
+    try:
+        return user_cache.get_or_load(user_id, "openai_key", lambda: _load_user_openai_key(user_id))
+    except: return None
+
+def _load_user_openai_key(user_id: str) -> str | None:
+    res = supabase.table("user_settings").select("openai_key").eq("user_id", user_id).execute()
+    if not res.data or not res.data[0].get('openai_key'):
         return None
     from app.encryption import decrypt_token
-    encrypted_key = profile.get('openai_key')
+    encrypted_key = res.data[0]['openai_key']
     return decrypt_token(encrypted_key)
 
 def save_user_settings(user_id: str, openai_key: str):
@@ -69,22 +159,89 @@ def save_user_settings(user_id: str, openai_key: str):
     from app.encryption import encrypt_token
     encrypted_key = encrypt_token(openai_key) if openai_key else None
     supabase.table("user_settings").update({"openai_key": encrypted_key}).eq("user_id", user_id).execute()
+    user_cache.invalidate(user_id, "openai_key")
 
-def get_cached_cards(user_id: str, limit: int = 10):
+def get_cached_cards(user_id: str, limit: int = 10) -> list[CardSummary]:
     if not supabase: return []
     try:
-        return supabase.table("task_cards").select("*").eq("user_id", user_id).eq("status", "PENDING").order("created_at", desc=True).limit(limit).execute().data
+        return supabase.table("task_cards").select(CARD_SUMMARY_COLUMNS).eq("user_id", user_id).eq("status", "PENDING").order("created_at", desc=True).limit(limit).execute().data
     except: return []
 
+# --- Keyset pagination on (created_at, id) ---
+
+def encode_cursor(row: dict, column: str = "created_at", key: str = "id") -> str:
+    """Opaque cursor pointing just past a row"""
+    import base64, json
+    raw = json.dumps([row[column], str(row[key])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor from encode_cursor; raises ValueError if it is malformed"""
+    import base64, binascii, json
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+def _keyset_page(query, limit: int, cursor: str = None, column: str = "created_at", key: str = "id"):
+    """Fetch one page newest-first on (column, key), strictly after the cursor. Returns (rows, next_cursor)"""
+    if cursor:
+        moment, row_id = decode_cursor(cursor)
+        query = query.or_(f'{column}.lt."{moment}",and({column}.eq."{moment}",{key}.lt."{row_id}")')
+    rows = query.order(column, desc=True).order(key, desc=True).limit(limit + 1).execute().data or []
+    next_cursor = encode_cursor(rows[limit - 1], column, key) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def _iter_keyset(build_query, page_size: int = 500):
+    """Yield every row of a query page by page (for streamed listings)"""
+    cursor = None
+    while True:
+        rows, cursor = _keyset_page(build_query(), page_size, cursor)
+        yield from rows
+        if not cursor: return
+
+_ROW_KEYS = {"payment_events": "event_id"}  # primary key when it isn't "id"
+
+def get_user_rows_page(table: str, user_id: str, columns: str = "*", limit: int = 500, cursor: str = None,
+                       order_column: str = "created_at"):
+    """Page through any user-owned table keyed by (order_column, primary key); order_column must be non-null. Returns (rows, next_cursor)"""
+    if not supabase: return [], None
+    return _keyset_page(supabase.table(table).select(columns).eq("user_id", user_id), limit, cursor, order_column,
+                        _ROW_KEYS.get(table, "id"))
+
+CARD_HISTORY_STATUSES = ["PENDING", "POSTED", "DISMISSED"]
+
 def get_card_history(user_id: str, limit: int = 50, offset: int = 0):
     """Get all cards (including POSTED and DISMISSED) for history view"""
     if not supabase: return []
     try:
-        return supabase.table("task_cards").select("*").eq("user_id", user_id).in_("status", ["PENDING", "POSTED", "DISMISSED"]).order("created_at", desc=True).limit(limit).offset(offset).execute().data
+        return supabase.table("task_cards").select(CARD_HISTORY_COLUMNS).eq("user_id", user_id).in_("status", CARD_HISTORY_STATUSES).order("created_at", desc=True).limit(limit).offset(offset).execute().data
     except Exception as e:
         print(f"DB Error (Card History): {e}")
         return []
 
+def _card_history_query(user_id: str):
+    return supabase.table("task_cards").select(CARD_HISTORY_COLUMNS).eq("user_id", user_id).in_("status", CARD_HISTORY_STATUSES)
+
+def get_card_history_page(user_id: str, limit: int = 50, cursor: str = None):
+    """Card history page via keyset pagination. Returns (cards, next_cursor)"""
+    if not supabase: return [], None
+    try:
+        return _keyset_page(_card_history_query(user_id), limit, cursor)
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"DB Error (Card History): {e}")
+        return [], None
+
+def iter_card_history(user_id: str):
+    """Stream a user's full card history"""
+    if not supabase: return iter(())
+    return _iter_keyset(lambda: _card_history_query(user_id))
+
 def card_exists(user_id: str, source_id: str):
     if not supabase: return False
     try:
@@ -104,14 +261,42 @@ def update_card_status(card_id: str, status: str):
     try: supabase.table("task_cards").update({"status": status}).eq("id", card_id).execute()
     except: pass
 
-def get_user_integrations(user_id: str):
-    """Get all integrations for a user with permissions"""
+def get_card(user_id: str, card_id: str, columns: str = CARD_SUMMARY_COLUMNS) -> dict | None:
+    """One of the user's cards, or None"""
+    if not supabase: return None
+    res = supabase.table("task_cards").select(columns).eq("id", card_id).eq("user_id", user_id).limit(1).execute()
+    return res.data[0] if res.data else None
+
+def get_user_integrations(user_id: str) -> list[IntegrationSummary]:
+    """Get all integrations for a user with permissions (tokens are never selected)"""
     if not supabase: return []
     try:
-        return supabase.table("user_integrations").select("*").eq("user_id", user_id).execute().data
+        return user_cache.get_or_load(
+            user_id, "integrations",
+            lambda: supabase.table("user_integrations").select(INTEGRATION_SUMMARY_COLUMNS).eq("user_id", user_id).execute().data
+        )
     except: return []
 
-def save_integration_with_permissions(user_id: str, provider: str, token: str, refresh_token: str = None, permissions: list = None, consent_given: bool = True):
+def get_integration_metadata(user_id: str, provider: str) -> dict | None:
+    """Get the metadata blob of one integration (e.g. the LinkedIn person URN)"""
+    if not supabase: return None
+    def load():
+        res = supabase.table("user_integrations").select("metadata").eq("user_id", user_id).eq("provider", provider).execute()
+        return res.data[0].get("metadata") if res.data else None
+    return user_cache.get_or_load(user_id, f"metadata:{provider}", load)
+
+def update_integration_metadata(user_id: str, provider: str, metadata: dict):
+    """Replace an integration's metadata blob"""
+    if not supabase: return
+    supabase.table("user_integrations").update({"metadata": metadata}).eq("user_id", user_id).eq("provider", provider).execute()
+    invalidate_user_integrations(user_id, provider)
+
+def invalidate_user_integrations(user_id: str, provider: str):
+    """Drop cached rows after an integration is connected, refreshed, changed or removed"""
+    user_cache.invalidate(user_id, "integrations", f"token:{provider}", f"oauth:{provider}", f"metadata:{provider}")
+
+def save_integration_with_permissions(user_id: str, provider: str, token: str, refresh_token: str = None, permissions: list = None, consent_given: bool = True,
+                                      expires_at: str = None):
     """Save integration with permissions and consent tracking"""
     if not supabase: return
     from app.encryption import encrypt_token
@@ -126,8 +311,14 @@ def save_integration_with_permissions(user_id: str, provider: str, token: str, r
         data["refresh_token"] = encrypt_token(refresh_token)
     if permissions:
         data["permissions"] = permissions
+    if expires_at:
+        data["token_expires_at"] = expires_at
+    # A fresh connect starts refresh over, whatever happened to the old token
+    data["token_refresh_failures"] = 0
+    data["token_next_refresh_at"] = None
     supabase.table("user_integrations").upsert(data).execute()
     supabase.table("user_settings").upsert({"user_id": user_id}, on_conflict="user_id").execute()
+    invalidate_user_integrations(user_id, provider)
 
 def get_integration_refresh_token(user_id: str, provider: str) -> str | None:
     """Get refresh token for an integration"""
@@ -141,18 +332,105 @@ def get_integration_refresh_token(user_id: str, provider: str) -> str | None:
         return None
     except: return None
 
-def update_integration_token(user_id: str, provider: str, access_token: str, refresh_token: str = None):
-    """Update access token and optionally refresh token"""
+def update_integration_token(user_id: str, provider: str, access_token: str, refresh_token: str = None, expires_at: str = None):
+    """Update access token and optionally refresh token and expiry"""
     if not supabase: return
     from app.encryption import encrypt_token
-    data = {"access_token": encrypt_token(access_token)}
+    data = {"access_token": encrypt_token(access_token), "token_expires_at": expires_at, "token_refresh_locked_until": None,
+            "token_refresh_failures": 0, "token_next_refresh_at": None}
     if refresh_token:
         data["refresh_token"] = encrypt_token(refresh_token)
     supabase.table("user_integrations").update(data).eq("user_id", user_id).eq("provider", provider).execute()
+    invalidate_user_integrations(user_id, provider)
 
-def save_analytics(user_id: str, card_id: str, platform: str, post_id: str = None, status: str = "PENDING"):
-    """Save post analytics"""
-    if not supabase: return
+def get_oauth_credentials(user_id: str, provider: str) -> dict | None:
+    """Decrypted access token, expiry (epoch seconds or None) and whether it can be refreshed; cached until expiry"""
+    if not supabase: return None
+    return user_cache.get_or_load(user_id, f"oauth:{provider}", lambda: _load_oauth_credentials(user_id, provider),
+                                  cache_none=False, ttl=_oauth_credentials_ttl)
+
+def load_oauth_credentials(user_id: str, provider: str) -> dict | None:
+    """get_oauth_credentials straight from the DB, bypassing the cache (to see another worker's refresh)"""
+    if not supabase: return None
+    return _load_oauth_credentials(user_id, provider)
+
+def _epoch(value: str | None) -> float | None:
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def _load_oauth_credentials(user_id: str, provider: str) -> dict | None:
+    from app.encryption import decrypt_token
+    res = supabase.table("user_integrations").select(
+        "access_token, refresh_token, token_expires_at, token_next_refresh_at"
+    ).eq("user_id", user_id).eq("provider", provider).execute()
+    if not res.data or not res.data[0].get("access_token"):
+        return None
+    row = res.data[0]
+    return {
+        "access_token": decrypt_token(row["access_token"]),
+        "expires_at": _epoch(row.get("token_expires_at")),
+        "refreshable": bool(row.get("refresh_token")),
+        "next_refresh_at": _epoch(row.get("token_next_refresh_at")),  # set while failed refreshes back off
+    }
+
+def _oauth_credentials_ttl(credentials: dict) -> float | None:
+    import time
+    if credentials and credentials["expires_at"]:
+        return max(1.0, credentials["expires_at"] - time.time())
+    return None
+
+def get_expiring_integrations(providers: list, before: str, limit: int = 500) -> list:
+    """Refreshable integrations whose access token expires before an ISO timestamp
+
+    Integrations backing off after failed refreshes (token_next_refresh_at in
+    the future) are left out, so revoked ones can't fill the page.
+    """
+    if not supabase: return []
+    now = datetime.utcnow().isoformat()
+    try:
+        return supabase.table("user_integrations").select("user_id, provider, token_expires_at").in_(
+            "provider", providers
+        ).not_.is_("refresh_token", "null").lt("token_expires_at", before).or_(
+            f"token_next_refresh_at.is.null,token_next_refresh_at.lte.{now}"
+        ).order("token_expires_at").limit(limit).execute().data or []
+    except Exception as e:
+        print(f"Expiring token scan error: {e}")
+        return []
+
+def record_token_refresh_failure(user_id: str, provider: str, base_delay: int, max_delay: int) -> int:
+    """Count a failed refresh and keep the integration out of refresh scans for a while
+
+    The delay doubles with each consecutive failure up to max_delay; a
+    successful refresh or a reconnect resets it. Returns the delay in seconds.
+    """
+    if not supabase: return base_delay
+    res = supabase.table("user_integrations").select("token_refresh_failures").eq("user_id", user_id).eq("provider", provider).execute()
+    failures = ((res.data[0].get("token_refresh_failures") or 0) if res.data else 0) + 1
+    delay = min(max_delay, base_delay * 2 ** (failures - 1))
+    supabase.table("user_integrations").update({
+        "token_refresh_failures": failures,
+        "token_next_refresh_at": (datetime.utcnow() + timedelta(seconds=delay)).isoformat(),
+        "token_refresh_locked_until": None,
+    }).eq("user_id", user_id).eq("provider", provider).execute()
+    invalidate_user_integrations(user_id, provider)
+    return delay
+
+def claim_token_refresh(user_id: str, provider: str, lease_seconds: int) -> bool:
+    """Take a short lease on refreshing one integration so only one worker refreshes it"""
+    if not supabase: return True
+    now = datetime.utcnow()
+    res = supabase.table("user_integrations").update(
+        {"token_refresh_locked_until": (now + timedelta(seconds=lease_seconds)).isoformat()}
+    ).eq("user_id", user_id).eq("provider", provider).or_(
+        f"token_refresh_locked_until.is.null,token_refresh_locked_until.lt.{now.isoformat()}"
+    ).execute()
+    return bool(res.data)
+
+def _analytics_row(user_id: str, card_id: str, platform: str, post_id: str = None, status: str = "PENDING") -> dict:
     data = {
         "user_id": user_id,
         "card_id": card_id,
@@ -163,11 +441,40 @@ def save_analytics(user_id: str, card_id: str, platform: str, post_id: str = Non
         data["post_id"] = post_id
     if status == "POSTED":
         data["posted_at"] = "now()"
+    return data
+
+def save_analytics(user_id: str, card_id: str, platform: str, post_id: str = None, status: str = "PENDING"):
+    """Save post analytics"""
+    if not supabase: return
     try:
-        supabase.table("post_analytics").insert(data).execute()
+        supabase.table("post_analytics").insert(_analytics_row(user_id, card_id, platform, post_id, status)).execute()
     except Exception as e:
         print(f"Analytics save error: {e}")
 
+def save_analytics_bulk(user_id: str, card_id: str, results: list):
+    """Save one post_analytics row per platform result ({platform, post_id, status}) in a single insert"""
+    if not supabase or not results: return
+    rows = [_analytics_row(user_id, card_id, r["platform"], r.get("post_id"), r["status"]) for r in results]
+    # PostgREST bulk inserts need the same keys in every object
+    rows = [{"post_id": None, "posted_at": None, **row} for row in rows]
+    try:
+        supabase.table("post_analytics").insert(rows).execute()
+    except Exception as e:
+        print(f"Analytics save error: {e}")
+
+def _post_analytics_query(user_id: str):
+    return supabase.table("post_analytics").select(POST_ANALYTICS_COLUMNS).eq("user_id", user_id)
+
+def get_post_analytics_page(user_id: str, limit: int = 50, cursor: str = None):
+    """Post analytics page via keyset pagination. Returns (rows, next_cursor)"""
+    if not supabase: return [], None
+    return _keyset_page(_post_analytics_query(user_id), limit, cursor)
+
+def iter_post_analytics(user_id: str):
+    """Stream all of a user's post analytics"""
+    if not supabase: return iter(())
+    return _iter_keyset(lambda: _post_analytics_query(user_id))
+
 def update_card_image(card_id: str, image_url: str, generated: bool = False):
     """Update card with image URL"""
     if not supabase: return
@@ -235,24 +542,188 @@ def save_payment_notification(user_id: str, payment_id: str, amount: float, curr
     except Exception as e:
         print(f"Payment notification save error: {e}")
 
+def record_payment_event(event_id: str, event_type: str, user_id: str, payload: dict) -> bool:
+    """Store a webhook event once; returns False if this event id was already recorded"""
+    if not supabase: return True
+    row = {
+        "event_id": event_id,
+        "event_type": event_type,
+        "user_id": user_id,
+        "payload": payload,
+        "status": "PENDING",
+        "attempts": 0,
+        "received_at": datetime.utcnow().isoformat()
+    }
+    # Errors propagate: the webhook must not be acknowledged unless the event was stored
+    res = supabase.table("payment_events").upsert(row, on_conflict="event_id", ignore_duplicates=True).execute()
+    return bool(res.data)
+
+def claim_payment_event(event_id: str, lease_seconds: int) -> bool:
+    """Mark an event PROCESSING if it is pending or its previous lease expired; False if another worker holds it"""
+    if not supabase: return True
+    now = datetime.utcnow()
+    data = {"status": "PROCESSING", "locked_until": (now + timedelta(seconds=lease_seconds)).isoformat()}
+    claimed = supabase.table("payment_events").update(data).eq("event_id", event_id).eq("status", "PENDING").execute()
+    if claimed.data:
+        return True
+    stale = supabase.table("payment_events").update(data).eq("event_id", event_id).eq("status", "PROCESSING").lt("locked_until", now.isoformat()).execute()
+    return bool(stale.data)
+
+def finish_payment_event(event_id: str, status: str, attempts: int, error: str = None):
+    """Record the outcome of a processing attempt (PENDING to retry, DONE or FAILED)"""
+    if not supabase: return
+    data = {"status": status, "attempts": attempts, "last_error": error, "locked_until": None}
+    if status != "PENDING":
+        data["processed_at"] = datetime.utcnow().isoformat()
+    try:
+        supabase.table("payment_events").update(data).eq("event_id", event_id).execute()
+    except Exception as e:
+        print(f"Payment event update error: {e}")
+
+def get_unfinished_payment_events(limit: int = 500) -> list:
+    """Events not yet DONE/FAILED, oldest first (for recovery after a restart)"""
+    if not supabase: return []
+    try:
+        return supabase.table("payment_events").select("event_id, event_type, user_id, payload, attempts").in_(
+            "status", ["PENDING", "PROCESSING"]
+        ).order("received_at").limit(limit).execute().data
+    except Exception as e:
+        print(f"Payment event recovery error: {e}")
+        return []
+
+# --- Scheduled posts ---
+
+SCHEDULED_POST_COLUMNS = "id, user_id, card_id, platform, content, publish_at, status, attempts"
+
+def create_scheduled_posts(rows: list) -> list:
+    """Insert scheduled posts ({user_id, card_id, platform, content, publish_at}) and return them with ids"""
+    if not supabase or not rows: return []
+    rows = [{**row, "status": "SCHEDULED", "attempts": 0} for row in rows]
+    return supabase.table("scheduled_posts").insert(rows).execute().data or []
+
+def get_scheduled_posts_before(before: str, after: tuple = None, limit: int = 500) -> list:
+    """SCHEDULED posts due before an ISO timestamp, ascending by (publish_at, id), strictly after the `after` key"""
+    if not supabase: return []
+    query = supabase.table("scheduled_posts").select(SCHEDULED_POST_COLUMNS).eq("status", "SCHEDULED").lt("publish_at", before)
+    if after:
+        publish_at, row_id = after
+        query = query.or_(f'publish_at.gt."{publish_at}",and(publish_at.eq."{publish_at}",id.gt."{row_id}")')
+    return query.order("publish_at").order("id").limit(limit).execute().data or []
+
+def get_stale_scheduled_posts(now: str, limit: int = 500) -> list:
+    """PUBLISHING posts whose lease expired (their worker died mid-publish)"""
+    if not supabase: return []
+    return supabase.table("scheduled_posts").select(SCHEDULED_POST_COLUMNS).eq("status", "PUBLISHING").lt("locked_until", now).limit(limit).execute().data or []
+
+def claim_scheduled_posts(ids: list, lease_until: str, now: str) -> list:
+    """Atomically move due posts to PUBLISHING under a lease; returns only the rows this caller won"""
+    if not supabase or not ids: return []
+    data = {"status": "PUBLISHING", "locked_until": lease_until}
+    claimed = supabase.table("scheduled_posts").update(data).in_("id", ids).eq("status", "SCHEDULED").execute().data or []
+    remaining = list(set(ids) - {row["id"] for row in claimed})
+    if remaining:
+        claimed += supabase.table("scheduled_posts").update(data).in_("id", remaining).eq("status", "PUBLISHING").lt("locked_until", now).execute().data or []
+    return claimed
+
+def finish_scheduled_post(post_id: str, status: str, attempts: int, error: str = None, post_ref: str = None,
+                          publish_at: str = None):
+    """Record a publish outcome: POSTED, FAILED, or SCHEDULED again (with a new publish_at) to retry"""
+    if not supabase: return
+    data = {"status": status, "attempts": attempts, "last_error": error, "post_id": post_ref, "locked_until": None}
+    if publish_at:
+        data["publish_at"] = publish_at
+    try:
+        supabase.table("scheduled_posts").update(data).eq("id", post_id).execute()
+    except Exception as e:
+        print(f"Scheduled post update error: {e}")
+
+def get_user_scheduled_posts(user_id: str, limit: int = 100) -> list:
+    if not supabase: return []
+    return supabase.table("scheduled_posts").select(
+        "id, card_id, platform, publish_at, status, attempts, last_error, post_id, created_at"
+    ).eq("user_id", user_id).in_("status", ["SCHEDULED", "PUBLISHING", "FAILED"]).order("publish_at").limit(limit).execute().data or []
+
+def cancel_scheduled_post(user_id: str, post_id: str) -> dict | None:
+    """Cancel a post that has not started publishing; returns the cancelled row or None"""
+    if not supabase: return None
+    res = supabase.table("scheduled_posts").update({"status": "CANCELLED"}).eq("id", post_id).eq("user_id", user_id).eq("status", "SCHEDULED").execute()
+    return res.data[0] if res.data else None
+
+def count_scheduled_posts(card_id: str) -> int:
+    """Posts for a card still waiting to be published"""
+    if not supabase: return 0
+    res = supabase.table("scheduled_posts").select("id", count="exact").eq("card_id", card_id).in_("status", ["SCHEDULED", "PUBLISHING"]).execute()
+    return res.count or 0
+
+# --- Competitor crawling ---
+
+COMPETITOR_FETCH_COLUMNS = "id, user_id, name, platform, handle, url, fetch_interval, fetch_cursor, fetch_failures, last_fetched_at"
+COMPETITOR_POST_COLUMNS = "id, external_id, content, url, engagement_metrics, posted_at, fetched_at"
+
+def get_due_competitors(now: str, limit: int = 200) -> list:
+    """Competitors whose next fetch is due (never-fetched ones included)"""
+    if not supabase: return []
+    return supabase.table("competitors").select(COMPETITOR_FETCH_COLUMNS).or_(
+        f"next_fetch_at.is.null,next_fetch_at.lte.{now}"
+    ).order("next_fetch_at").limit(limit).execute().data or []
+
+def get_competitor(user_id: str, competitor_id: str, columns: str = COMPETITOR_FETCH_COLUMNS) -> dict | None:
+    if not supabase: return None
+    res = supabase.table("competitors").select(columns).eq("id", competitor_id).eq("user_id", user_id).execute()
+    return res.data[0] if res.data else None
+
+def claim_competitor_fetch(competitor_id: str, lease_seconds: int) -> bool:
+    """Take a short lease on fetching one competitor so only one worker polls it"""
+    if not supabase: return True
+    now = datetime.utcnow()
+    res = supabase.table("competitors").update(
+        {"fetch_locked_until": (now + timedelta(seconds=lease_seconds)).isoformat()}
+    ).eq("id", competitor_id).or_(
+        f"fetch_locked_until.is.null,fetch_locked_until.lt.{now.isoformat()}"
+    ).execute()
+    return bool(res.data)
+
+def save_competitor_posts(posts: list, snapshots: list):
+    """Upsert fetched posts by (competitor_id, content_hash), refreshing their engagement, and record the snapshots"""
+    if not supabase or not posts: return
+    supabase.table("competitor_posts").upsert(posts, on_conflict="competitor_id,content_hash").execute()
+    if snapshots:
+        supabase.table("competitor_post_snapshots").insert(snapshots).execute()
+
+def finish_competitor_fetch(competitor_id: str, data: dict):
+    """Store the fetch cursor, schedule and outcome, releasing the lease"""
+    if not supabase: return
+    try:
+        supabase.table("competitors").update({**data, "fetch_locked_until": None}).eq("id", competitor_id).execute()
+    except Exception as e:
+        print(f"Competitor fetch update error: {e}")
+
+def get_stored_competitor_posts(competitor_id: str, user_id: str, limit: int = 20) -> list:
+    if not supabase: return []
+    return supabase.table("competitor_posts").select(COMPETITOR_POST_COLUMNS).eq("competitor_id", competitor_id).eq(
+        "user_id", user_id
+    ).order("posted_at", desc=True).limit(limit).execute().data or []
+
+def count_ai_usage_since(user_id: str, since: str) -> int:
+    """Count ai_usage_log rows for a user since an ISO timestamp; raises on DB errors (used by quota)"""
+    if not supabase: return 0
+    count = supabase.table("ai_usage_log").select("id", count="exact").eq("user_id", user_id).gte("created_at", since).execute()
+    return count.count if hasattr(count, 'count') else 0
+
 def get_ai_usage_today(user_id: str) -> int:
     """Get AI usage count for today"""
-    if not supabase: return 0
-    from datetime import datetime, timedelta
+    from datetime import datetime
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
     try:
-        count = supabase.table("ai_usage_log").select("id", count="exact").eq("user_id", user_id).gte("created_at", today_start).execute()
-        return count.count if hasattr(count, 'count') else 0
+        return count_ai_usage_since(user_id, today_start)
     except: return 0
 
 def get_ai_usage_month(user_id: str) -> int:
     """Get AI usage count for current month"""
-    if not supabase: return 0
     from datetime import datetime
     month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
     try:
-        count = supabase.table("ai_usage_log").select("id", count="exact").eq("user_id", user_id).gte("created_at", month_start).execute()
-        return count.count if hasattr(count, 'count') else 0
+        return count_ai_usage_since(user_id, month_start)
     except: return 0
 
 def log_ai_usage(user_id: str, model: str, tokens_used: int = 0):
@@ -263,10 +734,12 @@ def log_ai_usage(user_id: str, model: str, tokens_used: int = 0):
         "model": model,
         "tokens_used": tokens_used
     }
-    try:
-        supabase.table("ai_usage_log").insert(data).execute()
-    except Exception as e:
-        print(f"AI usage log error: {e}")
+    # Written behind the request by the batch writer; quota counts it right away,
+    # and as unflushed until the row lands so seeds and reconciles don't miss it
+    from app.batch_writer import batch_writer
+    from app.quota import quota_service
+    queued = batch_writer.enqueue("ai_usage_log", data)
+    quota_service.record(user_id, queued=queued)
 
 def get_user_ai_preferences(user_id: str):
     """Get user AI preferences"""
@@ -294,10 +767,9 @@ def learn_from_interaction(user_id: str, action: str, content: str, feedback: st
         "content": content,
         "feedback": feedback
     }
-    try:
-        supabase.table("ai_learning_log").insert(data).execute()
-    except Exception as e:
-        print(f"AI learning log error: {e}")
+    # Style profiles pick the row up once the batch writer has inserted it
+    from app.batch_writer import batch_writer
+    batch_writer.enqueue("ai_learning_log", data)
 
 def create_notification(user_id: str, type: str, title: str, message: str, severity: str = "info", action_url: str = None, metadata: dict = None):
     """Create a notification for a user"""
@@ -316,24 +788,134 @@ def create_notification(user_id: str, type: str, title: str, message: str, sever
         data["metadata"] = metadata
     try:
         supabase.table("notifications").insert(data).execute()
+        user_cache.adjust([user_id], "unread", delta=1)
     except Exception as e:
         print(f"Notification creation error: {e}")
 
+NOTIFICATION_BULK_CHUNK = 200  # rows per multi-row insert (also bounds the in_() lookup URL)
+NOTIFICATION_COALESCE_WINDOW = 600  # seconds
+
+def create_notifications_bulk(recipients, type: str, title: str, message: str, severity: str = "info",
+                              action_url: str = None, metadata: dict = None, coalesce_key: str = None,
+                              coalesce_window: int = NOTIFICATION_COALESCE_WINDOW) -> dict:
+    """Create the same notification for many users with chunked multi-row inserts
+
+    recipients is a list of user ids or a selector string ("all", "plan:PRO",
+    "provider:jira"; see iter_selected_user_ids). With a coalesce_key, users who
+    already got a notification of this type with the same key within
+    coalesce_window seconds are skipped.
+    """
+    result = {"created": 0, "coalesced": 0}
+    if not supabase: return result
+    user_ids = iter_selected_user_ids(recipients) if isinstance(recipients, str) else recipients
+    metadata = dict(metadata or {})
+    if coalesce_key:
+        metadata["coalesce_key"] = coalesce_key
+
+    seen = set()
+    chunk = []
+    for user_id in user_ids:
+        if user_id and user_id not in seen:
+            seen.add(user_id)
+            chunk.append(user_id)
+        if len(chunk) >= NOTIFICATION_BULK_CHUNK:
+            _insert_notification_chunk(chunk, type, title, message, severity, action_url, metadata, coalesce_key, coalesce_window, result)
+            chunk = []
+    if chunk:
+        _insert_notification_chunk(chunk, type, title, message, severity, action_url, metadata, coalesce_key, coalesce_window, result)
+    return result
+
+def _insert_notification_chunk(user_ids: list, type: str, title: str, message: str, severity: str, action_url: str,
+                               metadata: dict, coalesce_key: str, coalesce_window: int, result: dict):
+    if coalesce_key:
+        since = (datetime.utcnow() - timedelta(seconds=coalesce_window)).isoformat()
+        recent = supabase.table("notifications").select("user_id").in_("user_id", user_ids).eq("type", type).eq(
+            "metadata->>coalesce_key", coalesce_key).gte("created_at", since).execute().data or []
+        already = {row["user_id"] for row in recent}
+        result["coalesced"] += len(already)
+        user_ids = [u for u in user_ids if u not in already]
+        if not user_ids:
+            return
+    rows = [{
+        "user_id": user_id,
+        "type": type,
+        "title": title,
+        "message": message,
+        "severity": severity,
+        "read": False,
+        "action_url": action_url,
+        "metadata": metadata,
+    } for user_id in user_ids]
+    supabase.table("notifications").insert(rows).execute()
+    user_cache.adjust(user_ids, "unread", delta=1)
+    result["created"] += len(rows)
+
+def iter_selected_user_ids(selector: str, page_size: int = 1000):
+    """Resolve a recipient selector to user ids, paging by user_id
+
+    "all" - every account; "plan:<PLAN>" - accounts on a plan;
+    "provider:<name>" - accounts with that integration connected.
+    """
+    kind, _, value = selector.partition(":")
+    if kind == "all":
+        build = lambda: supabase.table("user_settings").select("user_id")
+    elif kind == "plan" and value:
+        build = lambda: supabase.table("user_settings").select("user_id").eq("plan", value)
+    elif kind == "provider" and value:
+        build = lambda: supabase.table("user_integrations").select("user_id").eq("provider", value)
+    else:
+        raise ValueError(f"Unknown recipient selector: {selector}")
+    last = None
+    while True:
+        query = build()
+        if last is not None:
+            query = query.gt("user_id", last)
+        rows = query.order("user_id").limit(page_size).execute().data or []
+        for row in rows:
+            yield row["user_id"]
+        if len(rows) < page_size: return
+        last = rows[-1]["user_id"]
+
 def get_notifications(user_id: str, unread_only: bool = False, limit: int = 50):
     """Get notifications for a user"""
     if not supabase: return []
     try:
-        query = supabase.table("notifications").select("*").eq("user_id", user_id)
+        query = supabase.table("notifications").select(NOTIFICATION_COLUMNS).eq("user_id", user_id)
         if unread_only:
             query = query.eq("read", False)
         return query.order("created_at", desc=True).limit(limit).execute().data
     except: return []
 
-def mark_notification_read(notification_id: str):
-    """Mark a notification as read"""
+def _notifications_query(user_id: str, unread_only: bool = False):
+    query = supabase.table("notifications").select(NOTIFICATION_COLUMNS).eq("user_id", user_id)
+    if unread_only:
+        query = query.eq("read", False)
+    return query
+
+def get_notifications_page(user_id: str, unread_only: bool = False, limit: int = 50, cursor: str = None):
+    """Notifications page via keyset pagination. Returns (notifications, next_cursor)"""
+    if not supabase: return [], None
+    try:
+        return _keyset_page(_notifications_query(user_id, unread_only), limit, cursor)
+    except ValueError:
+        raise
+    except: return [], None
+
+def iter_notifications(user_id: str, unread_only: bool = False):
+    """Stream all of a user's notifications"""
+    if not supabase: return iter(())
+    return _iter_keyset(lambda: _notifications_query(user_id, unread_only))
+
+def mark_notification_read(notification_id: str, user_id: str = None):
+    """Mark a notification as read (scoped to user_id when given)"""
     if not supabase: return
     try:
-        supabase.table("notifications").update({"read": True}).eq("id", notification_id).execute()
+        query = supabase.table("notifications").update({"read": True}).eq("id", notification_id)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        query.execute()
+        if user_id:
+            user_cache.invalidate(user_id, "unread")
     except Exception as e:
         print(f"Mark notification read error: {e}")
 
@@ -342,6 +924,7 @@ def mark_all_notifications_read(user_id: str):
     if not supabase: return
     try:
         supabase.table("notifications").update({"read": True}).eq("user_id", user_id).eq("read", False).execute()
+        user_cache.adjust([user_id], "unread", value=0)
     except Exception as e:
         print(f"Mark all notifications read error: {e}")
 
@@ -349,6 +932,50 @@ def get_unread_count(user_id: str) -> int:
     """Get count of unread notifications"""
     if not supabase: return 0
     try:
-        result = supabase.table("notifications").select("id", count="exact").eq("user_id", user_id).eq("read", False).execute()
-        return result.count if hasattr(result, 'count') else 0
-    except: return 0
\ No newline at end of file
+        return user_cache.get_or_load(user_id, "unread", lambda: _count_unread(user_id))
+    except: return 0
+
+def _count_unread(user_id: str) -> int:
+    result = supabase.table("notifications").select("id", count="exact").eq("user_id", user_id).eq("read", False).limit(1).execute()
+    return result.count if hasattr(result, 'count') else 0
+
+# --- Account purge ---
+
+# Children before parents so foreign keys never block a step; the account rows go last
+PURGE_TABLES = [
+    "post_analytics", "task_cards", "competitor_posts", "competitors", "ai_training",
+    "ai_usage_log", "ai_learning_log", "notifications", "webhook_retries",
+    "payment_notifications", "payment_events", "user_integrations", "ai_preferences", "user_settings", "user_accounts"
+]
+PURGE_CHUNK_SIZE = 5000
+PURGE_DELETE_CHUNK = 200  # ids per in_() delete in the client-side fallback (bounds the URL)
+_PURGE_BY_USER_ID = {"ai_preferences", "user_settings"}  # keyed by user_id, at most one row
+
+def purge_user_data_step(user_id: str, chunk: int = PURGE_CHUNK_SIZE) -> dict:
+    """Delete the next chunk of a user's rows in one transaction
+
+    Returns {"table", "deleted", "done"}. Uses the purge_user_data_step SQL
+    function; falls back to client-side chunked deletes if it isn't installed.
+    """
+    if not supabase: return {"table": None, "deleted": 0, "done": True}
+    try:
+        res = supabase.rpc("purge_user_data_step", {"p_user_id": user_id, "p_chunk": chunk}).execute()
+        row = res.data[0] if isinstance(res.data, list) else res.data
+        return {"table": row.get("table_name"), "deleted": row.get("deleted", 0), "done": row.get("done", False)}
+    except Exception as e:
+        if getattr(e, "code", None) != "PGRST202":  # function not found
+            raise
+        print("purge_user_data_step not installed, purging client-side")
+    for table in PURGE_TABLES:
+        if table in _PURGE_BY_USER_ID:
+            deleted = supabase.table(table).delete().eq("user_id", user_id).execute().data or []
+            if deleted:
+                return {"table": table, "deleted": len(deleted), "done": False}
+            continue
+        key = _ROW_KEYS.get(table, "id")
+        ids = [r[key] for r in supabase.table(table).select(key).eq("user_id", user_id).limit(chunk).execute().data or []]
+        if ids:
+            for i in range(0, len(ids), PURGE_DELETE_CHUNK):
+                supabase.table(table).delete().in_(key, ids[i:i + PURGE_DELETE_CHUNK]).execute()
+            return {"table": table, "deleted": len(ids), "done": False}
+    return {"table": None, "deleted": 0, "done": True}
@@ -0,0 +1,235 @@
+"""
+Streaming GDPR data export
+
+Every user-owned table is paged concurrently (keyset pages off the event
+loop) into one bounded queue, so memory use stays flat however large the
+account is. The rows are either streamed to the client as NDJSON or written
+into a zip of per-table JSON files on disk for later download. Zips that
+are not picked up within EXPORT_DOWNLOAD_TTL are deleted.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import datetime
+
+from app.jobs import JOB_RESULT_TTL
+
+logger = logging.getLogger("CovalynceExport")
+
+EXPORT_PAGE_SIZE = 500  # rows per DB page
+EXPORT_QUEUE_SIZE = 1000  # rows buffered between producers and the writer
+EXPORT_CONCURRENCY = 4  # tables paged at once
+EXPORT_DIR = os.getenv("EXPORT_DIR") or tempfile.gettempdir()
+EXPORT_DOWNLOAD_TTL = JOB_RESULT_TTL  # seconds a zip waits for pickup; its link goes away with the job anyway
+EXPORT_SWEEP_INTERVAL = 300  # seconds between deletions of expired zips
+_EXPORT_PREFIX = "covalynce_export_"
+
+# Razorpay webhook fields that identify the card, token or merchant account rather than the user
+_PAYMENT_EVENT_MASKED = tuple(
+    f"payload.payload.payment.entity.{field}" for field in ("card", "card_id", "token_id", "acquirer_data")
+) + ("payload.account_id",)
+
+# (export name, table, columns, masked columns or dotted paths into JSON columns, keyset column or None for small unpaged tables)
+EXPORT_TABLES = (
+    ("profile", "user_settings", "*", ("openai_key",), None),
+    ("integrations", "user_integrations", "id, provider, permissions, consent_given, consent_timestamp, metadata, created_at", (), "created_at"),
+    ("cards", "task_cards", "*", (), "created_at"),
+    ("scheduled_posts", "scheduled_posts", "*", (), "created_at"),
+    ("analytics", "post_analytics", "*", (), "created_at"),
+    ("competitors", "competitors", "*", (), "created_at"),
+    ("competitor_posts", "competitor_posts", "*", (), "fetched_at"),
+    ("competitor_snapshots", "competitor_post_snapshots", "*", (), "captured_at"),
+    ("ai_training", "ai_training", "*", (), "created_at"),
+    ("ai_preferences", "ai_preferences", "*", (), None),
+    ("ai_usage", "ai_usage_log", "*", (), "created_at"),
+    ("ai_learning", "ai_learning_log", "*", (), "created_at"),
+    ("notifications", "notifications", "*", (), "created_at"),
+    ("payments", "payment_notifications", "*", (), "created_at"),
+    ("payment_events", "payment_events", "event_id, event_type, status, payload, received_at, processed_at",
+     _PAYMENT_EVENT_MASKED, "received_at"),
+)
+
+_DONE = object()
+
+
+def _fetch_all(table: str, user_id: str, columns: str) -> list:
+    """Unpaged fetch for small tables (at most a row or two per user)"""
+    from app.database import supabase
+    if not supabase:
+        return []
+    return supabase.table(table).select(columns).eq("user_id", user_id).execute().data or []
+
+
+def _mask(row: dict, path: str):
+    """Blank one exported value: top-level columns are stored encrypted, nested JSON fields are redacted"""
+    *parents, leaf = path.split(".")
+    target = row
+    for key in parents:
+        target = target.get(key) if isinstance(target, dict) else None
+    if isinstance(target, dict) and target.get(leaf):
+        target[leaf] = "[REDACTED]" if parents else "[ENCRYPTED]"
+
+
+async def _produce(user_id: str, spec: tuple, out: asyncio.Queue, limit: asyncio.Semaphore):
+    from app.database import get_user_rows_page
+    name, table, columns, masked, order_column = spec
+    try:
+        async with limit:
+            cursor = None
+            while True:
+                if order_column:
+                    rows, cursor = await asyncio.to_thread(
+                        get_user_rows_page, table, user_id, columns, EXPORT_PAGE_SIZE, cursor, order_column
+                    )
+                else:
+                    rows = await asyncio.to_thread(_fetch_all, table, user_id, columns)
+                for row in rows:
+                    for path in masked:
+                        _mask(row, path)
+                    await out.put((name, row))
+                if not cursor:
+                    break
+    except Exception as e:
+        logger.error(f"Export of {table} failed for {user_id}: {e}")
+        await out.put((name, {"_export_error": str(e)}))
+    finally:
+        await out.put((name, _DONE))
+
+
+async def iter_export_rows(user_id: str):
+    """Yield (export name, row) for every exported row, tables interleaved"""
+    out: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    limit = asyncio.Semaphore(EXPORT_CONCURRENCY)
+    producers = [asyncio.create_task(_produce(user_id, spec, out, limit)) for spec in EXPORT_TABLES]
+    remaining = len(producers)
+    try:
+        while remaining:
+            name, row = await out.get()
+            if row is _DONE:
+                remaining -= 1
+                continue
+            yield name, row
+    finally:
+        for task in producers:
+            task.cancel()
+
+
+def _manifest(user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "exported_at": datetime.utcnow().isoformat(),
+        "tables": [spec[0] for spec in EXPORT_TABLES],
+    }
+
+
+async def stream_ndjson(user_id: str):
+    """NDJSON export: a manifest line, then one {"table", "row"} line per row"""
+    yield json.dumps(_manifest(user_id)) + "\n"
+    async for name, row in iter_export_rows(user_id):
+        yield json.dumps({"table": name, "row": row}, default=str) + "\n"
+
+
+async def write_zip(user_id: str) -> str:
+    """Write a zip of per-table JSON arrays to EXPORT_DIR and return its path"""
+    parts = {spec[0]: tempfile.TemporaryFile() for spec in EXPORT_TABLES}
+    written = dict.fromkeys(parts, 0)
+    try:
+        # Rows go straight to per-table spool files as they arrive
+        for part in parts.values():
+            part.write(b"[")
+        async for name, row in iter_export_rows(user_id):
+            parts[name].write((("," if written[name] else "") + json.dumps(row, default=str)).encode())
+            written[name] += 1
+        for part in parts.values():
+            part.write(b"]")
+        return await asyncio.to_thread(_assemble_zip, user_id, parts)
+    finally:
+        for part in parts.values():
+            part.close()
+
+
+def _assemble_zip(user_id: str, parts: dict) -> str:
+    fd, path = tempfile.mkstemp(prefix=_EXPORT_PREFIX, suffix=".zip", dir=EXPORT_DIR)
+    os.close(fd)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("manifest.json", json.dumps(_manifest(user_id)))
+        for name, part in parts.items():
+            part.seek(0)
+            with zf.open(f"{name}.json", "w") as entry:
+                shutil.copyfileobj(part, entry)
+    return path
+
+
+# Finished zip exports waiting for pickup: token -> (user_id, path, expires_at)
+_downloads: dict[str, tuple] = {}
+
+
+def register_download(user_id: str, path: str) -> str:
+    token = uuid.uuid4().hex
+    _downloads[token] = (user_id, path, time.time() + EXPORT_DOWNLOAD_TTL)
+    return token
+
+
+def pop_download(token: str, user_id: str) -> str | None:
+    """Claim a finished export file; each one can be downloaded once"""
+    entry = _downloads.get(token)
+    if not entry or entry[0] != user_id:
+        return None
+    del _downloads[token]
+    if entry[2] <= time.time():
+        _remove(entry[1])
+        return None
+    return entry[1] if os.path.exists(entry[1]) else None
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def expire_downloads(now: float = None) -> int:
+    """Delete zips past their pickup window, including ones orphaned by a restart; returns how many"""
+    now = now or time.time()
+    removed = 0
+    for token, (_, path, expires_at) in list(_downloads.items()):
+        if expires_at <= now:
+            del _downloads[token]
+            removed += _remove(path)
+    waiting = {entry[1] for entry in _downloads.values()}
+    for entry in os.scandir(EXPORT_DIR):
+        if not (entry.name.startswith(_EXPORT_PREFIX) and entry.name.endswith(".zip")) or entry.path in waiting:
+            continue
+        try:
+            expired = entry.stat().st_mtime <= now - EXPORT_DOWNLOAD_TTL
+        except FileNotFoundError:
+            continue
+        if expired:
+            removed += _remove(entry.path)
+    return removed
+
+
+async def expire_downloads_loop():
+    """Background task that deletes export zips nobody picked up"""
+    while True:
+        try:
+            removed = await asyncio.to_thread(expire_downloads)
+            if removed:
+                logger.info(f"Deleted {removed} expired export files")
+        except Exception as e:
+            logger.error(f"Export cleanup error: {e}")
+        await asyncio.sleep(EXPORT_SWEEP_INTERVAL)
+
+
+async def export_job(user_id: str, payload: dict) -> dict:
+    """Job handler: build the zip export in the background for later pickup"""
+    token = register_download(user_id, await write_zip(user_id))
+    return {"export_id": token, "download_url": f"/user/data/export/download/{token}"}
@@ -0,0 +1,270 @@
+"""
+Generated images: prompt dedup, local content-addressed cache and derivatives
+
+image_store.generate() is what /image/generate and the image_generate job
+call:
+
+- identical prompts are deduplicated: a prompt that was generated before
+  is answered from the local cache without calling the provider, and
+  concurrent requests for the same prompt share one provider call;
+- the provider's result is returned (and put on the card) right away, then
+  downloaded in the background into IMAGE_DIR, named by the SHA-256 of its
+  bytes, so identical images are stored once whatever prompt made them;
+- thumbnails and platform sizes (WebP, plus AVIF thumbnails where Pillow
+  supports it) are rendered in a process pool, off the event loop, and
+  served from /images.
+
+IMAGE_DIR is local to one instance and may not survive a redeploy, so the
+database only ever stores the provider's URL; the local copies are offered
+in responses, and only when IMAGE_BASE_URL says where this API is reachable.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import httpx
+from fastapi import HTTPException
+
+from app.database import update_card_image
+
+logger = logging.getLogger("CovalynceImages")
+
+NANO_BANANA_API_KEY = os.getenv("NANO_BANANA_API_KEY")
+IMAGE_API_URL = "https://api.nanobanana.ai/v1/generate"  # Placeholder URL
+IMAGE_MODEL = "stable-diffusion-xl"
+IMAGE_SIZE = 1024
+
+IMAGE_DIR = os.getenv("IMAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "covalynce_images")
+IMAGE_BASE_URL = (os.getenv("IMAGE_BASE_URL") or "").rstrip("/")  # public URL of this API; unset: no local URLs
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))  # processes rendering derivatives
+IMAGE_GENERATE_TIMEOUT = 60.0
+IMAGE_DOWNLOAD_TIMEOUT = 30.0
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+# variant -> (width, height, crop to fill); thumbnails keep their aspect ratio
+IMAGE_VARIANTS = {
+    "thumb": (320, 320, False),
+    "linkedin": (1200, 627, True),
+    "x": (1600, 900, True),
+    "instagram": (1080, 1080, True),
+}
+
+_FILE_NAME = re.compile(r"^[0-9a-f]{64}(_[a-z]+)?\.(png|jpg|webp|gif|avif)$")
+_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "GIF": "gif"}
+
+
+def image_url(name: str) -> str:
+    """Public URL of a cached file; check IMAGE_BASE_URL is set before handing these out"""
+    if not IMAGE_BASE_URL:
+        raise HTTPException(status_code=503, detail="Image hosting not configured (IMAGE_BASE_URL)")
+    return f"{IMAGE_BASE_URL}/images/{name}"
+
+
+def render_variants(source_path: str, digest: str, out_dir: str) -> dict:
+    """
+    Validate a downloaded image, move it into the cache and render its variants.
+    Runs in a worker process; returns {"original": name, "variants": {variant: name}}.
+    """
+    from PIL import Image, ImageOps, features
+
+    with Image.open(source_path) as img:
+        ext = _EXTENSIONS.get(img.format)
+        if ext is None:
+            raise ValueError(f"Unsupported image format: {img.format}")
+        img.load()
+        original = f"{digest}.{ext}"
+        os.replace(source_path, os.path.join(out_dir, original))
+
+        base = ImageOps.exif_transpose(img).convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        variants = {}
+        for name, (width, height, crop) in IMAGE_VARIANTS.items():
+            if crop:
+                resized = ImageOps.fit(base, (width, height), Image.LANCZOS)
+            else:
+                resized = base.copy()
+                resized.thumbnail((width, height), Image.LANCZOS)
+            formats = [("webp", "WEBP")]
+            if name == "thumb" and features.check("avif"):
+                formats.append(("avif", "AVIF"))
+            for ext, fmt in formats:
+                file_name = f"{digest}_{name}.{ext}"
+                path = os.path.join(out_dir, file_name)
+                if not os.path.exists(path):
+                    tmp = f"{path}.{os.getpid()}.tmp"
+                    resized.save(tmp, fmt, quality=82)
+                    os.replace(tmp, path)
+                variants[name if ext == "webp" else f"{name}_{ext}"] = file_name
+    return {"original": original, "variants": variants}
+
+
+class ImageStore:
+    """Deduplicated generation with a local content-addressed cache"""
+
+    def __init__(self, root: str = IMAGE_DIR, workers: int = IMAGE_WORKERS):
+        self.root = root
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._inflight: dict[str, asyncio.Task] = {}  # prompt key -> provider call
+        self._ingests: dict[str, asyncio.Task] = {}  # prompt key -> download + render
+
+    @staticmethod
+    def prompt_key(prompt: str) -> str:
+        normalized = " ".join(prompt.split()).lower()
+        return hashlib.sha256(f"{IMAGE_MODEL}|{IMAGE_SIZE}|{normalized}".encode()).hexdigest()
+
+    def path_for(self, name: str) -> str | None:
+        """Filesystem path of a cached file, or None for names that are not cache entries"""
+        if not _FILE_NAME.match(name):
+            return None
+        path = os.path.join(self.root, name)
+        return path if os.path.exists(path) else None
+
+    async def stop(self):
+        tasks = list(self._ingests.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def generate(self, prompt: str, card_id: str = None) -> dict:
+        """Image for a prompt: from the cache if this prompt was generated before, else from the provider"""
+        key = self.prompt_key(prompt)
+        record = await asyncio.to_thread(self._read_record, key)
+        if record:
+            if card_id:
+                await asyncio.to_thread(update_card_image, card_id, record["source_url"], True)
+            return self._public(record, prompt)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._call_provider(prompt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        source_url = await asyncio.shield(task)
+
+        if card_id:
+            await asyncio.to_thread(update_card_image, card_id, source_url, True)
+        if key not in self._ingests:
+            ingest = asyncio.create_task(self._ingest(key, source_url))
+            self._ingests[key] = ingest
+            ingest.add_done_callback(lambda _: self._ingests.pop(key, None))
+        return {"image_url": source_url, "prompt": prompt, "cached": False, "variants": {}}
+
+    async def _call_provider(self, prompt: str) -> str:
+        if not NANO_BANANA_API_KEY:
+            raise HTTPException(status_code=500, detail="Image generation not configured")
+        headers = {"Authorization": f"Bearer {NANO_BANANA_API_KEY}", "Content-Type": "application/json"}
+        data = {"prompt": prompt, "width": IMAGE_SIZE, "height": IMAGE_SIZE, "model": IMAGE_MODEL}
+        try:
+            async with httpx.AsyncClient(timeout=IMAGE_GENERATE_TIMEOUT) as http:
+                resp = await http.post(IMAGE_API_URL, json=data, headers=headers)
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail="Image generation timeout")
+        except httpx.HTTPError as e:
+            logger.error(f"Image generation error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        if resp.status_code != 200:
+            raise HTTPException(status_code=resp.status_code, detail="Image generation failed")
+        result = resp.json()
+        source_url = result.get("image_url") or result.get("url")
+        if not source_url:
+            raise HTTPException(status_code=502, detail="Image provider returned no image")
+        return source_url
+
+    async def _ingest(self, key: str, source_url: str):
+        """Download the provider's image into the cache and render its variants"""
+        try:
+            os.makedirs(os.path.join(self.root, "prompts"), exist_ok=True)
+            tmp_path, digest = await self._download(source_url)
+            try:
+                rendered = await self._render(tmp_path, digest)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            record = {"digest": digest, "source_url": source_url, "created_at": time.time(), **rendered}
+            await asyncio.to_thread(self._write_record, key, record)
+            logger.info(f"Cached generated image {digest[:12]} with {len(rendered['variants'])} variants")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The next request for this prompt tries again
+            logger.error(f"Image cache error for {source_url}: {e}")
+
+    async def _download(self, url: str) -> tuple:
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(prefix="download_", suffix=".tmp", dir=self.root)
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                async with httpx.AsyncClient(timeout=IMAGE_DOWNLOAD_TIMEOUT, follow_redirects=True) as http:
+                    async with http.stream("GET", url) as resp:
+                        resp.raise_for_status()
+                        async for chunk in resp.aiter_bytes():
+                            size += len(chunk)
+                            if size > IMAGE_MAX_BYTES:
+                                raise ValueError(f"Image larger than {IMAGE_MAX_BYTES} bytes")
+                            digest.update(chunk)
+                            out.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest()
+
+    async def _render(self, tmp_path: str, digest: str) -> dict:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor(), render_variants, tmp_path, digest, self.root)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory on a huge image): start a fresh pool next time
+            self._pool = None
+            raise
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the server process has threads and an event loop
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _record_path(self, key: str) -> str:
+        return os.path.join(self.root, "prompts", f"{key}.json")
+
+    def _read_record(self, key: str) -> dict | None:
+        try:
+            with open(self._record_path(key)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # The files may have been cleaned up since; treat that as a miss
+        return record if self.path_for(record.get("original", "")) else None
+
+    def _write_record(self, key: str, record: dict):
+        path = self._record_path(key)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _public(record: dict, prompt: str) -> dict:
+        if not IMAGE_BASE_URL:
+            # Nowhere to serve the local copies from: fall back to the provider's URL
+            return {"image_url": record["source_url"], "prompt": prompt, "cached": True, "variants": {}}
+        return {
+            "image_url": image_url(record["original"]),
+            "prompt": prompt,
+            "cached": True,
+            "variants": {name: image_url(file_name) for name, file_name in record["variants"].items()},
+        }
+
+
+image_store = ImageStore()
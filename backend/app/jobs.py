@@ -0,0 +1,213 @@
+"""
+Background AI job queue
+
+Long-running generations (image generation, multi-source combining) are
+submitted as jobs and run on a bounded pool of asyncio workers instead of
+holding an HTTP worker open for the whole provider call. Clients poll the job
+for its result, or ask for a completion callback and/or an in-app
+notification.
+
+Jobs are kept in process memory. Scheduling is round-robin across users, so
+one user queuing many jobs cannot starve everybody else.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import httpx
+from fastapi import HTTPException
+
+from app.outbound import UnsafeURLError, check_public_url
+
+logger = logging.getLogger("CovalynceJobs")
+
+JOB_WORKERS = 4  # concurrent jobs per process
+JOB_MAX_PENDING_PER_USER = 10  # queued + running jobs allowed per user
+JOB_RESULT_TTL = 3600  # seconds finished jobs stay pollable
+
+JOB_PENDING = "PENDING"
+JOB_RUNNING = "RUNNING"
+JOB_COMPLETED = "COMPLETED"
+JOB_FAILED = "FAILED"
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar("current_job", default=None)
+
+
+def report_progress(progress: dict):
+    """Publish progress for the job running in the current task (no-op outside a job)"""
+    job = _current_job.get()
+    if job is not None:
+        job["progress"] = progress
+
+
+class JobQueue:
+    """In-memory job store with a fair, bounded worker pool"""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_pending_per_user: int = JOB_MAX_PENDING_PER_USER,
+                 result_ttl: int = JOB_RESULT_TTL):
+        self.workers = workers
+        self.max_pending_per_user = max_pending_per_user
+        self.result_ttl = result_ttl
+        self._handlers: dict = {}
+        self._internal: set = set()  # job types only the backend itself may submit
+        self._jobs: dict[str, dict] = {}
+        self._user_queues: dict[str, deque] = {}
+        self._ready_users: deque = deque()  # round-robin order of users with queued jobs
+        self._active: dict[str, int] = {}  # queued + running jobs per user
+        self._wakeup: asyncio.Queue | None = None
+        self._tasks: list = []
+
+    def register(self, job_type: str, handler, internal: bool = False):
+        """Register an async handler(user_id, payload) -> dict for a job type
+
+        Internal job types (account export/purge) are queued by their own
+        rate-limited endpoints and can't be submitted through /jobs.
+        """
+        self._handlers[job_type] = handler
+        if internal:
+            self._internal.add(job_type)
+
+    @property
+    def job_types(self) -> list:
+        """Job types clients may submit"""
+        return sorted(t for t in self._handlers if t not in self._internal)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        # Jobs submitted before start() still need a wakeup each
+        for _ in range(sum(len(q) for q in self._user_queues.values())):
+            self._wakeup.put_nowait(None)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, user_id: str, job_type: str, payload: dict, callback_url: str = None, notify: bool = False) -> dict:
+        """Queue a job and return its public view"""
+        if job_type not in self._handlers:
+            raise HTTPException(status_code=400, detail=f"Unknown job type: {job_type}")
+        if self._active.get(user_id, 0) >= self.max_pending_per_user:
+            raise HTTPException(status_code=429, detail="Too many pending jobs")
+
+        self._prune()
+        job = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "type": job_type,
+            "payload": payload,
+            "callback_url": callback_url,
+            "notify": notify,
+            "status": JOB_PENDING,
+            "result": None,
+            "error": None,
+            "progress": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "_finished": None,
+        }
+        self._jobs[job["id"]] = job
+        self._active[user_id] = self._active.get(user_id, 0) + 1
+
+        user_queue = self._user_queues.setdefault(user_id, deque())
+        if not user_queue:
+            self._ready_users.append(user_id)
+        user_queue.append(job["id"])
+        if self._wakeup:
+            self._wakeup.put_nowait(None)
+        return self.view(job)
+
+    def get(self, job_id: str, user_id: str) -> dict | None:
+        job = self._jobs.get(job_id)
+        if not job or job["user_id"] != user_id:
+            return None
+        return self.view(job)
+
+    @staticmethod
+    def view(job: dict) -> dict:
+        return {k: v for k, v in job.items() if k not in ("payload", "callback_url", "_finished")}
+
+    def _next_job(self) -> dict | None:
+        while self._ready_users:
+            user_id = self._ready_users.popleft()
+            user_queue = self._user_queues.get(user_id)
+            if not user_queue:
+                continue
+            job_id = user_queue.popleft()
+            if user_queue:
+                self._ready_users.append(user_id)
+            else:
+                del self._user_queues[user_id]
+            return self._jobs.get(job_id)
+        return None
+
+    async def _worker(self, index: int):
+        while True:
+            await self._wakeup.get()
+            job = self._next_job()
+            if job:
+                await self._run(job)
+
+    async def _run(self, job: dict):
+        job["status"] = JOB_RUNNING
+        job["started_at"] = datetime.utcnow().isoformat()
+        _current_job.set(job)
+        try:
+            job["result"] = await self._handlers[job["type"]](job["user_id"], job["payload"])
+            job["status"] = JOB_COMPLETED
+        except HTTPException as e:
+            job["status"], job["error"] = JOB_FAILED, e.detail
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['type']}) failed: {e}")
+            job["status"], job["error"] = JOB_FAILED, str(e)
+        finally:
+            job["finished_at"] = datetime.utcnow().isoformat()
+            job["_finished"] = time.monotonic()
+            self._active[job["user_id"]] = max(0, self._active.get(job["user_id"], 1) - 1)
+        await self._complete(job)
+
+    async def _complete(self, job: dict):
+        from app.database import create_notification, add_webhook_retry
+        if job["notify"]:
+            succeeded = job["status"] == JOB_COMPLETED
+            create_notification(
+                job["user_id"],
+                "job_completed" if succeeded else "job_failed",
+                "Generation Ready" if succeeded else "Generation Failed",
+                f"Your {job['type'].replace('_', ' ')} job has finished." if succeeded else f"Your {job['type'].replace('_', ' ')} job failed: {job['error']}",
+                "success" if succeeded else "error",
+                metadata={"job_id": job["id"]}
+            )
+        if job["callback_url"]:
+            body = self.view(job)
+            try:
+                # Checked again here: the host may resolve differently than at submit time
+                await check_public_url(job["callback_url"])
+            except UnsafeURLError as e:
+                logger.warning(f"Job callback for {job['id']} not sent: {e}")
+                return
+            try:
+                async with httpx.AsyncClient() as http:
+                    resp = await http.post(job["callback_url"], json=body, timeout=10.0)
+                    resp.raise_for_status()
+            except Exception as e:
+                # Hand the callback to the webhook retry queue
+                logger.warning(f"Job callback failed for {job['id']}, added to retry queue: {e}")
+                add_webhook_retry(job["user_id"], "jobs", job["callback_url"], body)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id in [j["id"] for j in self._jobs.values() if j["_finished"] and j["_finished"] < cutoff]:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue()
@@ -0,0 +1,153 @@
+"""
+Event-loop lag and blocking-call watchdog
+
+Sync I/O inside `async def` handlers (Supabase, OpenAI, Razorpay, bcrypt)
+stalls every other request on the worker. Three pieces catch it:
+
+- a heartbeat coroutine measures how late the loop wakes it up
+  (event_loop_lag_seconds on /metrics);
+- every callback on the monitored loop is timed, and callbacks over
+  LOOP_BLOCK_THRESHOLD_MS are logged with the coroutine they ran and
+  charged to the request whose context they ran in (see
+  LOOP_BLOCK_STRICT_MS in metrics.py to fail such requests);
+- a watchdog thread grabs the loop thread's live stack while a callback is
+  still over the threshold, so the log shows the blocking call itself.
+
+Loops whose callbacks can't be wrapped (uvloop) still get the lag histogram
+and stack dumps, driven by the heartbeat going stale, but blocks are not
+attributed to requests there.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from app.metrics import LOOP_LAG, record_loop_block
+
+logger = logging.getLogger("CovalynceLoopMonitor")
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "true").lower() != "false"
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_LAG_INTERVAL = 0.25  # seconds between heartbeats
+LOOP_STACK_LIMIT = 25  # frames logged per blocked callback
+
+
+def describe_handle(handle) -> str:
+    """Name the coroutine (and where it is suspended) behind a loop callback"""
+    callback = getattr(handle, "_callback", None)
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        frame = getattr(coro, "cr_frame", None)
+        where = f" at {frame.f_code.co_filename}:{frame.f_lineno}" if frame else ""
+        return f"task {task.get_name()} ({getattr(coro, '__qualname__', coro)}){where}"
+    return repr(handle)
+
+
+class LoopMonitor:
+    """Times callbacks on one event loop and reports the ones that block it"""
+
+    def __init__(self, threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.blocks = 0
+        self._thread_id = None
+        self._current = None  # (handle, started) for the callback running right now
+        self._reported = None  # handle whose live stack was already logged
+        self._original_run = None
+        self._last_beat = 0.0
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start monitoring the running loop (call from inside it)"""
+        if self._thread_id is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._last_beat = time.perf_counter()
+        if isinstance(loop, asyncio.BaseEventLoop):
+            self._patch()
+        self._heartbeat = loop.create_task(self._beat(loop))
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(f"Event loop monitor on (threshold {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+        self._thread_id = None
+
+    def _patch(self):
+        original = self._original_run = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            if threading.get_ident() != monitor._thread_id:
+                return original(handle)
+            started = time.perf_counter()
+            monitor._current = (handle, started)
+            try:
+                return original(handle)
+            finally:
+                monitor._current = None
+                elapsed = time.perf_counter() - started
+                if elapsed >= monitor.threshold:
+                    monitor._blocked(handle, elapsed)
+
+        asyncio.events.Handle._run = _run
+
+    def _blocked(self, handle, elapsed: float):
+        self.blocks += 1
+        record_loop_block(elapsed, getattr(handle, "_context", None))
+        if self._reported is handle:
+            logger.warning(f"Event loop unblocked after {elapsed * 1000:.0f} ms: {describe_handle(handle)}")
+        else:
+            logger.warning(f"Event loop blocked for {elapsed * 1000:.0f} ms by {describe_handle(handle)}")
+        self._reported = None
+
+    async def _beat(self, loop):
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._last_beat = time.perf_counter()
+            LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+    def _watch(self):
+        """Log the loop thread's stack while a callback is stuck past the threshold"""
+        stale_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            if self._original_run is None:
+                # Unpatched loop: a heartbeat that is overdue by the threshold means a stall
+                beat = self._last_beat
+                if beat == stale_beat or time.perf_counter() - beat < self.interval + self.threshold:
+                    continue
+                stale_beat = beat
+                self._log_stack("Event loop heartbeat stalled")
+                continue
+            current = self._current
+            if not current or current[0] is self._reported:
+                continue
+            handle, started = current
+            if time.perf_counter() - started < self.threshold:
+                continue
+            self._reported = handle
+            self._log_stack(f"Event loop blocked in {describe_handle(handle)}")
+
+    def _log_stack(self, message: str):
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame, limit=LOOP_STACK_LIMIT))
+        logger.warning(f"{message} (>{self.threshold * 1000:.0f} ms); stack:\n{stack}")
+
+
+loop_monitor = LoopMonitor()
@@ -1,19 +1,19 @@
 import os
 import httpx
 import logging
-import razorpay
-import hmac
 import hashlib
+import hmac
 import json
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from fastapi import FastAPI, HTTPException, Header, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr, Field, validator
 from typing import List, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -21,17 +21,43 @@ from app.database import (
     get_user_token, save_user_token, get_cached_cards, save_card, 
     card_exists, update_card_status, get_user_openai_key, 
     save_user_settings, check_limit_reached, get_user_profile, upgrade_user_plan,
-    get_user_integrations, save_integration_with_permissions, get_integration_refresh_token,
-    update_integration_token, save_analytics, update_card_image, add_webhook_retry,
-    get_pending_webhook_retries, update_webhook_retry_status, save_payment_notification,
-    get_ai_usage_today, get_ai_usage_month, log_ai_usage, get_user_ai_preferences,
-    save_user_ai_preferences, learn_from_interaction, create_notification, get_notifications,
-    mark_notification_read, mark_all_notifications_read, get_unread_count, get_card_history
+    get_user_integrations, save_integration_with_permissions,
+    get_pending_webhook_retries, update_webhook_retry_status,
+    log_ai_usage, get_user_ai_preferences,
+    save_user_ai_preferences, learn_from_interaction, create_notification,
+    mark_notification_read, mark_all_notifications_read, get_unread_count, get_card_history,
+    get_card_history_page, iter_card_history, get_post_analytics_page, iter_post_analytics,
+    get_notifications_page, iter_notifications, purge_user_data_step,
+    update_integration_metadata, invalidate_user_integrations,
+    create_notifications_bulk, get_card, get_user_scheduled_posts, get_competitor, get_stored_competitor_posts
 )
+from app.cache import user_cache, start_invalidation_channel
+from app.providers import openai_client, warm as warm_providers, PROVIDERS_PREWARM
+from app.payments import razorpay_api, verify_webhook_signature, RazorpayError
+from app.payment_events import payment_events
+from app.publisher import publish, slack_card_message
+from app.slack_outbox import slack_outbox
+from app.images import image_store
+from app.memes import meme_renderer
+from app.trending import trending_service
+from app.competitors import competitor_crawler, COMPETITOR_FIRST_FETCH_WAIT
+from app.scheduler import post_scheduler, cancel as cancel_scheduled
+from app.tokens import token_manager, TokenRefreshError, expires_at_from
+from app.metrics import instrument, metrics_middleware, render_metrics, METRICS_TOKEN
+from app.loop_monitor import loop_monitor, LOOP_MONITOR_ENABLED
 from app.auth import (
     verify_password, get_password_hash, create_access_token, verify_token,
     get_permissions_for_provider, INTEGRATION_PERMISSIONS
 )
+from app.quota import quota_service, reconcile_quota_counters
+from app.batch_writer import batch_writer
+from app.jobs import job_queue, report_progress
+from app.outbound import UnsafeURLError, check_public_url
+from app.style_profile import style_profiles, style_prompt, refresh_style_profiles
+from app.export import stream_ndjson, write_zip, pop_download, export_job, expire_downloads_loop
+from app.prompts import (
+    MARKETING_COPY, REPHRASE, POST_EDIT, GROK_POST_EDIT, build_combine_sources_prompt
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("CovalynceSaaS")
@@ -51,16 +77,13 @@ CLIENT_ID_FACEBOOK = os.getenv("FACEBOOK_CLIENT_ID")
 CLIENT_SECRET_FACEBOOK = os.getenv("FACEBOOK_CLIENT_SECRET")
 CLIENT_ID_TWITTER = os.getenv("TWITTER_CLIENT_ID")
 CLIENT_SECRET_TWITTER = os.getenv("TWITTER_CLIENT_SECRET")
-NANO_BANANA_API_KEY = os.getenv("NANO_BANANA_API_KEY")
 GROK_API_KEY = os.getenv("GROK_API_KEY")
 XAI_API_KEY = os.getenv("XAI_API_KEY")  # xAI Grok API
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
-
-# Initialize OpenAI only if key exists, otherwise we handle it gracefully later
-client = OpenAI(api_key=GLOBAL_OPENAI_KEY) if GLOBAL_OPENAI_KEY else None
+NOTIFICATIONS_ADMIN_TOKEN = os.getenv("NOTIFICATIONS_ADMIN_TOKEN")  # guards system broadcast notifications
 
 app = FastAPI(title="Covalynce API")
 
@@ -79,6 +102,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request latency and DB/HTTP/LLM call breakdown (see /metrics)
+instrument()
+app.middleware("http")(metrics_middleware)
+
 # --- Models ---
 class TaskCard(BaseModel):
     id: str
@@ -92,6 +119,11 @@ class TaskCard(BaseModel):
     timestamp: str
     colorClass: str
 
+    @classmethod
+    def from_row(cls, r: dict) -> "TaskCard":
+        """Build straight from a CARD_SUMMARY_COLUMNS row"""
+        return cls(id=str(r['id']), source_id=r['source_id'], category=r['category'], type=r['type'], title=r['title'], subtitle=r['subtitle'], content=r['content'], tags=r['tags'], timestamp=r['created_at'], colorClass=r['color_class'])
+
 class SettingsPayload(BaseModel):
     openai_key: str
 
@@ -103,7 +135,14 @@ class AuthPayload(BaseModel):
 class ActionPayload(BaseModel):
     id: str
     content: str
-    platform: str
+    platform: str = "LINKEDIN"
+    platforms: Optional[List[str]] = None  # fan out to several platforms at once
+
+class SchedulePayload(BaseModel):
+    id: str
+    content: str
+    platforms: List[str] = Field(default_factory=lambda: ["LINKEDIN"], min_length=1)
+    publish_at: datetime  # naive values are taken as UTC
 
 class SlackNotifyPayload(BaseModel):
     card_id: str
@@ -190,6 +229,24 @@ class WebhookPayload(BaseModel):
     event: str
     payload: dict
 
+class JobSubmitPayload(BaseModel):
+    type: str  # image_generate, combine_sources
+    payload: dict
+    callback_url: Optional[str] = None
+    notify: bool = False
+
+class BulkNotificationPayload(BaseModel):
+    user_ids: Optional[List[str]] = None
+    selector: Optional[str] = None  # all, plan:<PLAN>, provider:<name>
+    type: str
+    title: str
+    message: str
+    severity: str = "info"
+    action_url: Optional[str] = None
+    metadata: Optional[dict] = None
+    coalesce_key: Optional[str] = None
+    coalesce_window: int = Field(600, ge=0, le=86400)
+
 # --- AI ENGINE ---
 def run_ai_agent(user_id: str, system_prompt: str, user_content: str):
     user_key = get_user_openai_key(user_id)
@@ -200,7 +257,7 @@ def run_ai_agent(user_id: str, system_prompt: str, user_content: str):
         return "AI Not Configured (Add Key in Settings)"
     
     # Create a temporary client for this request
-    temp_client = OpenAI(api_key=key_to_use)
+    temp_client = openai_client(key_to_use)
     try:
         response = temp_client.chat.completions.create(
             model="gpt-4o-mini",
@@ -212,14 +269,13 @@ def run_ai_agent(user_id: str, system_prompt: str, user_content: str):
         return f"AI Error: {str(e)}"
 
 def generate_marketing_copy(repo_name: str, commit_msg: str) -> str:
-    if not client: 
+    if not GLOBAL_OPENAI_KEY: 
         return f"Updates to {repo_name}: {commit_msg}"
         
-    prompt = f"Write a professional LinkedIn post about code pushed to '{repo_name}' with message: '{commit_msg}'. Under 200 chars. Use 'We'."
     try:
-        response = client.chat.completions.create(
+        response = openai_client(GLOBAL_OPENAI_KEY).chat.completions.create(
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+            messages=MARKETING_COPY.render("gpt-4o-mini", repo_name=repo_name, commit_msg=commit_msg),
             max_tokens=150
         )
         return response.choices[0].message.content.strip()
@@ -231,12 +287,73 @@ def generate_marketing_copy(repo_name: str, commit_msg: str) -> str:
 @app.on_event("startup")
 async def startup_event():
     logger.info("🚀 COVALYNCE PLATFORM ENGINE ONLINE")
+    # Watch for sync calls stalling the event loop
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
     # Start background webhook retry task
     asyncio.create_task(process_webhook_retries())
+    # Keep in-memory AI quota counters reconciled with ai_usage_log
+    asyncio.create_task(reconcile_quota_counters())
+    # Start the write-behind buffer for telemetry inserts
+    batch_writer.start()
+    # Worker pool for queued AI jobs
+    job_queue.start()
+    # Ordered, deduplicated processing of recorded Razorpay webhook events
+    payment_events.start()
+    # Dispatcher for posts scheduled for later
+    post_scheduler.start()
+    # Meme templates decoded in warm render workers before the first edit (else on first use)
+    if PROVIDERS_PREWARM:
+        meme_renderer.start()
+    # Poll trending-topic sources into the per-location index
+    trending_service.start()
+    # Incremental crawling of tracked competitors' posts
+    competitor_crawler.start()
+    # Refresh OAuth tokens ahead of expiry
+    token_manager.start()
+    # Compact learning/training rows into cached style profiles
+    asyncio.create_task(refresh_style_profiles())
+    # Delete zip exports that were never downloaded
+    asyncio.create_task(expire_downloads_loop())
+    # Broadcast settings/integration cache invalidations to other workers (if configured)
+    start_invalidation_channel()
+    # Provider SDKs are imported lazily; load them now that we're serving, off the loop
+    if PROVIDERS_PREWARM:
+        asyncio.create_task(asyncio.to_thread(warm_providers))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    loop_monitor.stop()
+    await job_queue.stop()
+    await payment_events.stop()
+    await post_scheduler.stop()
+    await token_manager.stop()
+    # Flush queued Slack messages; undelivered ones go to webhook_retries
+    await slack_outbox.stop()
+    await image_store.stop()
+    await meme_renderer.stop()
+    await trending_service.stop()
+    await competitor_crawler.stop()
+    await razorpay_api.aclose()
+    # Drain queued telemetry rows before the worker exits
+    await asyncio.to_thread(batch_writer.close)
 
 @app.get("/")
 def read_root(): return {"status": "online", "mode": "SAAS PRO"}
 
+@app.get("/metrics")
+async def metrics(request: Request, authorization: str = Header(None)):
+    """Prometheus text exposition of request, DB, HTTP and LLM latency histograms
+
+    Needs the METRICS_TOKEN bearer token; without one configured only localhost can scrape.
+    """
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401)
+    elif not request.client or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/user/profile")
 async def get_profile(x_user_id: str = Header(None)):
     if not x_user_id: raise HTTPException(status_code=401)
@@ -249,15 +366,9 @@ async def create_order(request: Request, payload: PaymentOrder, x_user_id: str =
         raise HTTPException(status_code=401)
     if not RAZORPAY_KEY_ID: 
         raise HTTPException(status_code=500, detail="Razorpay Config Missing")
-    client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-    data = { 
-        "amount": payload.amount, 
-        "currency": payload.currency, 
-        "receipt": f"receipt_{x_user_id}_{datetime.utcnow().timestamp()}" 
-    }
+    receipt = f"receipt_{x_user_id}_{datetime.utcnow().timestamp()}"
     try:
-        order = client.order.create(data=data)
-        return order
+        return await razorpay_api.create_order(payload.amount, payload.currency, receipt, notes={"user_id": x_user_id})
     except Exception as e:
         logger.error(f"Razorpay order creation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -269,14 +380,13 @@ async def verify_payment(request: Request, payload: PaymentVerify, x_user_id: st
         raise HTTPException(status_code=401)
     if not RAZORPAY_KEY_ID:
         raise HTTPException(status_code=500, detail="Razorpay Config Missing")
-    
-    client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+
+    verified = razorpay_api.verify_payment_signature(
+        payload.razorpay_order_id, payload.razorpay_payment_id, payload.razorpay_signature
+    )
     try:
-        client.utility.verify_payment_signature({
-            'razorpay_order_id': payload.razorpay_order_id,
-            'razorpay_payment_id': payload.razorpay_payment_id,
-            'razorpay_signature': payload.razorpay_signature
-        })
+        if not verified:
+            raise RazorpayError("Signature mismatch")
         upgrade_user_plan(x_user_id, "PRO")
         # Create success notification
         create_notification(
@@ -287,7 +397,7 @@ async def verify_payment(request: Request, payload: PaymentVerify, x_user_id: st
             "success"
         )
         return {"status": "verified", "plan": "PRO"}
-    except razorpay.errors.SignatureVerificationError as e:
+    except RazorpayError as e:
         logger.error(f"Payment verification failed: {e}")
         # Create failure notification
         create_notification(
@@ -350,6 +460,7 @@ async def linkedin_auth(payload: AuthPayload):
                 raise HTTPException(status_code=400, detail="Failed to get LinkedIn access token")
             
             access_token = token_data["access_token"]
+            refresh_token = token_data.get("refresh_token")
             
             # Get user's LinkedIn URN for posting
             profile_headers = {"Authorization": f"Bearer {access_token}"}
@@ -357,17 +468,13 @@ async def linkedin_auth(payload: AuthPayload):
             profile_data = profile_resp.json() if profile_resp.status_code == 200 else {}
             
             # Store token with metadata
-            save_user_token(payload.user_id, "linkedin", access_token)
+            save_user_token(payload.user_id, "linkedin", access_token, refresh_token, expires_at_from(token_data))
             if profile_data.get("sub"):
                 # Store LinkedIn URN in metadata if available
-                from app.database import supabase
-                if supabase:
-                    try:
-                        supabase.table("user_integrations").update({
-                            "metadata": {"person_urn": f"urn:li:person:{profile_data['sub']}"}
-                        }).eq("user_id", payload.user_id).eq("provider", "linkedin").execute()
-                    except Exception as e:
-                        logger.warning(f"Could not save LinkedIn metadata: {e}")
+                try:
+                    update_integration_metadata(payload.user_id, "linkedin", {"person_urn": f"urn:li:person:{profile_data['sub']}"})
+                except Exception as e:
+                    logger.warning(f"Could not save LinkedIn metadata: {e}")
             
             return {"status": "connected", "provider": "linkedin"}
         except Exception as e:
@@ -380,13 +487,31 @@ async def slack_auth(payload: AuthPayload):
     save_user_token(payload.user_id, "slack", fake_token)
     return {"status": "connected", "provider": "slack"}
 
+def ndjson_response(rows) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON"""
+    return StreamingResponse((json.dumps(row, default=str) + "\n" for row in rows), media_type="application/x-ndjson")
+
 @app.get("/cards/history")
-async def get_history(x_user_id: str = Header(None), limit: int = Query(50, le=100), offset: int = Query(0, ge=0)):
+async def get_history(
+    x_user_id: str = Header(None),
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
     """Get card history (all cards including POSTED and DISMISSED)"""
     if not x_user_id:
         raise HTTPException(status_code=401)
-    cards = get_card_history(x_user_id, limit=limit, offset=offset)
-    return {"cards": cards}
+    if format == "ndjson":
+        return ndjson_response(iter_card_history(x_user_id))
+    if offset and not cursor:
+        # Legacy offset paging; prefer next_cursor
+        return {"cards": get_card_history(x_user_id, limit=limit, offset=offset), "next_cursor": None}
+    try:
+        cards, next_cursor = get_card_history_page(x_user_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"cards": cards, "next_cursor": next_cursor}
 
 @app.get("/sync/github", response_model=List[TaskCard])
 async def sync_all_sources(x_user_id: str = Header(None)):
@@ -394,7 +519,7 @@ async def sync_all_sources(x_user_id: str = Header(None)):
     
     cached = get_cached_cards(x_user_id)
     if cached: 
-        return [TaskCard(id=str(r['id']), source_id=r['source_id'], category=r['category'], type=r['type'], title=r['title'], subtitle=r['subtitle'], content=r['content'], tags=r['tags'], timestamp=r['created_at'], colorClass=r['color_class']) for r in cached]
+        return [TaskCard.from_row(r) for r in cached]
 
     if check_limit_reached(x_user_id):
         return [TaskCard(id="limit", source_id="sys_limit", category="ENG", type="SYSTEM", title="Usage Limit Reached", subtitle="Upgrade to PRO", content="You have used your 5 free cards. Upgrade to PRO to continue syncing.", tags=["Billing"], timestamp="Now", colorClass="bg-red-900 text-white")]
@@ -416,7 +541,7 @@ async def sync_all_sources(x_user_id: str = Header(None)):
             new_cards.append(demo2)
         
         cached = get_cached_cards(x_user_id)
-        return [TaskCard(id=str(r['id']), source_id=r['source_id'], category=r['category'], type=r['type'], title=r['title'], subtitle=r['subtitle'], content=r['content'], tags=r['tags'], timestamp=r['created_at'], colorClass=r['color_class']) for r in cached]
+        return [TaskCard.from_row(r) for r in cached]
     # ------------------------
 
     headers = {"Authorization": f"token {token}", "Accept": "application/vnd.github.v3+json"}
@@ -448,131 +573,67 @@ async def sync_all_sources(x_user_id: str = Header(None)):
             
     if cards:
         cached = get_cached_cards(x_user_id)
-        return [TaskCard(id=str(r['id']), source_id=r['source_id'], category=r['category'], type=r['type'], title=r['title'], subtitle=r['subtitle'], content=r['content'], tags=r['tags'], timestamp=r['created_at'], colorClass=r['color_class']) for r in cached]
+        return [TaskCard.from_row(r) for r in cached]
     
     return []
 
-async def get_linkedin_person_urn(user_id: str) -> Optional[str]:
-    """Get LinkedIn person URN from database metadata"""
-    from app.database import supabase
-    if not supabase:
-        return None
-    try:
-        result = supabase.table("user_integrations").select("metadata").eq("user_id", user_id).eq("provider", "linkedin").execute()
-        if result.data and result.data[0].get("metadata"):
-            return result.data[0]["metadata"].get("person_urn")
-    except Exception as e:
-        logger.warning(f"Could not fetch LinkedIn URN: {e}")
-    return None
-
-async def post_to_linkedin(access_token: str, content: str, user_id: str) -> dict:
-    """Post content to LinkedIn using UGC Posts API"""
-    person_urn = await get_linkedin_person_urn(user_id)
-    
-    if not person_urn:
-        # Fallback: try to get person URN from userinfo endpoint
-        async with httpx.AsyncClient() as http:
-            try:
-                profile_resp = await http.get(
-                    "https://api.linkedin.com/v2/userinfo",
-                    headers={"Authorization": f"Bearer {access_token}"}
-                )
-                if profile_resp.status_code == 200:
-                    profile_data = profile_resp.json()
-                    if profile_data.get("sub"):
-                        person_urn = f"urn:li:person:{profile_data['sub']}"
-            except Exception as e:
-                logger.error(f"Could not fetch LinkedIn profile: {e}")
-    
-    if not person_urn:
-        raise HTTPException(status_code=400, detail="Could not determine LinkedIn person URN")
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-        "X-Restli-Protocol-Version": "2.0.0"
-    }
-    
-    post_data = {
-        "author": person_urn,
-        "lifecycleState": "PUBLISHED",
-        "specificContent": {
-            "com.linkedin.ugc.ShareContent": {
-                "shareCommentary": {
-                    "text": content
-                },
-                "shareMediaCategory": "NONE"
-            }
-        },
-        "visibility": {
-            "com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"
-        }
-    }
-    
-    async with httpx.AsyncClient() as http:
-        try:
-            resp = await http.post(
-                "https://api.linkedin.com/v2/ugcPosts",
-                headers=headers,
-                json=post_data
-            )
-            
-            if resp.status_code not in [200, 201]:
-                error_detail = resp.text
-                logger.error(f"LinkedIn API error: {resp.status_code} - {error_detail}")
-                raise HTTPException(status_code=resp.status_code, detail=f"LinkedIn API error: {error_detail}")
-            
-            return resp.json()
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"LinkedIn posting error: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to post to LinkedIn: {str(e)}")
-
 @app.post("/action/execute")
 async def execute_action(payload: ActionPayload, x_user_id: str = Header(None)):
+    """Approve a card and publish it to every requested platform concurrently"""
     if not x_user_id: raise HTTPException(status_code=401)
     
     # Update card status first
     update_card_status(payload.id, "APPROVED")
     
-    post_id = None
-    status = "POSTED"
-    
-    # Post to platform if LinkedIn
-    if payload.platform.upper() == "LINKEDIN":
-        token = get_user_token(x_user_id, "linkedin")
-        if not token:
-            status = "FAILED"
-            save_analytics(x_user_id, payload.id, "linkedin", None, status)
-            raise HTTPException(status_code=400, detail="LinkedIn not connected")
-        
-        # Check if it's a simulated token
-        if token.startswith("li_simulated_token_"):
-            logger.info(f"Simulated LinkedIn post for card {payload.id}")
-            save_analytics(x_user_id, payload.id, "linkedin", None, "PENDING")
-            return {"status": "executed", "platform": payload.platform, "note": "Simulated - configure LinkedIn credentials for real posting"}
-        
-        try:
-            result = await post_to_linkedin(token, payload.content, x_user_id)
-            post_id = result.get("id")
-            save_analytics(x_user_id, payload.id, "linkedin", post_id, "POSTED")
-            return {"status": "executed", "platform": payload.platform, "linkedin_post_id": post_id}
-        except HTTPException:
-            status = "FAILED"
-            save_analytics(x_user_id, payload.id, "linkedin", None, status)
-            raise
-        except Exception as e:
-            logger.error(f"Failed to post to LinkedIn: {e}")
-            status = "FAILED"
-            save_analytics(x_user_id, payload.id, "linkedin", None, status)
-            # Don't fail the action if posting fails, but log it
-            return {"status": "executed", "platform": payload.platform, "warning": f"Posting failed: {str(e)}"}
-    
-    # Save analytics for other platforms too
-    save_analytics(x_user_id, payload.id, payload.platform.lower(), post_id, status)
-    
-    return {"status": "executed", "platform": payload.platform}
+    platforms = payload.platforms or [payload.platform]
+    results = await publish(x_user_id, payload.id, payload.content, platforms)
+    
+    if len(results) == 1:
+        # Single-platform callers keep the original response and error codes
+        result = results[0]
+        if result["status"] == "FAILED" and result.get("status_code"):
+            raise HTTPException(status_code=result["status_code"], detail=result["error"])
+        response = {"status": "executed", "platform": platforms[0], "results": results}
+        if result["platform"] == "linkedin" and result.get("post_id"):
+            response["linkedin_post_id"] = result["post_id"]
+        if result.get("note"):
+            response["note"] = result["note"]
+        if result.get("error"):
+            response["warning"] = result["error"]
+        return response
+    
+    return {"status": "executed", "platforms": [r["platform"] for r in results], "results": results}
+
+@app.post("/action/schedule")
+async def schedule_action(payload: SchedulePayload, x_user_id: str = Header(None)):
+    """Publish a card to the given platforms at publish_at instead of now"""
+    if not x_user_id: raise HTTPException(status_code=401)
+    publish_at = payload.publish_at if payload.publish_at.tzinfo else payload.publish_at.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    if publish_at < now - timedelta(minutes=1):
+        raise HTTPException(status_code=400, detail="publish_at is in the past")
+    if publish_at > now + timedelta(days=365):
+        raise HTTPException(status_code=400, detail="publish_at must be within a year")
+    if not await asyncio.to_thread(get_card, x_user_id, payload.id, "id"):
+        raise HTTPException(status_code=404, detail="Card not found")
+    
+    rows = await post_scheduler.schedule(x_user_id, payload.id, payload.content, payload.platforms, publish_at)
+    return {"status": "scheduled", "publish_at": publish_at.isoformat(), "posts": [
+        {"id": r["id"], "platform": r["platform"]} for r in rows
+    ]}
+
+@app.get("/schedule")
+async def list_scheduled(x_user_id: str = Header(None)):
+    """The user's upcoming, in-progress and failed scheduled posts"""
+    if not x_user_id: raise HTTPException(status_code=401)
+    return await asyncio.to_thread(get_user_scheduled_posts, x_user_id)
+
+@app.delete("/schedule/{post_id}")
+async def cancel_schedule(post_id: str, x_user_id: str = Header(None)):
+    if not x_user_id: raise HTTPException(status_code=401)
+    if not await cancel_scheduled(x_user_id, post_id):
+        raise HTTPException(status_code=404, detail="No scheduled post to cancel")
+    return {"status": "cancelled", "id": post_id}
 
 @app.post("/action/discard")
 async def discard_action(payload: ActionPayload, x_user_id: str = Header(None)):
@@ -623,84 +684,33 @@ async def github_webhook(request: Request):
 
 @app.post("/webhook/razorpay")
 async def razorpay_webhook(request: Request):
-    """Handle Razorpay webhook events for payment verification"""
+    """Record a Razorpay webhook event and acknowledge; processing runs on the payment event workers"""
     if not RAZORPAY_WEBHOOK_SECRET:
         raise HTTPException(status_code=500, detail="Razorpay webhook secret not configured")
     
+    payload = await request.body()
+    signature = request.headers.get("X-Razorpay-Signature")
+    if not signature:
+        raise HTTPException(status_code=400, detail="Missing signature")
+    if not verify_webhook_signature(payload, signature, RAZORPAY_WEBHOOK_SECRET):
+        raise HTTPException(status_code=400, detail="Invalid signature")
     try:
-        payload = await request.body()
-        signature = request.headers.get("X-Razorpay-Signature")
-        
-        if not signature:
-            raise HTTPException(status_code=400, detail="Missing signature")
-        
-        # Verify webhook signature
-        expected_signature = hmac.new(
-            RAZORPAY_WEBHOOK_SECRET.encode(),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
-        
-        if not hmac.compare_digest(signature, expected_signature):
-            raise HTTPException(status_code=400, detail="Invalid signature")
-        
         event_data = json.loads(payload)
-        event_type = event_data.get("event")
-        
-        logger.info(f"Razorpay webhook received: {event_type}")
-        
-        # Handle payment success
-        if event_type == "payment.captured":
-            payment_data = event_data.get("payload", {}).get("payment", {}).get("entity", {})
-            order_id = payment_data.get("order_id")
-            payment_id = payment_data.get("id")
-            amount = payment_data.get("amount", 0) / 100  # Convert from paise to rupees
-            
-            # Extract user_id from order receipt (format: receipt_{user_id})
-            receipt = payment_data.get("notes", {}).get("user_id") or payment_data.get("order_id", "").split("_")[-1]
-            
-            if order_id and payment_id:
-                # Verify payment with Razorpay
-                client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-                try:
-                    payment = client.payment.fetch(payment_id)
-                    if payment.get("status") == "captured":
-                        # Upgrade user plan
-                        upgrade_user_plan(receipt, "PRO")
-                        save_payment_notification(receipt, payment_id, amount, "INR", "SUCCESS")
-                        logger.info(f"Upgraded user {receipt} to PRO plan")
-                        return {"status": "success", "event": event_type}
-                except Exception as e:
-                    logger.error(f"Error verifying payment: {e}")
-                    save_payment_notification(receipt, payment_id, amount, "INR", "FAILED", str(e))
-                    raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
-        
-        # Handle payment failures
-        elif event_type == "payment.failed":
-            payment_data = event_data.get("payload", {}).get("payment", {}).get("entity", {})
-            payment_id = payment_data.get("id")
-            amount = payment_data.get("amount", 0) / 100
-            failure_reason = payment_data.get("error_description", "Payment failed")
-            receipt = payment_data.get("notes", {}).get("user_id") or "unknown"
-            
-            save_payment_notification(receipt, payment_id, amount, "INR", "FAILED", failure_reason)
-            logger.warning(f"Payment failed for user {receipt}: {failure_reason}")
-        
-        # Handle subscription events
-        elif event_type in ["subscription.activated", "subscription.charged"]:
-            subscription_data = event_data.get("payload", {}).get("subscription", {}).get("entity", {})
-            user_id = subscription_data.get("notes", {}).get("user_id")
-            if user_id:
-                upgrade_user_plan(user_id, "PRO")
-                logger.info(f"Upgraded user {user_id} to PRO via subscription")
-        
-        return {"status": "success", "event": event_type}
-    
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    
+    event_type = event_data.get("event")
+    # Redeliveries of an event carry the same id; fall back to the body hash
+    event_id = request.headers.get("X-Razorpay-Event-Id") or hashlib.sha256(payload).hexdigest()
+    try:
+        accepted = await payment_events.ingest(event_id, event_data)
     except Exception as e:
+        # Not stored, so let Razorpay redeliver it
         logger.error(f"Webhook error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail="Could not record webhook event")
+    
+    logger.info(f"Razorpay webhook {'received' if accepted else 'duplicate'}: {event_type} ({event_id})")
+    return {"status": "queued" if accepted else "duplicate", "event": event_type}
 
 @app.post("/webhook/slack")
 async def slack_webhook(payload: dict):
@@ -708,15 +718,9 @@ async def slack_webhook(payload: dict):
     if not SLACK_WEBHOOK_URL:
         raise HTTPException(status_code=500, detail="Slack webhook URL not configured")
     
-    try:
-        # Forward the payload to Slack
-        async with httpx.AsyncClient() as http:
-            resp = await http.post(SLACK_WEBHOOK_URL, json=payload)
-            resp.raise_for_status()
-            return {"status": "sent", "slack_response": resp.text}
-    except Exception as e:
-        logger.error(f"Slack webhook error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # Forwarded through the outbox: paced to Slack's rate limit, bursts merged into digests
+    slack_outbox.enqueue(SLACK_WEBHOOK_URL, payload)
+    return {"status": "queued"}
 
 # --- WEBHOOK RETRY BACKGROUND TASK ---
 
@@ -726,7 +730,14 @@ async def process_webhook_retries():
         try:
             pending = get_pending_webhook_retries()
             for retry in pending:
+                if retry.get("provider") == "slack":
+                    # Slack retries go through the paced outbox instead of all at once
+                    slack_outbox.enqueue(retry["endpoint"], retry["payload"], retry.get("user_id"), retry["id"])
+                    continue
                 try:
+                    if retry.get("provider") == "jobs":
+                        # Job callback URLs are user-supplied
+                        await check_public_url(retry["endpoint"])
                     async with httpx.AsyncClient() as http:
                         resp = await http.post(
                             retry["endpoint"],
@@ -765,52 +776,14 @@ async def notify_slack_engineering(payload: SlackNotifyPayload, x_user_id: str =
         raise HTTPException(status_code=500, detail="Database not available")
     
     try:
-        card_result = supabase.table("task_cards").select("*").eq("id", payload.card_id).eq("user_id", x_user_id).execute()
+        card_result = supabase.table("task_cards").select("title, subtitle, content, category, type").eq("id", payload.card_id).eq("user_id", x_user_id).execute()
         if not card_result.data:
             raise HTTPException(status_code=404, detail="Card not found")
         
-        card = card_result.data[0]
-        
         # Format Slack message
-        slack_payload = {
-            "text": f"🔧 Engineering Update: {card.get('title', 'New Task')}",
-            "blocks": [
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": f"🔧 {card.get('title', 'Engineering Task')}"
-                    }
-                },
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*{card.get('subtitle', '')}*\n\n{card.get('content', '')}"
-                    }
-                },
-                {
-                    "type": "context",
-                    "elements": [
-                        {
-                            "type": "mrkdwn",
-                            "text": f"Category: {card.get('category', 'ENG')} | Type: {card.get('type', 'TASK')}"
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        async with httpx.AsyncClient() as http:
-            try:
-                resp = await http.post(SLACK_WEBHOOK_URL, json=slack_payload, timeout=10.0)
-                resp.raise_for_status()
-                return {"status": "sent", "card_id": payload.card_id}
-            except Exception as e:
-                # Add to retry queue
-                add_webhook_retry(x_user_id, "slack", SLACK_WEBHOOK_URL, slack_payload)
-                logger.warning(f"Slack webhook failed, added to retry queue: {e}")
-                raise HTTPException(status_code=500, detail=f"Slack notification failed: {str(e)}")
+        slack_payload = slack_card_message(card_result.data[0])
+        slack_outbox.enqueue(SLACK_WEBHOOK_URL, slack_payload, x_user_id)
+        return {"status": "queued", "card_id": payload.card_id}
     
     except HTTPException:
         raise
@@ -871,7 +844,7 @@ async def signin(request: Request, payload: SignInPayload):
         raise HTTPException(status_code=500, detail="Database not available")
     
     # Get user account
-    account = supabase.table("user_accounts").select("*").eq("email", payload.email).execute()
+    account = supabase.table("user_accounts").select("user_id, password_hash").eq("email", payload.email).execute()
     if not account.data:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
@@ -923,7 +896,7 @@ async def google_auth(payload: AuthPayload):
             
             permissions = get_permissions_for_provider("google")
             save_integration_with_permissions(
-                payload.user_id, "google", access_token, refresh_token, permissions, True
+                payload.user_id, "google", access_token, refresh_token, permissions, True, expires_at_from(token_data)
             )
             
             return {"status": "connected", "provider": "google", "user_info": user_info}
@@ -1006,6 +979,7 @@ async def save_integration_consent(payload: IntegrationConsentPayload, x_user_id
             "consent_given": payload.consent_given,
             "consent_timestamp": datetime.utcnow().isoformat() if payload.consent_given else None
         }).eq("user_id", x_user_id).eq("provider", payload.provider).execute()
+        invalidate_user_integrations(x_user_id, payload.provider)
     
     return {"status": "consent_saved", "provider": payload.provider}
 
@@ -1013,117 +987,44 @@ async def save_integration_consent(payload: IntegrationConsentPayload, x_user_id
 
 @app.post("/integrations/{provider}/refresh")
 async def refresh_integration_token(provider: str, x_user_id: str = Header(None)):
-    """Refresh OAuth token for an integration"""
+    """Refresh OAuth token for an integration (joins a refresh already in flight)"""
     if not x_user_id:
         raise HTTPException(status_code=401)
     
-    refresh_token = get_integration_refresh_token(x_user_id, provider)
-    if not refresh_token:
-        raise HTTPException(status_code=400, detail="No refresh token available")
-    
-    if provider == "linkedin":
-        # LinkedIn token refresh
-        token_url = "https://www.linkedin.com/oauth/v2/accessToken"
-        data = {
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token,
-            "client_id": CLIENT_ID_LINKEDIN,
-            "client_secret": CLIENT_SECRET_LINKEDIN
-        }
-        
-        async with httpx.AsyncClient() as http:
-            try:
-                resp = await http.post(token_url, data=data)
-                token_data = resp.json()
-                
-                if "access_token" not in token_data:
-                    raise HTTPException(status_code=400, detail="Token refresh failed")
-                
-                new_access_token = token_data["access_token"]
-                new_refresh_token = token_data.get("refresh_token", refresh_token)
-                
-                update_integration_token(x_user_id, provider, new_access_token, new_refresh_token)
-                return {"status": "refreshed", "provider": provider}
-            except Exception as e:
-                logger.error(f"Token refresh error: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
-    
-    elif provider == "google":
-        # Google token refresh
-        token_url = "https://oauth2.googleapis.com/token"
-        data = {
-            "client_id": CLIENT_ID_GOOGLE,
-            "client_secret": CLIENT_SECRET_GOOGLE,
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token"
-        }
-        
-        async with httpx.AsyncClient() as http:
-            try:
-                resp = await http.post(token_url, data=data)
-                token_data = resp.json()
-                
-                if "access_token" not in token_data:
-                    raise HTTPException(status_code=400, detail="Token refresh failed")
-                
-                new_access_token = token_data["access_token"]
-                update_integration_token(x_user_id, provider, new_access_token, refresh_token)
-                return {"status": "refreshed", "provider": provider}
-            except Exception as e:
-                logger.error(f"Token refresh error: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
-    
-    raise HTTPException(status_code=400, detail="Provider not supported for refresh")
+    try:
+        await token_manager.refresh(x_user_id, provider)
+    except TokenRefreshError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"status": "refreshed", "provider": provider}
 
 # --- IMAGE GENERATION ---
 
 @app.post("/image/generate")
 async def generate_image(payload: ImageGeneratePayload, x_user_id: str = Header(None)):
     """Generate image using Nano Banana or similar service"""
-    if not NANO_BANANA_API_KEY:
-        # Fallback to placeholder or error
-        raise HTTPException(status_code=500, detail="Image generation not configured")
-    
-    # Nano Banana API integration
-    # Note: Adjust API endpoint based on actual Nano Banana API
-    api_url = "https://api.nanobanana.ai/v1/generate"  # Placeholder URL
-    
-    headers = {
-        "Authorization": f"Bearer {NANO_BANANA_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "prompt": payload.prompt,
-        "width": 1024,
-        "height": 1024,
-        "model": "stable-diffusion-xl"
-    }
-    
-    async with httpx.AsyncClient(timeout=60.0) as http:
-        try:
-            resp = await http.post(api_url, json=data, headers=headers)
-            if resp.status_code != 200:
-                raise HTTPException(status_code=resp.status_code, detail="Image generation failed")
-            
-            result = resp.json()
-            image_url = result.get("image_url") or result.get("url")
-            
-            # If card_id provided, update card with image
-            if payload.card_id and image_url:
-                update_card_image(payload.card_id, image_url, generated=True)
-            
-            return {"image_url": image_url, "prompt": payload.prompt}
-        except httpx.TimeoutException:
-            raise HTTPException(status_code=504, detail="Image generation timeout")
-        except Exception as e:
-            logger.error(f"Image generation error: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+    return await run_image_generation(payload)
+
+async def run_image_generation(payload: ImageGeneratePayload) -> dict:
+    """Generate (or reuse) the image for a prompt and attach it to the card (shared by the endpoint and jobs)"""
+    return await image_store.generate(payload.prompt, payload.card_id)
+
+@app.get("/images/{name}")
+async def get_image(name: str):
+    """Serve a cached image or derivative (content-addressed, so cacheable forever)"""
+    path = image_store.path_for(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 # --- ANALYTICS ---
 
 @app.get("/analytics/posts")
-async def get_post_analytics(x_user_id: str = Header(None), limit: int = 50):
+async def get_post_analytics(
+    x_user_id: str = Header(None),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
     """Get analytics for posted content"""
     if not x_user_id:
         raise HTTPException(status_code=401)
@@ -1132,9 +1033,14 @@ async def get_post_analytics(x_user_id: str = Header(None), limit: int = 50):
     if not supabase:
         raise HTTPException(status_code=500, detail="Database not available")
     
+    if format == "ndjson":
+        return ndjson_response(iter_post_analytics(x_user_id))
+    
     try:
-        analytics = supabase.table("post_analytics").select("*").eq("user_id", x_user_id).order("created_at", desc=True).limit(limit).execute().data
-        return {"analytics": analytics}
+        analytics, next_cursor = get_post_analytics_page(x_user_id, limit=limit, cursor=cursor)
+        return {"analytics": analytics, "next_cursor": next_cursor}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         logger.error(f"Analytics fetch error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1160,6 +1066,9 @@ async def add_competitor(payload: CompetitorPayload, x_user_id: str = Header(Non
             "url": payload.url
         }
         result = supabase.table("competitors").insert(competitor_data).execute()
+        if result.data:
+            # First fetch right away rather than at the next scan
+            competitor_crawler.crawl(result.data[0])
         return {"status": "added", "competitor": result.data[0] if result.data else None}
     except Exception as e:
         logger.error(f"Add competitor error: {e}")
@@ -1188,26 +1097,26 @@ async def get_competitor_posts(competitor_id: str, x_user_id: str = Header(None)
     if not x_user_id:
         raise HTTPException(status_code=401)
     
-    from app.database import supabase
-    if not supabase:
-        return {"posts": []}
-    
     try:
-        competitor = supabase.table("competitors").select("*").eq("id", competitor_id).eq("user_id", x_user_id).execute()
-        if not competitor.data:
+        competitor = await asyncio.to_thread(get_competitor, x_user_id, competitor_id)
+        if not competitor:
             raise HTTPException(status_code=404, detail="Competitor not found")
         
-        comp = competitor.data[0]
-        # In production, this would fetch from the platform API
-        # For now, return mock data
+        if not competitor.get("last_fetched_at"):
+            # Never crawled yet: give the first fetch a moment instead of showing an empty list
+            await asyncio.wait({competitor_crawler.crawl(competitor)}, timeout=COMPETITOR_FIRST_FETCH_WAIT)
+        
+        posts = await asyncio.to_thread(get_stored_competitor_posts, competitor_id, x_user_id)
         return {
             "posts": [
                 {
-                    "id": "1",
-                    "content": "Sample post from competitor",
-                    "engagement": {"likes": 100, "comments": 20, "shares": 10},
-                    "posted_at": "2024-01-15T10:00:00Z"
+                    "id": p["id"],
+                    "content": p["content"],
+                    "url": p.get("url"),
+                    "engagement": p.get("engagement_metrics") or {},
+                    "posted_at": p.get("posted_at")
                 }
+                for p in posts
             ]
         }
     except HTTPException:
@@ -1222,19 +1131,28 @@ async def learn_from_competitor(competitor_id: str, x_user_id: str = Header(None
     if not x_user_id:
         raise HTTPException(status_code=401)
     
-    from app.database import supabase
-    if not supabase:
-        raise HTTPException(status_code=500, detail="Database not available")
-    
     try:
-        # Get competitor posts
-        posts = supabase.table("competitor_posts").select("*").eq("competitor_id", competitor_id).limit(10).execute().data
+        # Only the user's own competitors, and only the posts crawled for them
+        competitor = await asyncio.to_thread(get_competitor, x_user_id, competitor_id, "id")
+        if not competitor:
+            raise HTTPException(status_code=404, detail="Competitor not found")
+        posts = await asyncio.to_thread(get_stored_competitor_posts, competitor_id, x_user_id, 10)
         
-        # Analyze posts and learn patterns
-        # In production, this would use ML to extract style patterns
+        # Queue the posts as training examples (flushed as one multi-row insert)
+        batch_writer.enqueue_many("ai_training", [
+            {
+                "user_id": x_user_id,
+                "content": post.get("content", ""),
+                "style": "competitor_learned",
+                "examples": [post.get("content", "")]
+            }
+            for post in posts
+        ])
         learn_from_interaction(x_user_id, "competitor_analysis", str(posts), "learning_from_competitor")
         
         return {"status": "learned", "posts_analyzed": len(posts)}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Competitor learning error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1256,6 +1174,14 @@ async def get_ai_styles(x_user_id: str = Header(None)):
         logger.error(f"Get AI styles error: {e}")
         return {"styles": []}
 
+@app.get("/trends/ai/profile")
+async def get_style_profile(x_user_id: str = Header(None)):
+    """Get the compacted style profile used to personalise prompts"""
+    if not x_user_id:
+        raise HTTPException(status_code=401)
+    
+    return {"profile": style_profiles.get(x_user_id)}
+
 @app.post("/trends/generate-comparison")
 async def generate_comparison_post(competitor_post_id: str, x_user_id: str = Header(None)):
     """Generate a comparison post based on competitor content"""
@@ -1272,7 +1198,7 @@ async def generate_comparison_post(competitor_post_id: str, x_user_id: str = Hea
     prompt = f"Create a comparison post that highlights our advantages over this competitor post. Be professional and engaging."
     
     try:
-        client = OpenAI(api_key=key_to_use)
+        client = openai_client(key_to_use)
         response = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
@@ -1292,43 +1218,10 @@ async def get_trending_content(location: Optional[str] = Query(None), x_user_id:
     if not location:
         return {"trending": [], "memes": []}
     
-    # In production, fetch from location-based APIs (Twitter Trends API, etc.)
-    # Mock data for now
-    trending = [
-        {
-            "id": "1",
-            "type": "trend",
-            "content": f"AI automation is trending in {location}",
-            "hashtags": ["#AI", "#Automation"],
-            "trending_score": 95,
-            "category": "tech"
-        },
-        {
-            "id": "2",
-            "type": "trend",
-            "content": f"Startup culture discussions in {location}",
-            "hashtags": ["#Startup", "#Tech"],
-            "trending_score": 88,
-            "category": "business"
-        }
-    ]
-    
-    memes = [
-        {
-            "id": "1",
-            "name": "Drake Pointing",
-            "image_url": "https://via.placeholder.com/500x500?text=Drake+Meme",
-            "template": "drake"
-        },
-        {
-            "id": "2",
-            "name": "Distracted Boyfriend",
-            "image_url": "https://via.placeholder.com/500x500?text=Distracted",
-            "template": "distracted"
-        }
-    ]
+    # Precomputed by the ingestion service; this is a read of two short ranked lists
+    trending = trending_service.top(location)
     
-    return {"trending": trending, "memes": memes}
+    return {"trending": trending, "memes": meme_renderer.templates()}
 
 @app.post("/trends/meme/edit")
 async def edit_meme(payload: MemeEditPayload, x_user_id: str = Header(None)):
@@ -1336,9 +1229,15 @@ async def edit_meme(payload: MemeEditPayload, x_user_id: str = Header(None)):
     if not x_user_id:
         raise HTTPException(status_code=401)
     
-    # In production, this would use an image editing API
-    # For now, return a placeholder URL
-    edited_url = f"https://via.placeholder.com/500x500?text={payload.top_text}+{payload.bottom_text}"
+    try:
+        edited_url = await meme_renderer.render(payload.template_id, payload.top_text, payload.bottom_text)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Meme template not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Meme render error: {e}")
+        raise HTTPException(status_code=500, detail="Meme rendering failed")
     
     return {
         "image_url": edited_url,
@@ -1354,7 +1253,7 @@ async def edit_post_from_trend(payload: PostEditPayload, x_user_id: str = Header
         raise HTTPException(status_code=401)
     
     # Check usage limits
-    daily_usage = get_ai_usage_today(x_user_id)
+    daily_usage = quota_service.get_usage_today(x_user_id)
     profile = get_user_profile(x_user_id)
     daily_limit = profile.get("daily_ai_limit", 50) if profile else 50
     
@@ -1373,10 +1272,7 @@ async def edit_post_from_trend(payload: PostEditPayload, x_user_id: str = Header
                     headers={"Authorization": f"Bearer {GROK_API_KEY}"},
                     json={
                         "model": "grok-beta",
-                        "messages": [
-                            {"role": "system", "content": "You are a sassy Hinglish content writer. Write catchy, engaging posts."},
-                            {"role": "user", "content": f"Rewrite this: {payload.original_content}"}
-                        ]
+                        "messages": GROK_POST_EDIT.render("grok-beta", content=payload.original_content)
                     }
                 )
                 if grok_response.status_code == 200:
@@ -1399,16 +1295,20 @@ async def edit_post_from_trend(payload: PostEditPayload, x_user_id: str = Header
     tone_instruction = f"Tone: {preferences.get('tone', 'professional')}" if preferences else ""
     style_instruction = f"Style: {preferences.get('style', 'engaging')}" if preferences else ""
     
-    prompt = f"Edit this post: {payload.original_content}\n{tone_instruction}\n{style_instruction}\nEdits requested: {payload.edits}"
+    messages = POST_EDIT.render(
+        "gpt-4o-mini",
+        style=style_prompt(x_user_id),
+        content=payload.original_content,
+        tone_instruction=tone_instruction,
+        style_instruction=style_instruction,
+        edits=payload.edits
+    )
     
     try:
-        client = OpenAI(api_key=key_to_use)
+        client = openai_client(key_to_use)
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a content editor. Apply the requested edits while maintaining quality."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             max_tokens=400
         )
         content = response.choices[0].message.content.strip()
@@ -1443,8 +1343,7 @@ async def get_ai_usage(x_user_id: str = Header(None)):
     if not x_user_id:
         raise HTTPException(status_code=401)
     
-    daily = get_ai_usage_today(x_user_id)
-    monthly = get_ai_usage_month(x_user_id)
+    daily, monthly = quota_service.get_usage(x_user_id)
     profile = get_user_profile(x_user_id)
     daily_limit = profile.get("daily_ai_limit", 50) if profile else 50
     monthly_limit = profile.get("monthly_ai_limit", 1000) if profile else 1000
@@ -1454,36 +1353,6 @@ async def get_ai_usage(x_user_id: str = Header(None)):
         "monthly": {"used": monthly, "limit": monthly_limit, "remaining": monthly_limit - monthly}
     }
 
-@app.post("/trends/competitor/learn")
-async def learn_from_competitor(competitor_id: str, x_user_id: str = Header(None)):
-    """AI learns from competitor posts automatically"""
-    if not x_user_id:
-        raise HTTPException(status_code=401)
-    
-    from app.database import supabase
-    if not supabase:
-        raise HTTPException(status_code=500, detail="Database not available")
-    
-    try:
-        # Get competitor posts
-        posts_result = supabase.table("competitor_posts").select("*").eq("competitor_id", payload.competitor_id).limit(10).execute()
-        posts = posts_result.data if posts_result.data else []
-        
-        # Extract patterns and save to AI training
-        for post in posts:
-            training_data = {
-                "user_id": x_user_id,
-                "content": post.get("content", ""),
-                "style": "competitor_learned",
-                "examples": [post.get("content", "")]
-            }
-            supabase.table("ai_training").insert(training_data).execute()
-        
-        return {"status": "learned", "posts_analyzed": len(posts)}
-    except Exception as e:
-        logger.error(f"AI learning error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
 @app.post("/trends/ai/preferences")
 async def save_ai_preferences(preferences: dict, x_user_id: str = Header(None)):
     """Save AI preferences"""
@@ -1548,6 +1417,7 @@ async def disable_integration(request: Request, provider: str, x_user_id: str =
     
     try:
         supabase.table("user_integrations").delete().eq("user_id", x_user_id).eq("provider", provider).execute()
+        invalidate_user_integrations(x_user_id, provider)
         return {"status": "disabled", "provider": provider}
     except Exception as e:
         logger.error(f"Disable integration error: {e}")
@@ -1557,7 +1427,12 @@ async def disable_integration(request: Request, provider: str, x_user_id: str =
 
 @app.post("/user/data/export")
 @limiter.limit("5/hour")
-async def export_user_data(request: Request, x_user_id: str = Header(None)):
+async def export_user_data(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|zip)$"),
+    delivery: str = Query("stream", pattern="^(stream|async)$"),
+    x_user_id: str = Header(None)
+):
     """Export all user data (GDPR - Right to Data Portability)"""
     if not x_user_id:
         raise HTTPException(status_code=401)
@@ -1566,59 +1441,39 @@ async def export_user_data(request: Request, x_user_id: str = Header(None)):
     if not supabase:
         raise HTTPException(status_code=500, detail="Database not available")
     
+    filename = f"covalynce-export-{datetime.utcnow().date().isoformat()}"
+    
+    if delivery == "async":
+        # Built as a zip in the background; poll /jobs/{job_id} for the download URL
+        job = job_queue.submit(x_user_id, "data_export", {}, notify=True)
+        return {"job_id": job["id"], "status": job["status"]}
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_ndjson(x_user_id),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.ndjson"'}
+        )
+    
     try:
-        # Collect all user data
-        user_data = {
-            "user_id": x_user_id,
-            "exported_at": datetime.utcnow().isoformat(),
-            "profile": None,
-            "integrations": [],
-            "cards": [],
-            "analytics": [],
-            "competitors": [],
-            "ai_training": []
-        }
-        
-        # Get profile
-        profile = get_user_profile(x_user_id)
-        if profile:
-            # Don't export encrypted keys
-            profile_copy = profile.copy()
-            if 'openai_key' in profile_copy:
-                profile_copy['openai_key'] = "[ENCRYPTED]"
-            user_data["profile"] = profile_copy
-        
-        # Get integrations (without tokens)
-        integrations = get_user_integrations(x_user_id)
-        for integration in integrations:
-            integration_copy = integration.copy()
-            integration_copy['access_token'] = "[ENCRYPTED]"
-            if 'refresh_token' in integration_copy:
-                integration_copy['refresh_token'] = "[ENCRYPTED]"
-            user_data["integrations"].append(integration_copy)
-        
-        # Get cards
-        cards = supabase.table("task_cards").select("*").eq("user_id", x_user_id).execute().data
-        user_data["cards"] = cards or []
-        
-        # Get analytics
-        analytics = supabase.table("post_analytics").select("*").eq("user_id", x_user_id).execute().data
-        user_data["analytics"] = analytics or []
-        
-        # Get competitors
-        competitors = supabase.table("competitors").select("*").eq("user_id", x_user_id).execute().data
-        user_data["competitors"] = competitors or []
-        
-        # Get AI training
-        ai_training = supabase.table("ai_training").select("*").eq("user_id", x_user_id).execute().data
-        user_data["ai_training"] = ai_training or []
-        
-        return user_data
+        path = await write_zip(x_user_id)
     except Exception as e:
         logger.error(f"Data export error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(path, media_type="application/zip", filename=f"{filename}.zip", background=BackgroundTask(os.remove, path))
 
-@app.delete("/user/data/delete")
+@app.get("/user/data/export/download/{export_id}")
+async def download_user_export(export_id: str, x_user_id: str = Header(None)):
+    """Download a zip export built by an async export job"""
+    if not x_user_id:
+        raise HTTPException(status_code=401)
+    
+    path = pop_download(export_id, x_user_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return FileResponse(path, media_type="application/zip", filename=os.path.basename(path), background=BackgroundTask(os.remove, path))
+
+@app.delete("/user/data/delete", status_code=202)
 @limiter.limit("1/hour")
 async def delete_user_data(request: Request, x_user_id: str = Header(None)):
     """Delete all user data (GDPR - Right to be Forgotten)"""
@@ -1629,23 +1484,27 @@ async def delete_user_data(request: Request, x_user_id: str = Header(None)):
     if not supabase:
         raise HTTPException(status_code=500, detail="Database not available")
     
-    try:
-        # Delete all user data
-        supabase.table("task_cards").delete().eq("user_id", x_user_id).execute()
-        supabase.table("post_analytics").delete().eq("user_id", x_user_id).execute()
-        supabase.table("user_integrations").delete().eq("user_id", x_user_id).execute()
-        supabase.table("competitors").delete().eq("user_id", x_user_id).execute()
-        supabase.table("ai_training").delete().eq("user_id", x_user_id).execute()
-        supabase.table("competitor_posts").delete().eq("user_id", x_user_id).execute()
-        supabase.table("webhook_retries").delete().eq("user_id", x_user_id).execute()
-        supabase.table("payment_notifications").delete().eq("user_id", x_user_id).execute()
-        supabase.table("user_settings").delete().eq("user_id", x_user_id).execute()
-        supabase.table("user_accounts").delete().eq("user_id", x_user_id).execute()
-        
-        return {"status": "deleted", "message": "All user data has been deleted"}
-    except Exception as e:
-        logger.error(f"Data deletion error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # Purged in chunks by a background job; poll /jobs/{job_id} for progress
+    job = job_queue.submit(x_user_id, "data_purge", {})
+    return {"status": "deleting", "job_id": job["id"], "message": "Your data is being deleted"}
+
+async def purge_user_data_job(user_id: str, payload: dict) -> dict:
+    """Job handler: delete a user's rows chunk by chunk, reporting progress"""
+    deleted = {}
+    while True:
+        step = await asyncio.to_thread(purge_user_data_step, user_id)
+        if step["done"]:
+            break
+        deleted[step["table"]] = deleted.get(step["table"], 0) + step["deleted"]
+        report_progress({"table": step["table"], "deleted": dict(deleted)})
+    # Drop anything still cached for the account
+    quota_service.invalidate(user_id)
+    style_profiles.invalidate(user_id)
+    user_cache.invalidate(user_id)
+    logger.info(f"Purged data for user {user_id}: {deleted}")
+    return {"status": "deleted", "deleted": deleted}
+
+job_queue.register("data_purge", purge_user_data_job, internal=True)
 
 # --- ORCHESTRATION ENDPOINTS ---
 
@@ -1697,14 +1556,26 @@ async def link_pr_to_jira(request: Request, pr_number: int, repo: str, x_user_id
 
 @app.get("/notifications")
 @limiter.limit("30/minute")
-async def get_user_notifications(request: Request, unread_only: bool = Query(False), x_user_id: str = Header(None)):
+async def get_user_notifications(
+    request: Request,
+    unread_only: bool = Query(False),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    x_user_id: str = Header(None)
+):
     """Get notifications for user"""
     if not x_user_id:
         raise HTTPException(status_code=401)
     
+    if format == "ndjson":
+        return ndjson_response(iter_notifications(x_user_id, unread_only=unread_only))
+    
     try:
-        notifications = get_notifications(x_user_id, unread_only=unread_only)
-        return {"notifications": notifications, "count": len(notifications)}
+        notifications, next_cursor = get_notifications_page(x_user_id, unread_only=unread_only, limit=limit, cursor=cursor)
+        return {"notifications": notifications, "count": len(notifications), "next_cursor": next_cursor}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         logger.error(f"Get notifications error: {e}")
         return {"notifications": [], "count": 0}
@@ -1731,7 +1602,7 @@ async def mark_notification_as_read(request: Request, notification_id: str, x_us
         raise HTTPException(status_code=401)
     
     try:
-        mark_notification_read(notification_id)
+        mark_notification_read(notification_id, x_user_id)
         return {"status": "read"}
     except Exception as e:
         logger.error(f"Mark notification read error: {e}")
@@ -1751,6 +1622,29 @@ async def mark_all_as_read(request: Request, x_user_id: str = Header(None)):
         logger.error(f"Mark all read error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/notifications/broadcast")
+@limiter.limit("10/minute")
+async def broadcast_notification(request: Request, payload: BulkNotificationPayload, x_admin_token: str = Header(None)):
+    """Fan a system notification out to a list of users or a selector (outages, maintenance, shared project events)"""
+    if not NOTIFICATIONS_ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, NOTIFICATIONS_ADMIN_TOKEN):
+        raise HTTPException(status_code=403)
+    if bool(payload.user_ids) == bool(payload.selector):
+        raise HTTPException(status_code=400, detail="Provide exactly one of user_ids or selector")
+    
+    try:
+        result = await asyncio.to_thread(
+            create_notifications_bulk,
+            payload.user_ids or payload.selector,
+            payload.type, payload.title, payload.message, payload.severity,
+            payload.action_url, payload.metadata, payload.coalesce_key, payload.coalesce_window
+        )
+        return {"status": "sent", **result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Broadcast notification error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # --- AI REPHRASE ENDPOINT ---
 
 class RephrasePayload(BaseModel):
@@ -1785,15 +1679,10 @@ async def rephrase_content(request: Request, payload: RephrasePayload, x_user_id
     max_tokens = length_map.get(length, 200)
     
     try:
-        client = OpenAI(api_key=key_to_use)
-        prompt = f"Rephrase this content in a {tone} tone, keeping it {length} length:\n\n{payload.content}"
-        
+        client = openai_client(key_to_use)
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You are a content rephrasing expert. Maintain the original meaning while improving clarity and engagement. Tone: {tone}."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=REPHRASE.render("gpt-4o-mini", style=style_prompt(x_user_id), tone=tone, length=length, content=payload.content),
             max_tokens=max_tokens
         )
         
@@ -1812,8 +1701,12 @@ async def combine_sources(payload: MultiSourcePayload, x_user_id: str = Header(N
     if not x_user_id:
         raise HTTPException(status_code=401)
     
+    return run_combine_sources(payload, x_user_id)
+
+def run_combine_sources(payload: MultiSourcePayload, x_user_id: str) -> dict:
+    """Combine sources with the user's AI settings (shared by the endpoint and jobs)"""
     # Check usage limits
-    daily_usage = get_ai_usage_today(x_user_id)
+    daily_usage = quota_service.get_usage_today(x_user_id)
     profile = get_user_profile(x_user_id)
     daily_limit = profile.get("daily_ai_limit", 50) if profile else 50
     
@@ -1829,20 +1722,15 @@ async def combine_sources(payload: MultiSourcePayload, x_user_id: str = Header(N
     # Get preferences
     preferences = get_user_ai_preferences(x_user_id)
     
-    # Combine sources based on strategy
-    sources_text = "\n".join([f"Source {i+1}: {s.get('content', '')}" for i, s in enumerate(payload.sources)])
-    
+    # Combine sources based on strategy, fitting them into the model's token budget
     tone = preferences.get('tone', 'professional') if preferences else 'professional'
-    prompt = f"Combine these sources into a cohesive post ({tone} tone):\n{sources_text}\n\nStrategy: {payload.combine_strategy}"
+    messages = build_combine_sources_prompt(payload.sources, tone, payload.combine_strategy, "gpt-4o-mini", style_prompt(x_user_id))
     
     try:
-        client = OpenAI(api_key=key_to_use)
+        client = openai_client(key_to_use)
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a content curator combining multiple sources."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             max_tokens=400
         )
         content = response.choices[0].message.content.strip()
@@ -1853,6 +1741,48 @@ async def combine_sources(payload: MultiSourcePayload, x_user_id: str = Header(N
         logger.error(f"Multi-source combine error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- BACKGROUND JOBS ---
+
+async def image_generate_job(user_id: str, payload: dict) -> dict:
+    return await run_image_generation(ImageGeneratePayload(**payload))
+
+async def combine_sources_job(user_id: str, payload: dict) -> dict:
+    # The OpenAI client is synchronous; keep it off the event loop
+    return await asyncio.to_thread(run_combine_sources, MultiSourcePayload(**payload), user_id)
+
+job_queue.register("image_generate", image_generate_job)
+job_queue.register("combine_sources", combine_sources_job)
+job_queue.register("data_export", export_job, internal=True)
+
+@app.post("/jobs")
+@limiter.limit("30/minute")
+async def submit_job(request: Request, payload: JobSubmitPayload, x_user_id: str = Header(None)):
+    """Queue a long-running AI generation and return its job id"""
+    if not x_user_id:
+        raise HTTPException(status_code=401)
+    
+    if payload.type not in job_queue.job_types:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {payload.type}")
+    if payload.callback_url:
+        try:
+            await check_public_url(payload.callback_url)
+        except UnsafeURLError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid callback_url: {e}")
+    
+    job = job_queue.submit(x_user_id, payload.type, payload.payload, payload.callback_url, payload.notify)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, x_user_id: str = Header(None)):
+    """Get job status and, once finished, its result"""
+    if not x_user_id:
+        raise HTTPException(status_code=401)
+    
+    job = job_queue.get(job_id, x_user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # --- ENHANCED ACTION EXECUTE WITH ANALYTICS ---
 
 # Update the existing execute_action to save analytics
\ No newline at end of file
@@ -0,0 +1,268 @@
+"""
+Server-side meme rendering
+
+Memes are drawn with Pillow in a small process pool, so text layout and
+encoding never run on the event loop:
+
+- template images are downloaded once into MEME_TEMPLATE_DIR, and every
+  worker decodes them when it starts; a render only copies the in-memory
+  template and draws on it;
+- fonts are loaded once per size per worker; text is upper-cased,
+  word-wrapped and shrunk until it fits its box;
+- rendered memes are written to the image cache under the SHA-256 of their
+  bytes and served from /images, and an LRU keyed by (template_id,
+  top_text, bottom_text) answers repeated edits without rendering again.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import httpx
+from fastapi import HTTPException
+
+from app.images import IMAGE_BASE_URL, IMAGE_DIR, image_url
+
+logger = logging.getLogger("CovalynceMemes")
+
+MEME_TEMPLATE_DIR = os.getenv("MEME_TEMPLATE_DIR") or os.path.join(IMAGE_DIR, "meme_templates")
+MEME_FONT = os.getenv("MEME_FONT")  # path to a TrueType font; Impact or DejaVu Sans Bold otherwise
+MEME_WORKERS = int(os.getenv("MEME_WORKERS", "2"))
+MEME_CACHE_SIZE = 1024  # rendered memes remembered by (template, texts)
+MEME_MAX_TEXT = 200
+MEME_MIN_FONT = 12
+MEME_QUALITY = 85
+MEME_MAX_WIDTH = 800  # templates are scaled down to this when decoded; plenty for a post image
+
+# id -> template; text boxes are (left, top, width, height) as fractions of the image, top text first
+MEME_TEMPLATES = {
+    "1": {
+        "name": "Drake Pointing",
+        "template": "drake",
+        "source": "https://i.imgflip.com/30b1gx.jpg",
+        "boxes": ((0.5, 0.0, 0.5, 0.5), (0.5, 0.5, 0.5, 0.5)),
+    },
+    "2": {
+        "name": "Distracted Boyfriend",
+        "template": "distracted",
+        "source": "https://i.imgflip.com/1ur9b0.jpg",
+        "boxes": ((0.0, 0.0, 1.0, 0.22), (0.0, 0.78, 1.0, 0.22)),
+    },
+}
+
+_FONT_CANDIDATES = ("impact.ttf", "Impact.ttf", "DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf")
+
+# Per worker process: decoded templates, filled by _init_worker
+_templates: dict = {}
+
+
+def _init_worker(paths: dict):
+    """Decode every template once when a worker starts"""
+    from PIL import Image
+    for template_id, path in paths.items():
+        try:
+            with Image.open(path) as img:
+                img.draft("RGB", (MEME_MAX_WIDTH, MEME_MAX_WIDTH))
+                img = img.convert("RGB")
+            if img.width > MEME_MAX_WIDTH:
+                img = img.resize((MEME_MAX_WIDTH, round(img.height * MEME_MAX_WIDTH / img.width)), Image.LANCZOS)
+            _templates[template_id] = img
+        except Exception:
+            # Template missing (offline first start): render on a plain canvas rather than fail
+            _templates[template_id] = Image.new("RGB", (600, 600), (40, 40, 40))
+    for size in (24, 36, 48):
+        _font(size)
+
+
+@lru_cache(maxsize=64)
+def _font(size: int):
+    from PIL import ImageFont
+    for candidate in ((MEME_FONT,) if MEME_FONT else ()) + _FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def _wrap(text: str, font, width: int) -> list:
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if line and font.getlength(candidate) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _fit(text: str, width: int, height: int) -> tuple:
+    """Largest font size (and its lines) at which the wrapped text fits the box"""
+    size = max(MEME_MIN_FONT, min(height // 2, width // 6))
+    while True:
+        font = _font(size)
+        lines = _wrap(text, font, width)
+        fits = len(lines) * size * 1.15 <= height and all(font.getlength(l) <= width for l in lines)
+        if fits or size <= MEME_MIN_FONT:
+            return font, lines, size
+        size = max(MEME_MIN_FONT, int(size * 0.85))
+
+
+def render_meme(template_id: str, top_text: str, bottom_text: str) -> bytes:
+    """Draw the texts onto a template and return JPEG bytes (runs in a worker process)"""
+    from PIL import ImageDraw
+
+    img = _templates[template_id].copy()
+    draw = ImageDraw.Draw(img)
+    for text, (left, top, box_w, box_h) in zip((top_text, bottom_text), MEME_TEMPLATES[template_id]["boxes"]):
+        text = " ".join(text.upper().split())
+        if not text:
+            continue
+        pad = int(img.width * 0.02)
+        x, y = int(left * img.width) + pad, int(top * img.height) + pad
+        width, height = int(box_w * img.width) - 2 * pad, int(box_h * img.height) - 2 * pad
+        font, lines, size = _fit(text, width, height)
+        line_height = size * 1.15
+        y += (height - len(lines) * line_height) / 2
+        for line in lines:
+            draw.text(
+                (x + width / 2, y), line, font=font, anchor="ma", fill="white",
+                stroke_width=max(1, size // 15), stroke_fill="black",
+            )
+            y += line_height
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=MEME_QUALITY)
+    return out.getvalue()
+
+
+def _warm(_: int) -> bool:
+    return bool(_templates)
+
+
+class MemeRenderer:
+    """Process-pool renderer with an LRU of finished memes"""
+
+    def __init__(self, workers: int = MEME_WORKERS, cache_size: int = MEME_CACHE_SIZE, out_dir: str = IMAGE_DIR):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.out_dir = out_dir
+        self._pool: ProcessPoolExecutor | None = None
+        self._ready: asyncio.Task | None = None
+        self._paths: dict = {}
+        self._cache: OrderedDict = OrderedDict()  # (template_id, top, bottom) -> file name
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.renders = 0
+        self.hits = 0
+
+    def start(self):
+        """Fetch templates and spin the workers up in the background, so the first edit is already warm"""
+        if self._ready is None:
+            self._ready = asyncio.create_task(self._prepare())
+
+    async def stop(self):
+        if self._ready is not None and not self._ready.done():
+            self._ready.cancel()
+            await asyncio.gather(self._ready, return_exceptions=True)
+        self._ready = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def templates() -> list:
+        return [
+            {"id": template_id, "name": t["name"], "image_url": t["source"], "template": t["template"]}
+            for template_id, t in MEME_TEMPLATES.items()
+        ]
+
+    async def render(self, template_id: str, top_text: str, bottom_text: str) -> str:
+        """URL of the rendered meme; raises KeyError for an unknown template"""
+        if template_id not in MEME_TEMPLATES:
+            raise KeyError(template_id)
+        if not IMAGE_BASE_URL:
+            # Rendered memes only exist in the local cache; without a public URL nobody could load them
+            raise HTTPException(status_code=503, detail="Image hosting not configured (IMAGE_BASE_URL)")
+        key = (template_id, top_text[:MEME_MAX_TEXT], bottom_text[:MEME_MAX_TEXT])
+        name = self._cache.get(key)
+        if name is not None and os.path.exists(os.path.join(self.out_dir, name)):
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return image_url(name)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._render(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return image_url(await asyncio.shield(task))
+
+    async def _render(self, key: tuple) -> str:
+        self.start()
+        await self._ready
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(self._executor(), render_meme, *key)
+        except BrokenProcessPool:
+            self._pool = None
+            raise
+        name = f"{hashlib.sha256(data).hexdigest()}.jpg"
+        await asyncio.to_thread(self._write, name, data)
+        self.renders += 1
+        self._cache[key] = name
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return name
+
+    def _write(self, name: str, data: bytes):
+        path = os.path.join(self.out_dir, name)
+        if os.path.exists(path):
+            return
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    async def _prepare(self):
+        os.makedirs(MEME_TEMPLATE_DIR, exist_ok=True)
+        os.makedirs(self.out_dir, exist_ok=True)
+        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as http:
+            for template_id, template in MEME_TEMPLATES.items():
+                path = os.path.join(MEME_TEMPLATE_DIR, f"{template['template']}{os.path.splitext(template['source'])[1]}")
+                if not os.path.exists(path):
+                    try:
+                        resp = await http.get(template["source"])
+                        resp.raise_for_status()
+                        await asyncio.to_thread(self._save_template, path, resp.content)
+                    except Exception as e:
+                        logger.warning(f"Could not fetch meme template {template['template']}: {e}")
+                self._paths[template_id] = path
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*(loop.run_in_executor(pool, _warm, i) for i in range(self.workers)))
+
+    @staticmethod
+    def _save_template(path: str, data: bytes):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(dict(self._paths),),
+            )
+        return self._pool
+
+
+meme_renderer = MemeRenderer()
@@ -0,0 +1,299 @@
+"""
+Request metrics, hot-path instrumentation and on-demand profiling
+
+Every request gets a RequestStats in a contextvar. Supabase (PostgREST) calls
+and outbound HTTP calls are timed at the httpx transport, LLM calls at the
+OpenAI SDK (hooked when providers.py first imports it), and each is added both to the request's stats and to
+process-wide Prometheus histograms served on /metrics. When a request
+finishes its breakdown is logged as one JSON line.
+
+Sending `X-Profile: <PROFILE_TOKEN>` profiles that single request (with
+pyinstrument if installed, else cProfile) and returns the report instead of
+the normal response.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger("CovalynceMetrics")
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # bearer token for /metrics (localhost only if unset)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # X-Profile value that enables profiling (disabled if unset)
+METRICS_LOG_REQUESTS = os.getenv("METRICS_LOG_REQUESTS", "true").lower() != "false"
+# Fail any request that blocked the event loop longer than this (for tests/CI; off if unset)
+LOOP_BLOCK_STRICT_MS = float(os.getenv("LOOP_BLOCK_STRICT_MS") or 0)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+_SUPABASE_HOST = urlparse(os.getenv("SUPABASE_URL") or "").hostname
+# Outbound histogram hosts are grouped by service: feed and callback URLs come from users, so raw hosts are unbounded
+_HTTP_SERVICES = (
+    ("openai.com", "openai"), ("x.ai", "xai"), ("linkedin.com", "linkedin"), ("slack.com", "slack"),
+    ("razorpay.com", "razorpay"), ("github.com", "github"), ("googleapis.com", "google"),
+    ("facebook.com", "facebook"), ("twitter.com", "twitter"),
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for label_values, series in items:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "API request latency", ("method", "route", "status"))
+REQUEST_DB_CALLS = Histogram("http_request_db_calls", "Database calls per API request", ("route",), COUNT_BUCKETS)
+DB_LATENCY = Histogram("db_call_duration_seconds", "Supabase/PostgREST call latency", ("table", "method"))
+HTTP_LATENCY = Histogram("http_client_duration_seconds", "Outbound HTTP call latency", ("host",))
+LLM_LATENCY = Histogram("llm_call_duration_seconds", "LLM call latency", ("model",))
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay of a periodic event-loop heartbeat", ())
+LOOP_BLOCK = Histogram("event_loop_block_seconds", "Event-loop callbacks that ran past the blocking threshold", ("route",))
+METRICS = [REQUEST_LATENCY, REQUEST_DB_CALLS, DB_LATENCY, HTTP_LATENCY, LLM_LATENCY, LOOP_LAG, LOOP_BLOCK]
+
+
+class RequestStats:
+    """Per-request call counts and durations, keyed by kind and target"""
+
+    def __init__(self):
+        self.calls: dict[tuple, list] = {}  # (kind, target) -> [count, seconds]
+        self.scope = None  # ASGI scope, for resolving the route mid-request
+        self.max_loop_block = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, target: str, seconds: float):
+        with self._lock:
+            entry = self.calls.setdefault((kind, target), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, kind: str) -> int:
+        return sum(c for (k, _), (c, _) in self.calls.items() if k == kind)
+
+    def summary(self) -> dict:
+        out: dict = {}
+        for (kind, target), (count, seconds) in sorted(self.calls.items()):
+            out.setdefault(kind, {})[target] = {"count": count, "ms": round(seconds * 1000, 2)}
+        return out
+
+
+_request_stats: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+
+def _record(kind: str, target: str, seconds: float):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add(kind, target, seconds)
+
+
+def record_db(table: str, method: str, seconds: float):
+    DB_LATENCY.observe(seconds, table, method)
+    _record("db", table, seconds)
+
+
+def http_service(host: str) -> str:
+    """Fixed metrics label for an outbound host"""
+    if host and host == _SUPABASE_HOST:
+        return "supabase"
+    for suffix, service in _HTTP_SERVICES:
+        if host == suffix or host.endswith("." + suffix):
+            return service
+    return "other"
+
+
+def record_http(host: str, seconds: float):
+    HTTP_LATENCY.observe(seconds, http_service(host))
+    _record("http", host, seconds)  # the per-request log line keeps the real host
+
+
+def record_llm(model: str, seconds: float):
+    LLM_LATENCY.observe(seconds, model)
+    _record("llm", model, seconds)
+
+
+def record_loop_block(seconds: float, context=None):
+    """Attribute a slow event-loop callback to the request whose context it ran in"""
+    stats = context.get(_request_stats) if context is not None else None
+    if stats is not None:
+        stats.add("loop", "blocked", seconds)
+        stats.max_loop_block = max(stats.max_loop_block, seconds)
+    LOOP_BLOCK.observe(seconds, _route_of(stats.scope) if stats else "background")
+
+
+# --- Instrumentation hooks ---
+
+def _record_transport(request, seconds: float):
+    host = request.url.host
+    if host == _SUPABASE_HOST and "/rest/v1/" in request.url.path:
+        record_db(request.url.path.split("/rest/v1/", 1)[1].split("/", 1)[0], request.method, seconds)
+    else:
+        record_http(host, seconds)
+
+
+def _instrument_httpx():
+    import httpx
+    if getattr(httpx.HTTPTransport, "_covalynce_instrumented", False):
+        return
+    sync_handle = httpx.HTTPTransport.handle_request
+    async_handle = httpx.AsyncHTTPTransport.handle_async_request
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        try:
+            return sync_handle(self, request)
+        finally:
+            _record_transport(request, time.perf_counter() - started)
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        try:
+            return await async_handle(self, request)
+        finally:
+            _record_transport(request, time.perf_counter() - started)
+
+    httpx.HTTPTransport.handle_request = handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+    httpx.HTTPTransport._covalynce_instrumented = True
+
+
+def _timed_llm(create, default_model: str):
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return create(self, *args, **kwargs)
+        finally:
+            record_llm(kwargs.get("model") or default_model, time.perf_counter() - started)
+    wrapper._covalynce_instrumented = True
+    return wrapper
+
+
+def instrument_openai():
+    """Time OpenAI SDK calls; called when the SDK is first imported (see providers.py)"""
+    try:
+        from openai.resources.chat.completions import Completions
+        from openai.resources.images import Images
+    except ImportError:
+        return
+    if not getattr(Completions.create, "_covalynce_instrumented", False):
+        Completions.create = _timed_llm(Completions.create, "unknown")
+    if not getattr(Images.generate, "_covalynce_instrumented", False):
+        Images.generate = _timed_llm(Images.generate, "dall-e")
+
+
+def instrument():
+    """Install the httpx hooks (idempotent); OpenAI is hooked lazily by instrument_openai()"""
+    _instrument_httpx()
+
+
+# --- Middleware, exposition and profiling ---
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _route_of(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+async def metrics_middleware(request, call_next):
+    """Time the request, attribute its DB/HTTP/LLM calls and log the breakdown"""
+    profile = PROFILE_TOKEN and request.headers.get("x-profile") == PROFILE_TOKEN
+    if profile:
+        return await _profile_request(request, call_next)
+
+    stats = RequestStats()
+    stats.scope = request.scope
+    token = _request_stats.set(stats)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        if LOOP_BLOCK_STRICT_MS and stats.max_loop_block * 1000 > LOOP_BLOCK_STRICT_MS:
+            from fastapi.responses import JSONResponse
+            logger.error(f"{request.method} {_route_of(request.scope)} blocked the event loop for {stats.max_loop_block * 1000:.0f} ms")
+            response = JSONResponse(status_code=500, content={
+                "detail": f"Request blocked the event loop for {stats.max_loop_block * 1000:.0f} ms (limit {LOOP_BLOCK_STRICT_MS:.0f} ms)"
+            })
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _request_stats.reset(token)
+        route = _route_of(request.scope)
+        REQUEST_LATENCY.observe(elapsed, request.method, route, str(status))
+        REQUEST_DB_CALLS.observe(stats.count("db"), route)
+        if METRICS_LOG_REQUESTS and route != "/metrics":
+            logger.info(json.dumps({
+                "event": "request", "method": request.method, "route": route, "status": status,
+                "ms": round(elapsed * 1000, 2), **stats.summary(),
+            }))
+
+
+async def _profile_request(request, call_next):
+    from fastapi.responses import HTMLResponse, PlainTextResponse
+    html = request.headers.get("x-profile-format") == "html"
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler is not None:
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        try:
+            await call_next(request)
+        finally:
+            profiler.stop()
+        return HTMLResponse(profiler.output_html()) if html else PlainTextResponse(profiler.output_text(unicode=True))
+
+    # cProfile fallback: deterministic, and sees everything else the event loop runs meanwhile
+    import cProfile
+    import io
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await call_next(request)
+    finally:
+        profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+    return PlainTextResponse(out.getvalue())
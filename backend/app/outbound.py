@@ -0,0 +1,64 @@
+"""
+Outbound requests to user-supplied URLs
+
+Job callbacks and competitor feeds are fetched server-side from URLs users
+give us, so those URLs must not reach the backend's own network: the host
+is resolved and every address it resolves to has to be public (no
+loopback, private, link-local, shared or reserved ranges, which also rules
+out cloud metadata endpoints). Redirects are followed by hand so each hop
+is checked the same way.
+"""
+import asyncio
+import ipaddress
+import socket
+from urllib.parse import urlsplit
+
+import httpx
+
+OUTBOUND_MAX_REDIRECTS = 5
+
+
+class UnsafeURLError(ValueError):
+    """A URL that must not be requested from the server"""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_public_url(url: str, schemes: tuple = ("https",)) -> str:
+    """Return url if it uses an allowed scheme and resolves only to public addresses; raise UnsafeURLError otherwise"""
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        raise UnsafeURLError("Malformed URL")
+    if parts.scheme not in schemes:
+        raise UnsafeURLError(f"URL must use {' or '.join(schemes)}")
+    if not parts.hostname:
+        raise UnsafeURLError("URL has no host")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, port or (443 if parts.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except (socket.gaierror, UnicodeError):
+        raise UnsafeURLError(f"Cannot resolve {parts.hostname}")
+    if not infos or not all(_is_public(info[4][0]) for info in infos):
+        raise UnsafeURLError(f"{parts.hostname} is not a public address")
+    return url
+
+
+async def get_public(http: httpx.AsyncClient, url: str, headers: dict = None, schemes: tuple = ("https",),
+                     max_redirects: int = OUTBOUND_MAX_REDIRECTS) -> httpx.Response:
+    """GET a user-supplied URL, checking it and every redirect target with check_public_url"""
+    for _ in range(max_redirects + 1):
+        await check_public_url(url, schemes)
+        resp = await http.get(url, headers=headers, follow_redirects=False)
+        location = resp.headers.get("Location")
+        if not resp.is_redirect or not location:
+            return resp
+        url = str(resp.url.join(location))
+    raise UnsafeURLError("Too many redirects")
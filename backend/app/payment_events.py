@@ -0,0 +1,225 @@
+"""
+Razorpay webhook event processing
+
+The webhook handler only verifies the signature, records the event in
+payment_events (keyed by Razorpay's event id, so redeliveries are dropped)
+and acknowledges. The work itself (fetching the payment, upgrading the
+plan, saving the payment notification) runs here on background workers:
+
+- events for one user are handled one at a time, in arrival order, while
+  different users are processed concurrently;
+- each attempt first claims the row (PENDING -> PROCESSING with a lease),
+  so another worker process recovering the same event skips it;
+- failed attempts are retried with backoff, then marked FAILED; a captured
+  payment that can't be tied to a user is marked FAILED at once and logged
+  for manual review;
+- on startup and every PAYMENT_EVENT_LEASE seconds after, PENDING events
+  and PROCESSING events whose lease expired are reloaded, so nothing
+  acknowledged is lost across restarts.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from app.database import (
+    claim_payment_event, finish_payment_event, get_unfinished_payment_events,
+    record_payment_event, save_payment_notification, upgrade_user_plan,
+)
+from app.payments import razorpay_api
+
+logger = logging.getLogger("CovalyncePaymentEvents")
+
+PAYMENT_EVENT_WORKERS = 4
+PAYMENT_EVENT_MAX_ATTEMPTS = 5
+PAYMENT_EVENT_BACKOFF = 2.0  # seconds, doubled per attempt
+PAYMENT_EVENT_LEASE = 120  # seconds a claimed event stays locked to its worker
+PAYMENT_EVENT_SEEN = 10000  # event ids remembered in memory (dedup without a database)
+
+PAYMENT_EVENT_TYPES = {"payment.captured", "payment.failed", "subscription.activated", "subscription.charged"}
+
+
+class PaymentEventError(Exception):
+    """An event that can never be applied; it is marked FAILED without retrying"""
+
+
+def event_user_id(event: dict) -> str:
+    """User an event belongs to, from the notes set on the order/subscription"""
+    event_type = event.get("event")
+    if event_type and event_type.startswith("subscription."):
+        subscription = event.get("payload", {}).get("subscription", {}).get("entity", {})
+        return (subscription.get("notes") or {}).get("user_id") or "unknown"
+    payment = event.get("payload", {}).get("payment", {}).get("entity", {})
+    user_id = (payment.get("notes") or {}).get("user_id")
+    if not user_id and event_type == "payment.captured":
+        # Older orders carried no notes; fall back to the order id suffix
+        user_id = (payment.get("order_id") or "").split("_")[-1]
+    return user_id or "unknown"
+
+
+class PaymentEventProcessor:
+    """Per-user ordered consumer for recorded Razorpay events"""
+
+    def __init__(self, workers: int = PAYMENT_EVENT_WORKERS, max_attempts: int = PAYMENT_EVENT_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._user_queues: dict[str, deque] = {}
+        self._ready: asyncio.Queue | None = None  # users with queued events and none in flight
+        self._seen: OrderedDict = OrderedDict()
+        self._inflight: set = set()
+        self._tasks: list = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        for user_id, queue in self._user_queues.items():
+            if queue:
+                self._ready.put_nowait(user_id)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def ingest(self, event_id: str, event: dict) -> bool:
+        """Record and queue a verified webhook event; False if it is a duplicate"""
+        if event_id in self._seen:
+            return False
+        event_type = event.get("event")
+        user_id = event_user_id(event)
+        if not await asyncio.to_thread(record_payment_event, event_id, event_type, user_id, event):
+            self._remember(event_id)
+            return False
+        self._remember(event_id)
+        if event_type in PAYMENT_EVENT_TYPES:
+            self._enqueue({"event_id": event_id, "event_type": event_type, "user_id": user_id, "payload": event, "attempts": 0})
+        else:
+            await asyncio.to_thread(finish_payment_event, event_id, "DONE", 0)
+        return True
+
+    def _remember(self, event_id: str):
+        self._seen[event_id] = True
+        while len(self._seen) > PAYMENT_EVENT_SEEN:
+            self._seen.popitem(last=False)
+
+    def _enqueue(self, row: dict):
+        user_id = row["user_id"] or "unknown"
+        queue = self._user_queues.get(user_id)
+        if queue is None:
+            queue = self._user_queues[user_id] = deque()
+            if self._ready is not None:
+                self._ready.put_nowait(user_id)
+        queue.append(row)
+
+    async def _recover(self):
+        while True:
+            rows = await asyncio.to_thread(get_unfinished_payment_events)
+            known = self._inflight | {row["event_id"] for queue in self._user_queues.values() for row in queue}
+            rows = [row for row in rows if row["event_id"] not in known]
+            for row in rows:
+                self._remember(row["event_id"])
+                self._enqueue(row)
+            if rows:
+                logger.info(f"Recovered {len(rows)} unfinished payment events")
+            await asyncio.sleep(PAYMENT_EVENT_LEASE)
+
+    async def _worker(self, n: int):
+        while True:
+            user_id = await self._ready.get()
+            queue = self._user_queues[user_id]
+            row = queue.popleft()
+            self._inflight.add(row["event_id"])
+            try:
+                await self._process(row)
+            except Exception as e:
+                logger.error(f"Payment event worker {n} error: {e}")
+            finally:
+                self._inflight.discard(row["event_id"])
+                if queue:
+                    self._ready.put_nowait(user_id)
+                else:
+                    del self._user_queues[user_id]
+
+    async def _process(self, row: dict):
+        """Run one event to completion, retrying in place so later events for the user wait"""
+        event_id = row["event_id"]
+        attempts = row.get("attempts") or 0
+        while True:
+            if not await asyncio.to_thread(claim_payment_event, event_id, PAYMENT_EVENT_LEASE):
+                logger.info(f"Payment event {event_id} is held by another worker; skipping")
+                return
+            attempts += 1
+            try:
+                await handle_payment_event(row["event_type"], row["user_id"], row["payload"])
+            except PaymentEventError as e:
+                await asyncio.to_thread(finish_payment_event, event_id, "FAILED", attempts, str(e))
+                logger.error(f"Payment event {event_id} ({row['event_type']}) needs manual review: {e}")
+                return
+            except Exception as e:
+                final = attempts >= self.max_attempts
+                await asyncio.to_thread(finish_payment_event, event_id, "FAILED" if final else "PENDING", attempts, str(e))
+                if final:
+                    logger.error(f"Payment event {event_id} ({row['event_type']}) failed after {attempts} attempts: {e}")
+                    await on_payment_event_failed(row["event_type"], row["user_id"], row["payload"], str(e))
+                    return
+                delay = PAYMENT_EVENT_BACKOFF * (2 ** (attempts - 1))
+                logger.warning(f"Payment event {event_id} attempt {attempts} failed ({e}); retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                continue
+            await asyncio.to_thread(finish_payment_event, event_id, "DONE", attempts)
+            return
+
+
+def _payment_entity(event: dict) -> dict:
+    return event.get("payload", {}).get("payment", {}).get("entity", {})
+
+
+async def handle_payment_event(event_type: str, user_id: str, event: dict):
+    """Apply one event's effects; every branch is safe to repeat"""
+    if event_type == "payment.captured":
+        payment_data = _payment_entity(event)
+        payment_id = payment_data.get("id")
+        amount = payment_data.get("amount", 0) / 100  # Convert from paise to rupees
+        if not (payment_data.get("order_id") and payment_id):
+            return
+        if user_id == "unknown":
+            # Captured money we can't attribute: keep the event for follow-up instead of upgrading nobody
+            raise PaymentEventError(f"No user for captured payment {payment_id}")
+        # Confirm with Razorpay rather than trusting the webhook body alone
+        payment = await razorpay_api.fetch_payment(payment_id)
+        if payment.get("status") == "captured":
+            await asyncio.to_thread(upgrade_user_plan, user_id, "PRO")
+            await asyncio.to_thread(save_payment_notification, user_id, payment_id, amount, "INR", "SUCCESS")
+            logger.info(f"Upgraded user {user_id} to PRO plan")
+
+    elif event_type == "payment.failed":
+        payment_data = _payment_entity(event)
+        failure_reason = payment_data.get("error_description", "Payment failed")
+        if user_id == "unknown":
+            logger.warning(f"Payment {payment_data.get('id')} failed for an unknown user: {failure_reason}")
+            return
+        await asyncio.to_thread(
+            save_payment_notification, user_id, payment_data.get("id"), payment_data.get("amount", 0) / 100,
+            "INR", "FAILED", failure_reason,
+        )
+        logger.warning(f"Payment failed for user {user_id}: {failure_reason}")
+
+    elif event_type in ("subscription.activated", "subscription.charged"):
+        if user_id != "unknown":
+            await asyncio.to_thread(upgrade_user_plan, user_id, "PRO")
+            logger.info(f"Upgraded user {user_id} to PRO via subscription")
+
+
+async def on_payment_event_failed(event_type: str, user_id: str, event: dict, error: str):
+    if event_type == "payment.captured" and user_id != "unknown":
+        payment_data = _payment_entity(event)
+        await asyncio.to_thread(
+            save_payment_notification, user_id, payment_data.get("id"), payment_data.get("amount", 0) / 100,
+            "INR", "FAILED", error,
+        )
+
+
+payment_events = PaymentEventProcessor()
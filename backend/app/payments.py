@@ -0,0 +1,150 @@
+"""
+Razorpay adapter
+
+The handlers only need three Razorpay calls (create an order, fetch a
+payment, check a signature), so instead of the requests-based SDK, whose
+calls block the event loop, this talks to the REST API directly over one
+pooled httpx.AsyncClient. Requests have a timeout and are retried with
+backoff when that is safe: fetches on any transport error, 429 or 5xx;
+order creation only when the request never reached Razorpay (connect
+failures, 429), so a retry cannot create a second order.
+
+Signatures are checked locally with HMAC-SHA256, as the SDK does.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import random
+
+import httpx
+
+logger = logging.getLogger("CovalyncePayments")
+
+RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
+RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+RAZORPAY_API_URL = os.getenv("RAZORPAY_API_URL", "https://api.razorpay.com/v1")
+RAZORPAY_TIMEOUT = float(os.getenv("RAZORPAY_TIMEOUT_SECONDS", "10"))
+RAZORPAY_RETRIES = int(os.getenv("RAZORPAY_RETRIES", "2"))  # retries after the first attempt
+RAZORPAY_BACKOFF = 0.25  # seconds, doubled per retry
+RAZORPAY_MAX_CONNECTIONS = 20
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RazorpayError(Exception):
+    """A Razorpay API call failed (status_code is None when no response arrived)"""
+
+    def __init__(self, message: str, status_code: int | None = None, code: str | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+def _hmac_sha256(secret: str, message: bytes) -> str:
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_webhook_signature(body: bytes, signature: str | None, secret: str) -> bool:
+    """Check an X-Razorpay-Signature header against the raw webhook body"""
+    if not signature or not secret:
+        return False
+    return hmac.compare_digest(_hmac_sha256(secret, body), signature)
+
+
+class RazorpayClient:
+    """Async Razorpay REST client sharing one connection pool per event loop"""
+
+    def __init__(self, key_id: str | None, key_secret: str | None, base_url: str = RAZORPAY_API_URL,
+                 timeout: float = RAZORPAY_TIMEOUT, retries: int = RAZORPAY_RETRIES):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self._http: httpx.AsyncClient | None = None
+        self._loop = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.key_id and self.key_secret)
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._loop is not loop:
+            # A pool is tied to the loop it was opened on; tests and scripts may run several loops
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=(self.key_id or "", self.key_secret or ""),
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=RAZORPAY_MAX_CONNECTIONS, max_keepalive_connections=RAZORPAY_MAX_CONNECTIONS),
+            )
+            self._loop = loop
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._loop = None
+
+    async def _request(self, method: str, path: str, json: dict | None = None, idempotent: bool = True) -> dict:
+        if not self.configured:
+            raise RazorpayError("Razorpay credentials are not configured")
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                resp = await self._client().request(method, path, json=json)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = RazorpayError(f"Razorpay unreachable: {e!r}")
+            except httpx.TransportError as e:
+                # The request may have been processed; only safe to repeat reads
+                error = RazorpayError(f"Razorpay request failed: {e!r}")
+                if not idempotent:
+                    raise error from e
+            else:
+                if resp.status_code < 400:
+                    return resp.json()
+                error = self._error_from(resp)
+                if resp.status_code not in _RETRY_STATUSES or (not idempotent and resp.status_code != 429):
+                    raise error
+                retry_after = resp.headers.get("Retry-After")
+
+            if attempt >= self.retries:
+                raise error
+            delay = RAZORPAY_BACKOFF * (2 ** attempt) * (1 + random.random())
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            attempt += 1
+            logger.warning(f"Razorpay {method} {path} failed ({error}); retry {attempt}/{self.retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _error_from(resp: httpx.Response) -> RazorpayError:
+        try:
+            detail = resp.json().get("error", {})
+        except ValueError:
+            detail = {}
+        description = detail.get("description") or resp.text[:200] or resp.reason_phrase
+        return RazorpayError(f"Razorpay {resp.status_code}: {description}", resp.status_code, detail.get("code"))
+
+    async def create_order(self, amount: int, currency: str, receipt: str, notes: dict | None = None) -> dict:
+        data = {"amount": amount, "currency": currency, "receipt": receipt}
+        if notes:
+            data["notes"] = notes
+        return await self._request("POST", "/orders", json=data, idempotent=False)
+
+    async def fetch_payment(self, payment_id: str) -> dict:
+        return await self._request("GET", f"/payments/{payment_id}")
+
+    def verify_payment_signature(self, order_id: str, payment_id: str, signature: str | None) -> bool:
+        """Check the razorpay_signature returned by Checkout for an order/payment pair"""
+        if not signature or not self.key_secret:
+            return False
+        expected = _hmac_sha256(self.key_secret, f"{order_id}|{payment_id}".encode())
+        return hmac.compare_digest(expected, signature)
+
+
+razorpay_api = RazorpayClient(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
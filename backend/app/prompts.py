@@ -0,0 +1,212 @@
+"""
+Prompt assembly with precompiled templates and token budgeting
+
+Every prompt is a PromptTemplate: a fixed system prefix plus a user template,
+compiled once at import. Per-request values only ever go into the user
+message so the system prefix stays byte-identical across requests and
+provider-side prompt caching can hit. Source material is fitted into a
+per-model token budget before it is rendered; a prompt still over budget
+has its variable material cut, never the instructions around it.
+"""
+import re
+from functools import lru_cache
+from string import Template
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Input-token budgets per model (kept well under context windows to bound latency and cost)
+MODEL_INPUT_BUDGETS = {
+    "gpt-4o-mini": 3000,
+    "grok-beta": 3000,
+}
+DEFAULT_INPUT_BUDGET = 3000
+
+# tiktoken encodings by model prefix; anything else falls back to a character heuristic
+_MODEL_ENCODINGS = (
+    ("gpt-4o", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+)
+_CHARS_PER_TOKEN = 4
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_ELLIPSIS = " …"
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    for prefix, encoding in _MODEL_ENCODINGS:
+        if model.startswith(prefix):
+            try:
+                return tiktoken.get_encoding(encoding)
+            except Exception:
+                return None
+    return None
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Count tokens for a model (tiktoken when available, else ~4 chars/token)"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def count_message_tokens(messages: list, model: str = DEFAULT_MODEL) -> int:
+    """Approximate token count of a chat message list (content plus per-message overhead)"""
+    return sum(count_tokens(m["content"], model) + 4 for m in messages) + 2
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """Hard-truncate text to at most max_tokens"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens]).rstrip() + _ELLIPSIS
+    return text[:max_tokens * _CHARS_PER_TOKEN].rstrip() + _ELLIPSIS
+
+
+def condense(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """Shrink text to a token budget, keeping whole leading sentences where possible"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for sentence in _SENTENCE_SPLIT.split(text.strip()):
+        cost = count_tokens(sentence, model) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    if not kept:
+        # A single sentence is already over budget
+        return truncate_to_tokens(text, max_tokens, model)
+    return " ".join(kept) + _ELLIPSIS
+
+
+def fit_sources(sources: list, budget: int, model: str = DEFAULT_MODEL) -> list:
+    """Fit a list of source texts into a shared token budget
+
+    Short sources are kept whole; the remaining budget is split evenly across
+    the longer ones, which are condensed to their share.
+    """
+    sizes = [count_tokens(s, model) for s in sources]
+    if sum(sizes) <= budget:
+        return list(sources)
+
+    shares = [0] * len(sources)
+    remaining = budget
+    pending = sorted(range(len(sources)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending[0]
+        if sizes[i] <= share:
+            shares[i] = sizes[i]
+            remaining -= sizes[i]
+            pending.pop(0)
+        else:
+            for j in pending:
+                shares[j] = share
+            break
+
+    return [s if sizes[i] <= shares[i] else condense(s, shares[i], model) for i, s in enumerate(sources)]
+
+
+class PromptTemplate:
+    """A stable system prefix plus a precompiled user template"""
+
+    def __init__(self, name: str, system: str | None, user: str, max_input_tokens: int | None = None,
+                 truncate: tuple = ()):
+        self.name = name
+        self.system = system
+        self.user = Template(user)
+        self.max_input_tokens = max_input_tokens
+        # Placeholder names are resolved once here, not on every render
+        self.fields = {m.group("named") or m.group("braced") for m in Template.pattern.finditer(user)} - {None}
+        # Fields cut, in this order, when a render is over budget
+        self.truncate = truncate or tuple(sorted(self.fields))
+        self._fixed_user = self.user.safe_substitute({f: "" for f in self.fields})
+        self._overhead: dict[str, int] = {}
+
+    def budget(self, model: str = DEFAULT_MODEL) -> int:
+        return self.max_input_tokens or MODEL_INPUT_BUDGETS.get(model, DEFAULT_INPUT_BUDGET)
+
+    def overhead(self, model: str = DEFAULT_MODEL) -> int:
+        """Tokens used by the fixed parts of the template"""
+        if model not in self._overhead:
+            self._overhead[model] = count_message_tokens(self._messages(self._fixed_user), model)
+        return self._overhead[model]
+
+    def render(self, model: str = DEFAULT_MODEL, **fields) -> list:
+        """Render chat messages; over budget, the truncate fields are shortened in turn until it fits"""
+        values = {k: "" if v is None else str(v) for k, v in fields.items()}
+        budget = self.budget(model)
+        messages = self._messages(self.user.substitute(values))
+        for field in self.truncate:
+            excess = count_message_tokens(messages, model) - budget
+            while excess > 0 and values.get(field):
+                # The ellipsis and re-tokenized joins cost a token or two; loop until it really fits
+                values[field] = truncate_to_tokens(values[field], count_tokens(values[field], model) - excess - 2, model)
+                messages = self._messages(self.user.substitute(values))
+                excess = count_message_tokens(messages, model) - budget
+            if excess <= 0:
+                break
+        return messages
+
+    def _messages(self, user: str) -> list:
+        if self.system is None:
+            return [{"role": "user", "content": user}]
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": user}]
+
+
+MARKETING_COPY = PromptTemplate(
+    "marketing_copy",
+    "You are a marketing copywriter announcing engineering work for a software team.",
+    "Write a professional LinkedIn post about code pushed to '$repo_name' with message: '$commit_msg'. Under 200 chars. Use 'We'.",
+    truncate=("commit_msg", "repo_name"),
+)
+
+REPHRASE = PromptTemplate(
+    "rephrase",
+    "You are a content rephrasing expert. Maintain the original meaning while improving clarity and engagement.",
+    "${style}Tone: $tone.\nRephrase this content in a $tone tone, keeping it $length length:\n\n$content",
+    truncate=("content", "style"),
+)
+
+POST_EDIT = PromptTemplate(
+    "post_edit",
+    "You are a content editor. Apply the requested edits while maintaining quality.",
+    "${style}Edit this post: $content\n$tone_instruction\n$style_instruction\nEdits requested: $edits",
+    truncate=("content", "style", "edits"),
+)
+
+GROK_POST_EDIT = PromptTemplate(
+    "grok_post_edit",
+    "You are a sassy Hinglish content writer. Write catchy, engaging posts.",
+    "Rewrite this: $content",
+    truncate=("content",),
+)
+
+COMBINE_SOURCES = PromptTemplate(
+    "combine_sources",
+    "You are a content curator combining multiple sources.",
+    "${style}Combine these sources into a cohesive post ($tone tone):\n$sources\n\nStrategy: $strategy",
+    truncate=("sources", "style", "strategy"),
+)
+
+
+def build_combine_sources_prompt(sources: list, tone: str, strategy: str, model: str = DEFAULT_MODEL, style: str = "") -> list:
+    """Render the combine-sources prompt with every source fitted into the model's budget"""
+    texts = [str(s.get("content", "")) for s in sources]
+    labels = [f"Source {i+1}: " for i in range(len(texts))]
+    fixed = COMBINE_SOURCES.overhead(model) + count_tokens(style + tone + strategy, model) + sum(count_tokens(l, model) + 1 for l in labels)
+    fitted = fit_sources(texts, max(0, COMBINE_SOURCES.budget(model) - fixed), model)
+    sources_text = "\n".join(label + text for label, text in zip(labels, fitted))
+    return COMBINE_SOURCES.render(model, style=style, tone=tone, sources=sources_text, strategy=strategy)
@@ -0,0 +1,38 @@
+"""
+Provider SDK clients, imported and built on first use
+
+The OpenAI SDK is slow to import and was loaded by app.main at
+import time, which cold starts paid on every deploy. It is now imported
+the first time a client is asked for, and clients are cached so repeat
+calls reuse their connection pools. warm() preloads it off the event loop
+once the app is already serving.
+"""
+import logging
+import os
+from functools import lru_cache
+
+logger = logging.getLogger("CovalynceProviders")
+
+PROVIDERS_PREWARM = os.getenv("PROVIDERS_PREWARM", "true").lower() != "false"
+
+
+@lru_cache(maxsize=64)
+def openai_client(api_key: str):
+    """OpenAI client for an API key (one per key, reused across requests)"""
+    from openai import OpenAI
+    from app.metrics import instrument_openai
+    instrument_openai()
+    return OpenAI(api_key=api_key)
+
+
+def warm():
+    """Import the provider SDKs ahead of the first request that needs them"""
+    try:
+        import openai  # noqa: F401
+        from app.metrics import instrument_openai
+        instrument_openai()
+        from app.database import supabase
+        if supabase:
+            supabase.table  # builds the lazy client
+    except Exception as e:
+        logger.warning(f"Provider prewarm failed: {e}")
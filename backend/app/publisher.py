@@ -0,0 +1,197 @@
+"""
+Multi-platform publishing for approved cards
+
+publish() sends one card to every requested platform at once instead of
+one /action/execute round trip per platform. Each platform has an adapter
+that knows how to post; adapters share one HTTP client per publish, run
+concurrently under a per-platform timeout, and report a result instead of
+raising, so one failing platform does not cancel the others. The
+post_analytics rows for all platforms are then written in one insert.
+
+Provider metadata an adapter needs (the LinkedIn person URN) comes from
+the cached integration metadata; when it has to be looked up from the
+provider it is written back, so the lookup happens once per account rather
+than once per post.
+"""
+import asyncio
+import logging
+import os
+
+import httpx
+
+from app.database import get_card, get_integration_metadata, save_analytics_bulk, update_integration_metadata
+from app.slack_outbox import slack_outbox
+from app.tokens import TokenRefreshError, token_manager
+
+logger = logging.getLogger("CovalyncePublisher")
+
+SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
+PUBLISH_TIMEOUT = 20.0  # seconds per platform
+
+POSTED = "POSTED"
+PENDING = "PENDING"
+FAILED = "FAILED"
+
+
+class PublishError(Exception):
+    """A platform rejected the post; status_code is what the API caller should see"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PlatformAdapter:
+    """Posts a card's content to one platform and returns {status, post_id, ...}"""
+
+    name = "manual"
+
+    async def publish(self, http: httpx.AsyncClient, user_id: str, card_id: str, content: str) -> dict:
+        # No API for this platform: record the approval so analytics still count it
+        return {"status": POSTED}
+
+
+class LinkedInAdapter(PlatformAdapter):
+    name = "linkedin"
+
+    async def person_urn(self, http: httpx.AsyncClient, user_id: str, access_token: str) -> str | None:
+        metadata = await asyncio.to_thread(get_integration_metadata, user_id, "linkedin") or {}
+        if metadata.get("person_urn"):
+            return metadata["person_urn"]
+        try:
+            resp = await http.get("https://api.linkedin.com/v2/userinfo", headers={"Authorization": f"Bearer {access_token}"})
+            sub = resp.json().get("sub") if resp.status_code == 200 else None
+        except Exception as e:
+            logger.error(f"Could not fetch LinkedIn profile: {e}")
+            return None
+        if not sub:
+            return None
+        person_urn = f"urn:li:person:{sub}"
+        try:
+            await asyncio.to_thread(update_integration_metadata, user_id, "linkedin", {**metadata, "person_urn": person_urn})
+        except Exception as e:
+            logger.warning(f"Could not save LinkedIn URN: {e}")
+        return person_urn
+
+    async def _post(self, http: httpx.AsyncClient, token: str, post_data: dict) -> httpx.Response:
+        return await http.post(
+            "https://api.linkedin.com/v2/ugcPosts",
+            headers={"Authorization": f"Bearer {token}", "X-Restli-Protocol-Version": "2.0.0"},
+            json=post_data,
+        )
+
+    async def publish(self, http: httpx.AsyncClient, user_id: str, card_id: str, content: str) -> dict:
+        token = await token_manager.get_token(user_id, "linkedin")
+        if not token:
+            raise PublishError(400, "LinkedIn not connected")
+        if token.startswith("li_simulated_token_"):
+            logger.info(f"Simulated LinkedIn post for card {card_id}")
+            return {"status": PENDING, "note": "Simulated - configure LinkedIn credentials for real posting"}
+
+        person_urn = await self.person_urn(http, user_id, token)
+        if not person_urn:
+            raise PublishError(400, "Could not determine LinkedIn person URN")
+
+        post_data = {
+            "author": person_urn,
+            "lifecycleState": "PUBLISHED",
+            "specificContent": {
+                "com.linkedin.ugc.ShareContent": {
+                    "shareCommentary": {"text": content},
+                    "shareMediaCategory": "NONE"
+                }
+            },
+            "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
+        }
+        resp = await self._post(http, token, post_data)
+        if resp.status_code == 401:
+            # Revoked or expired early: refresh once and retry instead of failing the post
+            try:
+                token = await token_manager.refresh(user_id, "linkedin")
+            except TokenRefreshError:
+                pass
+            else:
+                resp = await self._post(http, token, post_data)
+        if resp.status_code not in (200, 201):
+            logger.error(f"LinkedIn API error: {resp.status_code} - {resp.text}")
+            raise PublishError(resp.status_code, f"LinkedIn API error: {resp.text}")
+        return {"status": POSTED, "post_id": resp.json().get("id")}
+
+
+def slack_card_message(card: dict, content: str = None) -> dict:
+    """Slack webhook payload announcing a card (content overrides the stored text)"""
+    return {
+        "text": f"🔧 Engineering Update: {card.get('title', 'New Task')}",
+        "blocks": [
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"🔧 {card.get('title', 'Engineering Task')}"
+                }
+            },
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*{card.get('subtitle', '')}*\n\n{content if content is not None else card.get('content', '')}"
+                }
+            },
+            {
+                "type": "context",
+                "elements": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Category: {card.get('category', 'ENG')} | Type: {card.get('type', 'TASK')}"
+                    }
+                ]
+            }
+        ]
+    }
+
+
+class SlackAdapter(PlatformAdapter):
+    name = "slack"
+
+    async def publish(self, http: httpx.AsyncClient, user_id: str, card_id: str, content: str) -> dict:
+        if not SLACK_WEBHOOK_URL:
+            raise PublishError(500, "Slack webhook not configured")
+        card = await asyncio.to_thread(get_card, user_id, card_id, "title, subtitle, category, type") or {}
+        # Delivered by the outbox (paced, merged with other updates, retried on failure)
+        slack_outbox.enqueue(SLACK_WEBHOOK_URL, slack_card_message(card, content), user_id)
+        return {"status": POSTED}
+
+
+ADAPTERS: dict[str, PlatformAdapter] = {a.name: a for a in (LinkedInAdapter(), SlackAdapter())}
+_DEFAULT_ADAPTER = PlatformAdapter()
+
+
+def register_adapter(adapter: PlatformAdapter):
+    ADAPTERS[adapter.name] = adapter
+
+
+async def _publish_one(adapter: PlatformAdapter, platform: str, http: httpx.AsyncClient,
+                       user_id: str, card_id: str, content: str) -> dict:
+    try:
+        result = await asyncio.wait_for(adapter.publish(http, user_id, card_id, content), PUBLISH_TIMEOUT)
+    except PublishError as e:
+        return {"platform": platform, "status": FAILED, "error": e.detail, "status_code": e.status_code}
+    except asyncio.TimeoutError:
+        logger.error(f"Publishing card {card_id} to {platform} timed out")
+        return {"platform": platform, "status": FAILED, "error": f"Timed out after {PUBLISH_TIMEOUT:.0f}s"}
+    except Exception as e:
+        logger.error(f"Failed to post to {platform}: {e}")
+        return {"platform": platform, "status": FAILED, "error": f"Posting failed: {str(e)}"}
+    return {"platform": platform, "post_id": None, **result}
+
+
+async def publish(user_id: str, card_id: str, content: str, platforms: list) -> list:
+    """Post a card to every platform concurrently and record one analytics row per platform"""
+    targets = list(dict.fromkeys(p.lower() for p in platforms if p))
+    async with httpx.AsyncClient(timeout=PUBLISH_TIMEOUT) as http:
+        results = await asyncio.gather(*(
+            _publish_one(ADAPTERS.get(p, _DEFAULT_ADAPTER), p, http, user_id, card_id, content) for p in targets
+        ))
+    await asyncio.to_thread(save_analytics_bulk, user_id, card_id, results)
+    return list(results)
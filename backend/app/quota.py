@@ -0,0 +1,224 @@
+"""
+In-memory AI quota counters
+
+Keeps per-user day/month AI usage counts in process memory so quota checks
+don't need a count="exact" scan over ai_usage_log on every request. Counters
+are seeded from the DB on first use, incremented by log_ai_usage, rolled over
+at UTC day/month boundaries and periodically reconciled against the DB to pick
+up usage recorded by other workers.
+
+ai_usage_log rows are written behind the request by the batch writer, so the
+DB trails this process by up to a flush interval. Rows still queued here are
+counted per user and added to every seed and reconcile, and so are rows the
+writer gave up on, for the rest of their day/month.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from app.batch_writer import batch_writer
+
+logger = logging.getLogger("CovalynceQuota")
+
+QUOTA_RECONCILE_INTERVAL = 300  # seconds between DB reconciliations per user
+QUOTA_IDLE_EVICT = 3600  # drop counters for users not seen for this long
+
+
+class _UsageCounter:
+    __slots__ = ("day_key", "day", "month_key", "month", "local", "reconciled_at", "seen_at")
+
+    def __init__(self, day_key, day: int, month_key, month: int):
+        self.day_key = day_key
+        self.day = day
+        self.month_key = month_key
+        self.month = month
+        self.local = 0  # increments applied in this process (monotonic)
+        self.reconciled_at = time.monotonic()
+        self.seen_at = self.reconciled_at
+
+
+def _period_keys(now: datetime = None):
+    now = now or datetime.utcnow()
+    return now.date(), (now.year, now.month)
+
+
+class QuotaService:
+    """Per-user cached AI usage counters"""
+
+    def __init__(self, reconcile_interval: int = QUOTA_RECONCILE_INTERVAL):
+        self.reconcile_interval = reconcile_interval
+        self._counters: dict[str, _UsageCounter] = {}
+        self._unflushed: Counter = Counter()  # user -> usage rows queued in the batch writer
+        self._lost: dict[str, _UsageCounter] = {}  # user -> usage whose rows the batch writer failed to insert
+        self._seeding: dict[str, int] = {}  # user -> usage recorded while their counter is being seeded
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: str) -> _UsageCounter:
+        """Read a user's day/month counts from the DB; raises if the DB can't be read"""
+        from app.database import count_ai_usage_since
+        now = datetime.utcnow()
+        day_key, month_key = _period_keys(now)
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        day = count_ai_usage_since(user_id, day_start.isoformat())
+        month = count_ai_usage_since(user_id, day_start.replace(day=1).isoformat())
+        return _UsageCounter(day_key, day, month_key, month)
+
+    def _roll(self, counter: _UsageCounter):
+        day_key, month_key = _period_keys()
+        if counter.day_key != day_key:
+            counter.day_key, counter.day = day_key, 0
+        if counter.month_key != month_key:
+            counter.month_key, counter.month = month_key, 0
+
+    def _not_in_db(self, user_id: str) -> tuple[int, int]:
+        """(day, month) usage this process knows of that the DB doesn't have; call with the lock held"""
+        unflushed = self._unflushed[user_id]
+        lost = self._lost.get(user_id)
+        if lost is None:
+            return unflushed, unflushed
+        self._roll(lost)
+        return unflushed + lost.day, unflushed + lost.month
+
+    def _get(self, user_id: str) -> _UsageCounter:
+        with self._lock:
+            counter = self._counters.get(user_id)
+        if counter is None:
+            # Cold user: one DB round trip to seed, then served from memory
+            with self._lock:
+                self._seeding.setdefault(user_id, 0)
+                extra_day, extra_month = self._not_in_db(user_id)
+            try:
+                loaded = self._load(user_id)
+            except Exception as e:
+                # Don't cache a seed we couldn't read; this request sees only local usage, the next one retries
+                logger.warning(f"Quota seed failed for {user_id}: {e}")
+                loaded = None
+            finally:
+                with self._lock:
+                    during = self._seeding.pop(user_id, 0)
+            if loaded is None:
+                day_key, month_key = _period_keys()
+                return _UsageCounter(day_key, extra_day + during, month_key, extra_month + during)
+            # Queued rows aren't in the DB yet; usage recorded during the load may be (counted high, never low)
+            loaded.day += extra_day + during
+            loaded.month += extra_month + during
+            with self._lock:
+                counter = self._counters.setdefault(user_id, loaded)
+        with self._lock:
+            self._roll(counter)
+            counter.seen_at = time.monotonic()
+        return counter
+
+    def get_usage(self, user_id: str) -> tuple[int, int]:
+        """Return (today, this_month) AI usage counts for a user"""
+        counter = self._get(user_id)
+        return counter.day, counter.month
+
+    def get_usage_today(self, user_id: str) -> int:
+        return self.get_usage(user_id)[0]
+
+    def get_usage_month(self, user_id: str) -> int:
+        return self.get_usage(user_id)[1]
+
+    def check(self, user_id: str, daily_limit: int, monthly_limit: int = None) -> bool:
+        """True if the user is still under their daily (and optional monthly) limit"""
+        day, month = self.get_usage(user_id)
+        if day >= daily_limit:
+            return False
+        return monthly_limit is None or month < monthly_limit
+
+    def record(self, user_id: str, count: int = 1, queued: bool = True):
+        """Count AI usage for a user; called from log_ai_usage (queued: its row is waiting in the batch writer)"""
+        with self._lock:
+            if queued:
+                self._unflushed[user_id] += count
+            counter = self._counters.get(user_id)
+            if counter is None:
+                # Not cached yet - the next read seeds from the DB plus the unflushed rows
+                if user_id in self._seeding:
+                    self._seeding[user_id] += count
+                return
+            self._roll(counter)
+            counter.day += count
+            counter.month += count
+            counter.local += count
+            counter.seen_at = time.monotonic()
+
+    def reconcile(self, user_id: str):
+        """Re-read a user's counts from the DB, keeping rows not in it and increments made while the query ran
+
+        A failed read raises and leaves the cached counter as it was.
+        """
+        with self._lock:
+            counter = self._counters.get(user_id)
+            if counter is None:
+                return
+            local_before = counter.local
+            extra_day, extra_month = self._not_in_db(user_id)
+        fresh = self._load(user_id)
+        with self._lock:
+            counter = self._counters.get(user_id)
+            if counter is None:
+                return
+            delta = counter.local - local_before
+            counter.day_key, counter.day = fresh.day_key, fresh.day + extra_day + delta
+            counter.month_key, counter.month = fresh.month_key, fresh.month + extra_month + delta
+            counter.reconciled_at = time.monotonic()
+
+    def flushed(self, rows: list, written: bool = True):
+        """Batch writer callback: these ai_usage_log rows are no longer queued (written: and are in the DB)"""
+        with self._lock:
+            for user_id, count in Counter(row["user_id"] for row in rows).items():
+                self._unflushed[user_id] -= count
+                if self._unflushed[user_id] <= 0:
+                    del self._unflushed[user_id]
+                if not written:
+                    # The usage happened even though its rows are gone; keep counting it locally
+                    day_key, month_key = _period_keys()
+                    lost = self._lost.setdefault(user_id, _UsageCounter(day_key, 0, month_key, 0))
+                    self._roll(lost)
+                    lost.day += count
+                    lost.month += count
+
+    def reconcile_stale(self):
+        """Reconcile counters older than the interval and evict idle users"""
+        now = time.monotonic()
+        with self._lock:
+            for user_id in [u for u, c in self._counters.items() if now - c.seen_at > QUOTA_IDLE_EVICT]:
+                del self._counters[user_id]
+            for user_id, lost in list(self._lost.items()):
+                self._roll(lost)
+                if not lost.month:
+                    del self._lost[user_id]
+            stale = [u for u, c in self._counters.items() if now - c.reconciled_at >= self.reconcile_interval]
+        for user_id in stale:
+            try:
+                self.reconcile(user_id)
+            except Exception as e:
+                logger.warning(f"Quota reconcile failed for {user_id}: {e}")
+
+    def invalidate(self, user_id: str = None):
+        """Drop cached counters for one user (or everyone)"""
+        with self._lock:
+            if user_id is None:
+                self._counters.clear()
+            else:
+                self._counters.pop(user_id, None)
+
+
+quota_service = QuotaService()
+batch_writer.on_flush("ai_usage_log", quota_service.flushed)
+
+
+async def reconcile_quota_counters():
+    """Background task to keep cached quota counters in line with ai_usage_log"""
+    while True:
+        try:
+            await asyncio.to_thread(quota_service.reconcile_stale)
+        except Exception as e:
+            logger.error(f"Quota reconciliation error: {e}")
+
+        await asyncio.sleep(60)
@@ -0,0 +1,213 @@
+"""
+Scheduled publishing
+
+Posts scheduled for later are stored in scheduled_posts, one row per
+(card, platform, publish_at). Each worker keeps only the next
+SCHEDULER_HORIZON seconds of them in an in-memory heap:
+
+- a loader pages the due window in from the database once every
+  SCHEDULER_RELOAD_INTERVAL seconds (keyset on (publish_at, id)), so tens
+  of thousands of far-future posts cost nothing until they come close;
+  posts scheduled on this worker inside the window go straight into the
+  heap;
+- the dispatcher sleeps until the heap's head is due (or it is woken by a
+  new earlier post), then pops every due post and claims them in one
+  conditional update (SCHEDULED -> PUBLISHING with a lease). Workers that
+  loaded the same rows lose the claim and skip them, so nothing is posted
+  twice;
+- claimed posts are grouped by card and handed to the publisher in one
+  publish() call per card. Failures are retried later, then marked FAILED;
+  posts whose worker died mid-publish are reclaimed when their lease
+  expires.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+
+from app.database import (
+    cancel_scheduled_post, claim_scheduled_posts, count_scheduled_posts, create_scheduled_posts, finish_scheduled_post,
+    get_scheduled_posts_before, get_stale_scheduled_posts, update_card_status,
+)
+from app.publisher import FAILED, publish
+
+logger = logging.getLogger("CovalynceScheduler")
+
+SCHEDULER_HORIZON = 600  # seconds of upcoming posts held in memory
+SCHEDULER_RELOAD_INTERVAL = 60  # seconds between window loads
+SCHEDULER_PAGE = 1000  # rows per window page
+SCHEDULER_MAX_LOADED = 50000  # cap on posts held in memory
+SCHEDULER_BATCH = 200  # due posts claimed per dispatch
+SCHEDULER_CONCURRENCY = 4  # dispatch batches in flight
+SCHEDULER_LEASE = 300  # seconds a claimed post stays locked to its worker
+SCHEDULER_MAX_ATTEMPTS = 3
+SCHEDULER_RETRY_DELAY = 300  # seconds before a failed post is tried again
+
+
+def to_iso(moment) -> str:
+    """Fixed-width UTC timestamp (sorts correctly as text too)"""
+    if not isinstance(moment, datetime):
+        moment = datetime.fromtimestamp(moment, timezone.utc)
+    elif moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class PostScheduler:
+    """Heap-based dispatcher over the upcoming window of scheduled_posts"""
+
+    def __init__(self):
+        self._heap: list = []  # (due timestamp, post id)
+        self._rows: dict = {}  # post id -> row, for posts in the heap
+        self._loaded_until = 0.0
+        self._wakeup: asyncio.Event | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._tasks: list = []
+        self._dispatches: set = set()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+        self._tasks = [asyncio.create_task(self._loader()), asyncio.create_task(self._dispatcher())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    async def schedule(self, user_id: str, card_id: str, content: str, platforms: list, publish_at: datetime) -> list:
+        """Persist one scheduled post per platform and return the rows"""
+        when = to_iso(publish_at)
+        rows = await asyncio.to_thread(create_scheduled_posts, [
+            {"user_id": user_id, "card_id": card_id, "platform": p, "content": content, "publish_at": when}
+            for p in dict.fromkeys(p.lower() for p in platforms if p)
+        ])
+        await asyncio.to_thread(update_card_status, card_id, "SCHEDULED")
+        if publish_at.timestamp() <= self._loaded_until:
+            for row in rows:
+                self._push(row)
+        return rows
+
+    def forget(self, post_id: str):
+        """Drop a cancelled post from the heap (its heap entry is skipped lazily)"""
+        self._rows.pop(post_id, None)
+
+    def _push(self, row: dict, due: float = None):
+        if row["id"] in self._rows:
+            return
+        self._rows[row["id"]] = row
+        heapq.heappush(self._heap, (due if due is not None else _timestamp(row["publish_at"]), row["id"]))
+        if self._wakeup is not None and self._heap[0][1] == row["id"]:
+            self._wakeup.set()
+
+    async def _loader(self):
+        while True:
+            try:
+                await self._load()
+            except Exception as e:
+                logger.error(f"Scheduled post load error: {e}")
+            await asyncio.sleep(SCHEDULER_RELOAD_INTERVAL)
+
+    async def _load(self):
+        now = time.time()
+        horizon = now + SCHEDULER_HORIZON
+        after = None
+        while len(self._rows) < SCHEDULER_MAX_LOADED:
+            page = await asyncio.to_thread(get_scheduled_posts_before, to_iso(horizon), after, SCHEDULER_PAGE)
+            for row in page:
+                self._push(row)
+            if len(page) < SCHEDULER_PAGE:
+                break
+            after = (page[-1]["publish_at"], page[-1]["id"])
+        else:
+            # Window truncated: only posts up to the last loaded one are known to be in memory
+            horizon = _timestamp(after[0]) if after else now
+        for row in await asyncio.to_thread(get_stale_scheduled_posts, to_iso(now)):
+            self._push(row, due=now)
+        self._loaded_until = horizon
+
+    async def _dispatcher(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < SCHEDULER_BATCH:
+                _, post_id = heapq.heappop(self._heap)
+                row = self._rows.pop(post_id, None)
+                if row is not None:
+                    due.append(row)
+            if due:
+                await self._slots.acquire()
+                task = asyncio.create_task(self._dispatch(due))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+                continue
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self, rows: list):
+        try:
+            now = datetime.now(timezone.utc)
+            claimed = await asyncio.to_thread(
+                claim_scheduled_posts, [r["id"] for r in rows], to_iso(now.timestamp() + SCHEDULER_LEASE), to_iso(now)
+            )
+            groups: dict = {}
+            for row in claimed:
+                groups.setdefault((row["user_id"], row["card_id"], row["content"]), []).append(row)
+            await asyncio.gather(*(self._publish_card(key, group) for key, group in groups.items()))
+        except Exception as e:
+            logger.error(f"Scheduled dispatch error: {e}")
+        finally:
+            self._slots.release()
+
+    async def _publish_card(self, key: tuple, rows: list):
+        user_id, card_id, content = key
+        results = await publish(user_id, card_id, content, [r["platform"] for r in rows])
+        by_platform = {r["platform"]: r for r in results}
+        posted = False
+        for row in rows:
+            result = by_platform.get(row["platform"].lower(), {"status": FAILED, "error": "No result"})
+            attempts = (row.get("attempts") or 0) + 1
+            if result["status"] != FAILED:
+                posted = True
+                await asyncio.to_thread(finish_scheduled_post, row["id"], "POSTED", attempts, None, result.get("post_id"))
+            elif attempts < SCHEDULER_MAX_ATTEMPTS:
+                retry_at = time.time() + SCHEDULER_RETRY_DELAY
+                await asyncio.to_thread(finish_scheduled_post, row["id"], "SCHEDULED", attempts, result.get("error"),
+                                        None, to_iso(retry_at))
+                if retry_at <= self._loaded_until:
+                    self._push({**row, "attempts": attempts, "publish_at": to_iso(retry_at)})
+            else:
+                logger.error(f"Scheduled post {row['id']} to {row['platform']} failed after {attempts} attempts: {result.get('error')}")
+                await asyncio.to_thread(finish_scheduled_post, row["id"], "FAILED", attempts, result.get("error"))
+        if posted:
+            await asyncio.to_thread(update_card_status, card_id, "APPROVED")
+
+
+async def cancel(user_id: str, post_id: str) -> dict | None:
+    """Cancel a scheduled post; the card goes back to the feed once none of its posts are pending"""
+    row = await asyncio.to_thread(cancel_scheduled_post, user_id, post_id)
+    if row is None:
+        return None
+    post_scheduler.forget(post_id)
+    if not await asyncio.to_thread(count_scheduled_posts, row["card_id"]):
+        await asyncio.to_thread(update_card_status, row["card_id"], "PENDING")
+    return row
+
+
+post_scheduler = PostScheduler()
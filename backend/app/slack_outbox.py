@@ -0,0 +1,208 @@
+"""
+Paced, coalescing delivery to Slack incoming webhooks
+
+Slack accepts about one message per second per incoming webhook and
+answers bursts with 429. Messages are therefore queued per webhook URL and
+sent by one worker per URL:
+
+- at most one request per SLACK_MIN_INTERVAL; whatever queued up in the
+  meantime goes out as a single digest (each message's blocks, separated
+  by dividers, up to Slack's 50-block limit);
+- a 429 puts the batch back at the head of the queue and the worker waits
+  for Retry-After; 5xx and network errors back off and retry;
+- messages that still cannot be delivered (or do not fit in the queue)
+  fall back to the persistent webhook_retries table. A digest Slack
+  rejects is split so one bad message cannot sink the others; a single
+  rejected message is logged and dropped.
+
+Payloads with fields other than text/blocks (attachments, username, ...)
+are never merged and go out on their own.
+"""
+import asyncio
+import logging
+from collections import deque
+
+import httpx
+
+from app.database import add_webhook_retry, update_webhook_retry_status
+
+logger = logging.getLogger("CovalyncSlackOutbox")
+
+SLACK_MIN_INTERVAL = 1.0  # seconds between requests to one webhook
+SLACK_MAX_BLOCKS = 50  # Slack's limit per message
+SLACK_MAX_ATTEMPTS = 4
+SLACK_QUEUE_LIMIT = 1000  # queued messages per webhook before spilling to webhook_retries
+SLACK_SEND_TIMEOUT = 10.0
+SLACK_SHUTDOWN_FLUSH = 5.0  # seconds allowed to drain on shutdown
+
+_MERGEABLE_KEYS = {"text", "blocks"}
+
+
+def _blocks_of(message: dict) -> list:
+    if message.get("blocks"):
+        return list(message["blocks"])
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": message.get("text", "")[:3000]}}]
+
+
+def digest_message(messages: list) -> dict:
+    """Merge several Slack messages into one: their blocks in order, separated by dividers"""
+    blocks = []
+    for message in messages:
+        if blocks:
+            blocks.append({"type": "divider"})
+        blocks.extend(_blocks_of(message))
+    first = messages[0].get("text") or "Update"
+    return {"text": f"{first} (+{len(messages) - 1} more)", "blocks": blocks}
+
+
+class SlackOutbox:
+    """Per-webhook queues with pacing, digests and Retry-After handling"""
+
+    def __init__(self, min_interval: float = SLACK_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._queues: dict[str, deque] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._next_send: dict[str, float] = {}
+        self._queued_retries: set = set()
+        self._http: httpx.AsyncClient | None = None
+        self.sent = 0
+        self.digests = 0
+        self.spilled = 0
+
+    def enqueue(self, url: str, message: dict, user_id: str = None, retry_id: str = None) -> bool:
+        """Queue a message for delivery; False if it was spilled to webhook_retries instead"""
+        if retry_id is not None:
+            if retry_id in self._queued_retries:
+                return True
+            self._queued_retries.add(retry_id)
+        queue = self._queues.setdefault(url, deque())
+        item = {"message": message, "user_id": user_id, "retry_id": retry_id, "attempts": 0, "solo": False}
+        if len(queue) >= SLACK_QUEUE_LIMIT:
+            self.spilled += 1
+            asyncio.create_task(self._give_up(url, item, "Slack outbox full"))
+            return False
+        queue.append(item)
+        if url not in self._workers:
+            self._workers[url] = asyncio.create_task(self._drain(url))
+        return True
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def stop(self):
+        """Give queued messages a moment to go out, then persist the rest for the retry job"""
+        if self._workers:
+            await asyncio.wait(list(self._workers.values()), timeout=SLACK_SHUTDOWN_FLUSH)
+        for task in list(self._workers.values()):
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        for url, queue in self._queues.items():
+            while queue:
+                await self._give_up(url, queue.popleft(), "Shut down before delivery")
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=SLACK_SEND_TIMEOUT)
+        return self._http
+
+    async def _drain(self, url: str):
+        loop = asyncio.get_running_loop()
+        queue = self._queues[url]
+        try:
+            while queue:
+                wait = self._next_send.get(url, 0.0) - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                batch = self._take_batch(queue)
+                delay = await self._send(url, queue, batch)
+                self._next_send[url] = loop.time() + max(self.min_interval, delay)
+        finally:
+            self._workers.pop(url, None)
+
+    @staticmethod
+    def _take_batch(queue: deque) -> list:
+        first = queue.popleft()
+        batch = [first]
+        if first["solo"] or set(first["message"]) - _MERGEABLE_KEYS:
+            return batch
+        blocks = len(_blocks_of(first["message"]))
+        while queue:
+            item = queue[0]
+            if item["solo"] or set(item["message"]) - _MERGEABLE_KEYS:
+                break
+            size = len(_blocks_of(item["message"])) + 1  # + divider
+            if blocks + size > SLACK_MAX_BLOCKS:
+                break
+            blocks += size
+            batch.append(queue.popleft())
+        return batch
+
+    async def _send(self, url: str, queue: deque, batch: list) -> float:
+        """Deliver one batch; returns how long the worker should wait before the next request"""
+        message = batch[0]["message"] if len(batch) == 1 else digest_message([i["message"] for i in batch])
+        try:
+            resp = await self._client().post(url, json=message)
+            status, error = resp.status_code, resp.text[:200]
+        except httpx.HTTPError as e:
+            status, error = None, repr(e)
+
+        if status is not None and status < 400:
+            self.sent += len(batch)
+            self.digests += len(batch) > 1
+            for item in batch:
+                if item["retry_id"] is not None:
+                    await self._finish_retry(item, "SUCCESS")
+            return 0.0
+
+        if status == 429:
+            queue.extendleft(reversed(batch))
+            retry_after = resp.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 1.0
+            logger.warning(f"Slack rate limited; waiting {delay:.0f}s with {len(queue)} queued")
+            return delay
+
+        if status is not None and status < 500:
+            if len(batch) > 1:
+                # A rejected digest: send its messages one by one to isolate the bad one
+                for item in batch:
+                    item["solo"] = True
+                queue.extendleft(reversed(batch))
+                return 0.0
+            # Rejected payloads will not succeed later either: drop rather than retry
+            logger.error(f"Slack rejected message ({status}): {error}")
+            if batch[0]["retry_id"] is not None:
+                await self._finish_retry(batch[0], "FAILED", f"{status}: {error}", retry=False)
+            return 0.0
+
+        # 5xx or no response: back off, then give up to the persistent retry job
+        attempts = max(i["attempts"] for i in batch) + 1
+        for item in batch:
+            item["attempts"] = attempts
+        if attempts < SLACK_MAX_ATTEMPTS:
+            queue.extendleft(reversed(batch))
+            return 2.0 ** attempts
+        logger.warning(f"Slack delivery failed after {attempts} attempts: {error}")
+        for item in batch:
+            await self._give_up(url, item, error)
+        return 0.0
+
+    async def _give_up(self, url: str, item: dict, error: str):
+        if item["retry_id"] is not None:
+            await self._finish_retry(item, "FAILED", error)
+        else:
+            await asyncio.to_thread(add_webhook_retry, item["user_id"], "slack", url, item["message"])
+
+    async def _finish_retry(self, item: dict, status: str, error: str = None, retry: bool = True):
+        self._queued_retries.discard(item["retry_id"])
+        try:
+            await asyncio.to_thread(update_webhook_retry_status, item["retry_id"], status, error, retry and status == "FAILED")
+        except Exception as e:
+            logger.error(f"Webhook retry update error: {e}")
+
+
+slack_outbox = SlackOutbox()
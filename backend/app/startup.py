@@ -0,0 +1,108 @@
+"""
+Cold-start report and budget check
+
+    cd backend && python -m app.startup                    # import-time report
+    cd backend && python -m app.startup --check-startup    # exit 1 if over budget
+
+Imports app.main in a fresh interpreter (with -X importtime), runs the
+startup hook and serves one request, then reports import time,
+time-to-ready and the slowest imports. --check-startup fails when
+time-to-ready exceeds STARTUP_BUDGET_SECONDS or when a provider SDK that
+should load lazily was imported by app.main; run it in CI to keep cold
+starts from regressing.
+
+The probe runs with PROVIDERS_PREWARM=false, so no SDK prewarm or meme
+render pool starts: spawned workers would inherit -X importtime and mix
+their imports into the report.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "3.0"))
+# SDKs that must not be imported until first use (see providers.py and database.py)
+LAZY_MODULES = ("openai", "razorpay", "supabase", "passlib", "jose", "cryptography", "tiktoken", "PIL")
+
+_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main as api
+imported = time.perf_counter()
+eager = sorted(m for m in %r if m in sys.modules)
+
+async def ready():
+    import httpx
+    await api.startup_event()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://startup") as client:
+        (await client.get("/")).raise_for_status()
+    done = time.perf_counter()
+    await api.shutdown_event()
+    return done
+
+done = asyncio.run(ready())
+print(json.dumps({"import_s": imported - started, "ready_s": done - started, "eager": eager}))
+"""
+
+
+def _top_imports(importtime: str, limit: int) -> list:
+    """Slowest imports from -X importtime output (top level and one below) as (module, seconds)"""
+    rows = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if cumulative.strip().isdigit() and depth <= 1:
+            rows.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(rows, key=lambda r: r[1], reverse=True)[:limit]
+
+
+def measure(limit: int = 15) -> dict:
+    """Run the probe in a cold interpreter and return its timings plus the import report"""
+    env = dict(os.environ, PROVIDERS_PREWARM="false", METRICS_LOG_REQUESTS="false")
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE % (LAZY_MODULES,)],
+        cwd=backend, env=env, capture_output=True, text=True, timeout=120,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{proc.stderr[-4000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["top_imports"] = _top_imports(proc.stderr, limit)
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure app.main import and time-to-ready")
+    parser.add_argument("--check-startup", action="store_true", help="exit non-zero if over budget or SDKs load eagerly")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS, help="time-to-ready budget in seconds")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args(argv)
+
+    result = measure(args.top)
+    print(f"import app.main: {result['import_s']:.3f}s")
+    print(f"time to ready:   {result['ready_s']:.3f}s (budget {args.budget:.1f}s)")
+    print("slowest imports:")
+    for module, seconds in result["top_imports"]:
+        print(f"  {seconds:7.3f}s  {module}")
+    if result["eager"]:
+        print(f"imported eagerly: {', '.join(result['eager'])}")
+
+    if not args.check_startup:
+        return 0
+    failures = []
+    if result["ready_s"] > args.budget:
+        failures.append(f"time to ready {result['ready_s']:.3f}s exceeds budget {args.budget:.1f}s")
+    if result["eager"]:
+        failures.append(f"provider SDKs imported at startup: {', '.join(result['eager'])}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Per-user style profiles compacted from ai_learning_log and ai_training
+
+A background task folds new learning/training rows into running per-user
+aggregates (tone counts, hashtag frequencies, length stats and a bounded
+pool of candidate posts) and caches a compact profile snapshot. Prompt
+construction reads the snapshot with a dict lookup instead of scanning logs.
+
+Few-shot exemplars are picked from the candidate pool by max-min cosine
+distance over hashed bag-of-words vectors, so they cover different kinds of
+posts without an embeddings API call per row.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+
+from app.batch_writer import batch_writer
+
+logger = logging.getLogger("CovalynceStyleProfile")
+
+PROFILE_REFRESH_INTERVAL = 60  # seconds between background refreshes
+PROFILE_FETCH_PAGE = 500  # rows fetched per table per page
+PROFILE_CACHE_SIZE = 5000  # users whose aggregates stay in memory (least recently used evicted)
+PROFILE_CANDIDATE_POOL = 50  # recent posts considered for exemplars
+PROFILE_EXEMPLARS = 3
+PROFILE_TOP_HASHTAGS = 10
+EMBEDDING_DIM = 256
+
+# Learning actions whose content is a finished post in the user's voice
+EXEMPLAR_ACTIONS = {"post_edit", "rephrase", "combine_sources"}
+
+_HASHTAG = re.compile(r"#\w+")
+_WORD = re.compile(r"[a-z0-9']+")
+_LENGTH_BUCKETS = ((280, "short"), (800, "medium"))
+
+
+def _length_bucket(chars: int) -> str:
+    for limit, name in _LENGTH_BUCKETS:
+        if chars <= limit:
+            return name
+    return "long"
+
+
+def _parse_feedback(feedback: str | None) -> dict:
+    """Parse 'tone:casual,length:short' style feedback strings"""
+    if not feedback or ":" not in feedback:
+        return {}
+    return dict(part.split(":", 1) for part in feedback.split(",") if ":" in part)
+
+
+def embed(text: str) -> list:
+    """Cheap normalised hashed bag-of-words vector"""
+    vec = [0.0] * EMBEDDING_DIM
+    for word in _WORD.findall(text.lower()):
+        vec[int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % EMBEDDING_DIM] += 1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def select_diverse(texts: list, k: int = PROFILE_EXEMPLARS) -> list:
+    """Greedy max-min selection: each pick is the text least similar to those already chosen"""
+    if len(texts) <= k:
+        return list(texts)
+    vectors = [embed(t) for t in texts]
+    # Seed with the most recent candidate
+    chosen = [len(texts) - 1]
+    closest = [sum(a * b for a, b in zip(v, vectors[chosen[0]])) for v in vectors]
+    while len(chosen) < k:
+        best = min((i for i in range(len(texts)) if i not in chosen), key=lambda i: closest[i])
+        chosen.append(best)
+        closest = [max(c, sum(a * b for a, b in zip(v, vectors[best]))) for c, v in zip(closest, vectors)]
+    return [texts[i] for i in chosen]
+
+
+class _ProfileState:
+    """Running aggregates for one user plus the per-table (created_at, id) cursors already folded in"""
+
+    def __init__(self):
+        self.tones = Counter()
+        self.styles = Counter()
+        self.lengths = Counter()
+        self.hashtags = Counter()
+        self.total_chars = 0
+        self.samples = 0
+        self.candidates = deque(maxlen=PROFILE_CANDIDATE_POOL)
+        self.cursors = {"ai_learning_log": None, "ai_training": None}
+        self.rows_seen = 0
+
+    def add_post(self, text: str):
+        if not text:
+            return
+        self.hashtags.update(tag.lower() for tag in _HASHTAG.findall(text))
+        self.total_chars += len(text)
+        self.samples += 1
+        self.lengths[_length_bucket(len(text))] += 1
+        self.candidates.append(text)
+
+    def add_learning_row(self, row: dict):
+        feedback = _parse_feedback(row.get("feedback"))
+        if feedback.get("tone"):
+            self.tones[feedback["tone"]] += 1
+        if feedback.get("length"):
+            self.lengths[feedback["length"]] += 1
+        if row.get("action") in EXEMPLAR_ACTIONS:
+            self.add_post(row.get("content") or "")
+
+    def add_training_row(self, row: dict):
+        if row.get("style"):
+            self.styles[row["style"]] += 1
+        for example in row.get("examples") or [row.get("content") or ""]:
+            self.add_post(example)
+
+    def snapshot(self, user_id: str) -> dict:
+        return {
+            "user_id": user_id,
+            "tones": dict(self.tones.most_common()),
+            "styles": dict(self.styles.most_common()),
+            "hashtags": [tag for tag, _ in self.hashtags.most_common(PROFILE_TOP_HASHTAGS)],
+            "length": {
+                "preferred": self.lengths.most_common(1)[0][0] if self.lengths else None,
+                "avg_chars": self.total_chars // self.samples if self.samples else 0,
+            },
+            "exemplars": select_diverse(list(self.candidates)),
+            "rows_seen": self.rows_seen,
+            "built_at": datetime.utcnow().isoformat(),
+        }
+
+
+class StyleProfileStore:
+    """Cached per-user style profiles, refreshed incrementally in the background"""
+
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._states: OrderedDict[str, _ProfileState] = OrderedDict()
+        self._profiles: dict[str, dict] = {}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> dict | None:
+        """Cached profile for a user; unknown users are queued for the next build"""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._states.move_to_end(user_id)
+        if profile is None:
+            self.mark_dirty(user_id)
+        return profile
+
+    def mark_dirty(self, user_id: str):
+        """Flag a user whose learning/training rows changed"""
+        with self._lock:
+            self._dirty.add(user_id)
+
+    def flushed(self, rows: list, written: bool = True):
+        """Batch writer callback: these learning/training rows are now in the DB for the next fold"""
+        if not written:
+            return
+        with self._lock:
+            self._dirty.update(row["user_id"] for row in rows)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._states.pop(user_id, None)
+            self._profiles.pop(user_id, None)
+            self._dirty.discard(user_id)
+
+    def refresh(self, user_id: str) -> dict | None:
+        """Fold rows added since the last refresh into the user's profile"""
+        from app.database import supabase
+        if not supabase:
+            return None
+        with self._lock:
+            state = self._states.get(user_id) or _ProfileState()
+        self._fold(supabase, user_id, state, "ai_learning_log", "id, action, content, feedback, created_at", state.add_learning_row)
+        self._fold(supabase, user_id, state, "ai_training", "id, content, style, examples, created_at", state.add_training_row)
+        profile = state.snapshot(user_id)
+        with self._lock:
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            self._profiles[user_id] = profile
+            while len(self._states) > self.maxsize:
+                evicted, _ = self._states.popitem(last=False)
+                self._profiles.pop(evicted, None)
+        return profile
+
+    def refresh_dirty(self):
+        with self._lock:
+            users, self._dirty = self._dirty, set()
+        for user_id in users:
+            try:
+                self.refresh(user_id)
+            except Exception as e:
+                logger.warning(f"Style profile refresh failed for {user_id}: {e}")
+
+    @staticmethod
+    def _fold(supabase, user_id: str, state: _ProfileState, table: str, columns: str, add_row):
+        # Keyset on (created_at, id): rows from one multi-row insert share a created_at
+        while True:
+            query = supabase.table(table).select(columns).eq("user_id", user_id)
+            if state.cursors[table]:
+                created_at, row_id = state.cursors[table]
+                query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{row_id}")')
+            rows = query.order("created_at").order("id").limit(PROFILE_FETCH_PAGE).execute().data or []
+            for row in rows:
+                add_row(row)
+            state.rows_seen += len(rows)
+            if rows:
+                state.cursors[table] = (rows[-1]["created_at"], str(rows[-1]["id"]))
+            if len(rows) < PROFILE_FETCH_PAGE:
+                return
+
+
+style_profiles = StyleProfileStore()
+# Rows are written behind the request; flag users once their rows land, not when they're queued
+batch_writer.on_flush("ai_learning_log", style_profiles.flushed)
+batch_writer.on_flush("ai_training", style_profiles.flushed)
+
+
+def style_prompt(user_id: str) -> str:
+    """Style guidance block for prompts, built from the cached profile (empty when none yet)"""
+    profile = style_profiles.get(user_id)
+    if not profile or not profile["rows_seen"]:
+        return ""
+    lines = ["Match this user's style."]
+    if profile["tones"]:
+        lines.append(f"Usual tone: {next(iter(profile['tones']))}.")
+    if profile["length"]["preferred"]:
+        lines.append(f"Preferred length: {profile['length']['preferred']} (~{profile['length']['avg_chars']} chars).")
+    if profile["hashtags"]:
+        lines.append(f"Frequent hashtags: {' '.join(profile['hashtags'][:5])}")
+    for i, exemplar in enumerate(profile["exemplars"]):
+        lines.append(f"Example {i+1}: {exemplar[:500]}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def refresh_style_profiles():
+    """Background task that compacts new learning rows into cached profiles"""
+    while True:
+        try:
+            await asyncio.to_thread(style_profiles.refresh_dirty)
+        except Exception as e:
+            logger.error(f"Style profile refresh error: {e}")
+
+        await asyncio.sleep(PROFILE_REFRESH_INTERVAL)
@@ -0,0 +1,258 @@
+"""
+OAuth access tokens with proactive refresh
+
+token_manager.get_token() is what posting paths use instead of reading the
+stored token directly:
+
+- decrypted credentials are cached in memory (user_cache) until the token
+  expires, so the hot path is a dict lookup;
+- a token inside TOKEN_REFRESH_AHEAD of expiry is returned as is while a
+  refresh starts in the background; only an already expired token makes
+  the caller wait for a refresh;
+- refreshes are single-flight per (user, provider): concurrent callers
+  share one provider request;
+- every refresh, on demand or from the background scan, first takes a
+  short database lease on the integration so several workers do not
+  refresh (and rotate) the same refresh token at once; an on-demand
+  caller that finds the lease taken waits for the holder's new token;
+- a background scan refreshes tokens nearing expiry before anyone asks
+  for them;
+- failed refreshes are recorded on the integration and back off
+  exponentially, so revoked tokens drop out of the scan instead of
+  crowding out live ones, and expired tokens aren't refreshed on every
+  request while they wait.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from app.cache import user_cache
+from app.database import (
+    claim_token_refresh, get_expiring_integrations, get_integration_refresh_token, get_oauth_credentials,
+    load_oauth_credentials, record_token_refresh_failure, update_integration_token,
+)
+
+logger = logging.getLogger("CovalynceTokens")
+
+TOKEN_REFRESH_AHEAD = 900  # seconds before expiry to refresh
+TOKEN_EXPIRY_SKEW = 60  # treat tokens as expired this early (clock skew, request time)
+TOKEN_SCAN_INTERVAL = 300  # seconds between background scans
+TOKEN_REFRESH_CONCURRENCY = 5
+TOKEN_REFRESH_TIMEOUT = 15.0
+TOKEN_REFRESH_LEASE = 60  # seconds one worker holds an integration's refresh
+TOKEN_REFRESH_POLL = 1.0  # seconds between checks while another worker holds the lease
+TOKEN_FAILURE_BACKOFF = 1800  # seconds before retrying a refresh that failed, doubling per failure
+TOKEN_FAILURE_MAX_BACKOFF = 7 * 24 * 3600
+
+REFRESH_PROVIDERS = {
+    "linkedin": {
+        "url": "https://www.linkedin.com/oauth/v2/accessToken",
+        "client_id": os.getenv("LINKEDIN_CLIENT_ID"),
+        "client_secret": os.getenv("LINKEDIN_CLIENT_SECRET"),
+    },
+    "google": {
+        "url": "https://oauth2.googleapis.com/token",
+        "client_id": os.getenv("GOOGLE_CLIENT_ID"),
+        "client_secret": os.getenv("GOOGLE_CLIENT_SECRET"),
+    },
+}
+
+_MISSING = object()
+
+
+class TokenRefreshError(Exception):
+    """A refresh could not be done; status_code is what the API caller should see"""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def expires_at_from(token_data: dict) -> str | None:
+    """ISO expiry for a provider token response with expires_in (None if it has none)"""
+    expires_in = token_data.get("expires_in")
+    if not expires_in:
+        return None
+    return datetime.fromtimestamp(time.time() + int(expires_in), timezone.utc).isoformat()
+
+
+class TokenManager:
+    """Cached, proactively refreshed OAuth access tokens"""
+
+    def __init__(self):
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self._failed_until: dict[tuple, float] = {}
+        self._scan_task = None
+
+    def start(self):
+        if self._scan_task is None and any(c["client_id"] for c in REFRESH_PROVIDERS.values()):
+            self._scan_task = asyncio.create_task(self._scan_loop())
+
+    async def stop(self):
+        if self._scan_task:
+            self._scan_task.cancel()
+            await asyncio.gather(self._scan_task, return_exceptions=True)
+            self._scan_task = None
+
+    async def get_token(self, user_id: str, provider: str) -> str | None:
+        """A usable access token, refreshing first only if it has already expired"""
+        credentials = user_cache.peek(user_id, f"oauth:{provider}", _MISSING)
+        if credentials is _MISSING:
+            credentials = await asyncio.to_thread(get_oauth_credentials, user_id, provider)
+        if not credentials:
+            return None
+        expires_at = credentials["expires_at"]
+        if not expires_at or not credentials["refreshable"] or provider not in REFRESH_PROVIDERS:
+            return credentials["access_token"]
+        now = time.time()
+        if expires_at - TOKEN_EXPIRY_SKEW <= now:
+            if self._backing_off(user_id, provider, credentials, now):
+                return credentials["access_token"]
+            try:
+                return await self.refresh(user_id, provider)
+            except TokenRefreshError as e:
+                logger.warning(f"Could not refresh expired {provider} token for {user_id}: {e.detail}")
+                return credentials["access_token"]
+        if expires_at - TOKEN_REFRESH_AHEAD <= now and not self._backing_off(user_id, provider, credentials, now):
+            self._refresh_in_background(user_id, provider)
+        return credentials["access_token"]
+
+    def _backing_off(self, user_id: str, provider: str, credentials: dict, now: float) -> bool:
+        """True while a failed refresh (in this worker or, per the DB, any other) is backing off"""
+        until = max(self._failed_until.get((user_id, provider), 0), credentials.get("next_refresh_at") or 0)
+        return until > now
+
+    async def refresh(self, user_id: str, provider: str, wait: bool = True) -> str:
+        """Refresh now, joining a refresh already running for this (user, provider)
+
+        If another worker holds the refresh lease, wait for its token (or
+        raise TokenRefreshError with 409 straight away when wait is False).
+        """
+        key = (user_id, provider)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user_id, provider, wait))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded: a caller giving up must not cancel the refresh the others are waiting on
+        return await asyncio.shield(task)
+
+    def _refresh_in_background(self, user_id: str, provider: str):
+        if (user_id, provider) in self._inflight:
+            return
+        # The token still works, so there's nothing to wait for if another worker is refreshing it
+        task = asyncio.ensure_future(self.refresh(user_id, provider, wait=False))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # failures are logged in _refresh
+
+    async def _refresh(self, user_id: str, provider: str, wait: bool = True) -> str:
+        config = REFRESH_PROVIDERS.get(provider)
+        if not config or not config["client_id"]:
+            raise TokenRefreshError("Provider not supported for refresh")
+        if await asyncio.to_thread(claim_token_refresh, user_id, provider, TOKEN_REFRESH_LEASE):
+            return await self._refresh_claimed(user_id, provider, config)
+        if not wait:
+            raise TokenRefreshError("Token refresh already in progress", 409)
+        return await self._join_refresh(user_id, provider, config)
+
+    async def _join_refresh(self, user_id: str, provider: str, config: dict) -> str:
+        """Wait for the worker holding the lease to store a new token; take over if its lease lapses"""
+        before = await asyncio.to_thread(load_oauth_credentials, user_id, provider)
+        deadline = time.monotonic() + TOKEN_REFRESH_LEASE + TOKEN_REFRESH_POLL
+        while time.monotonic() < deadline:
+            await asyncio.sleep(TOKEN_REFRESH_POLL)
+            credentials = await asyncio.to_thread(load_oauth_credentials, user_id, provider)
+            if not credentials:
+                raise TokenRefreshError("Integration not found", 404)
+            if not before or credentials["access_token"] != before["access_token"]:
+                return credentials["access_token"]
+            if self._backing_off(user_id, provider, credentials, time.time()):
+                raise TokenRefreshError("Token refresh failed")
+            if await asyncio.to_thread(claim_token_refresh, user_id, provider, TOKEN_REFRESH_LEASE):
+                return await self._refresh_claimed(user_id, provider, config)
+        raise TokenRefreshError("Timed out waiting for another token refresh", 503)
+
+    async def _refresh_claimed(self, user_id: str, provider: str, config: dict) -> str:
+        """Do the provider refresh; the caller holds the lease, which storing the result or a failure releases"""
+        key = (user_id, provider)
+        refresh_token = await asyncio.to_thread(get_integration_refresh_token, user_id, provider)
+        if not refresh_token:
+            raise TokenRefreshError("No refresh token available")
+
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": config["client_id"],
+            "client_secret": config["client_secret"],
+        }
+        try:
+            async with httpx.AsyncClient(timeout=TOKEN_REFRESH_TIMEOUT) as http:
+                resp = await http.post(config["url"], data=data)
+            token_data = resp.json()
+        except (httpx.HTTPError, ValueError) as e:
+            await self._record_failure(user_id, provider)
+            logger.error(f"Token refresh error ({provider}, {user_id}): {e}")
+            raise TokenRefreshError(f"Token refresh failed: {e}", 502)
+        if "access_token" not in token_data:
+            await self._record_failure(user_id, provider)
+            logger.error(f"Token refresh rejected ({provider}, {user_id}): {token_data.get('error') or resp.status_code}")
+            raise TokenRefreshError("Token refresh failed")
+
+        # Providers that rotate refresh tokens return a new one; otherwise the old one stays valid
+        await asyncio.to_thread(
+            update_integration_token, user_id, provider, token_data["access_token"],
+            token_data.get("refresh_token"), expires_at_from(token_data),
+        )
+        self._failed_until.pop(key, None)
+        logger.info(f"Refreshed {provider} token for {user_id}")
+        return token_data["access_token"]
+
+    async def _record_failure(self, user_id: str, provider: str):
+        """Back off in memory for this worker's hot path and in the database for every worker's scan"""
+        try:
+            delay = await asyncio.to_thread(
+                record_token_refresh_failure, user_id, provider, TOKEN_FAILURE_BACKOFF, TOKEN_FAILURE_MAX_BACKOFF
+            )
+        except Exception as e:
+            logger.error(f"Could not record token refresh failure ({provider}, {user_id}): {e}")
+            delay = TOKEN_FAILURE_BACKOFF
+        self._failed_until[(user_id, provider)] = time.time() + delay
+
+    async def refresh_expiring(self) -> int:
+        """Refresh every stored token that expires within TOKEN_REFRESH_AHEAD; returns how many were refreshed"""
+        providers = [p for p, c in REFRESH_PROVIDERS.items() if c["client_id"]]
+        before = datetime.fromtimestamp(time.time() + TOKEN_REFRESH_AHEAD, timezone.utc).isoformat()
+        rows = await asyncio.to_thread(get_expiring_integrations, providers, before)
+        slots = asyncio.Semaphore(TOKEN_REFRESH_CONCURRENCY)
+        now = time.time()
+
+        async def refresh_one(row: dict) -> bool:
+            user_id, provider = row["user_id"], row["provider"]
+            if self._failed_until.get((user_id, provider), 0) > now:
+                return False
+            async with slots:
+                try:
+                    # Another worker holding the lease has it covered
+                    await self.refresh(user_id, provider, wait=False)
+                    return True
+                except TokenRefreshError:
+                    return False
+
+        return sum(await asyncio.gather(*(refresh_one(row) for row in rows)))
+
+    async def _scan_loop(self):
+        while True:
+            try:
+                refreshed = await self.refresh_expiring()
+                if refreshed:
+                    logger.info(f"Proactively refreshed {refreshed} OAuth tokens")
+            except Exception as e:
+                logger.error(f"Token refresh scan error: {e}")
+            await asyncio.sleep(TOKEN_SCAN_INTERVAL)
+
+
+token_manager = TokenManager()
@@ -0,0 +1,300 @@
+"""
+Trending-topic ingestion and per-location index
+
+Trending topics are pulled in the background from pluggable sources and
+kept, already ranked, in memory, so /trends/trending is a read of a short
+precomputed list instead of a fetch:
+
+- each source (see TrendSource) is polled on its own interval and its
+  items are normalized into one shape keyed by (source, id);
+- items are scored by volume, velocity (volume gained since the previous
+  poll, per hour) and recency, which halves every TRENDS_HALF_LIFE;
+- a top-K list is kept per location plus one for global topics. A poll
+  only recomputes the locations whose items it changed; everything is
+  rescored (and old items dropped) every TRENDS_RESCORE_INTERVAL as
+  recency decays;
+- a request merges its location's list with the global one, O(K).
+
+The fixture source reads a JSON file and needs no network, so trends work
+offline and in development; TRENDS_SOURCES selects the sources to run.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from itertools import islice
+
+import httpx
+
+logger = logging.getLogger("CovalynceTrending")
+
+TRENDS_SOURCES = [s.strip() for s in os.getenv("TRENDS_SOURCES", "fixture").split(",") if s.strip()]
+TRENDS_FIXTURE_PATH = os.getenv("TRENDS_FIXTURE_PATH") or os.path.join(os.path.dirname(__file__), "fixtures", "trends.json")
+TRENDS_TOP_K = 50  # items kept per location
+TRENDS_HALF_LIFE = 6 * 3600  # seconds for a topic's recency weight to halve
+TRENDS_MAX_AGE = 48 * 3600  # items older than this are dropped
+TRENDS_VELOCITY_WEIGHT = 1.5
+TRENDS_LOCAL_BOOST = 1.3  # local topics rank above global ones of similar score
+TRENDS_RESCORE_INTERVAL = 600  # seconds between full rescoring passes
+TRENDS_FETCH_TIMEOUT = 15.0
+
+GLOBAL = "global"
+
+
+def normalize_location(location: str | None) -> str:
+    return " ".join((location or GLOBAL).lower().split()) or GLOBAL
+
+
+class TrendSource:
+    """
+    A source of trending topics. fetch() returns raw items with:
+    id, content, and optionally location, hashtags, category, url,
+    volume (mentions, points, ...) and published_at (epoch seconds or ISO).
+    """
+
+    name = "source"
+    interval = 300  # seconds between polls
+
+    async def fetch(self, http: httpx.AsyncClient) -> list:
+        raise NotImplementedError
+
+
+class FixtureSource(TrendSource):
+    """Items from a JSON file; age_minutes is relative to when the file is read"""
+
+    name = "fixture"
+    interval = 60
+
+    def __init__(self, path: str = TRENDS_FIXTURE_PATH):
+        self.path = path
+
+    def _read(self) -> list:
+        with open(self.path) as f:
+            items = json.load(f)
+        now = time.time()
+        for item in items:
+            if "published_at" not in item:
+                item["published_at"] = now - 60 * item.get("age_minutes", 0)
+        return items
+
+    async def fetch(self, http: httpx.AsyncClient) -> list:
+        try:
+            return await asyncio.to_thread(self._read)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read trends fixture {self.path}: {e}")
+            return []
+
+
+class HackerNewsSource(TrendSource):
+    """Front-page Hacker News stories as global tech topics"""
+
+    name = "hackernews"
+    interval = 600
+
+    async def fetch(self, http: httpx.AsyncClient) -> list:
+        resp = await http.get("https://hn.algolia.com/api/v1/search", params={"tags": "front_page", "hitsPerPage": 50})
+        resp.raise_for_status()
+        return [
+            {
+                "id": hit["objectID"],
+                "content": hit.get("title") or "",
+                "url": hit.get("url") or f"https://news.ycombinator.com/item?id={hit['objectID']}",
+                "category": "tech",
+                "volume": (hit.get("points") or 0) + (hit.get("num_comments") or 0),
+                "published_at": hit.get("created_at_i"),
+            }
+            for hit in resp.json().get("hits", [])
+        ]
+
+
+SOURCES: dict[str, TrendSource] = {s.name: s for s in (FixtureSource(), HackerNewsSource())}
+
+
+def register_source(source: TrendSource):
+    SOURCES[source.name] = source
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def score(item: dict, now: float) -> float:
+    age = max(0.0, now - item["published_at"])
+    decay = 0.5 ** (age / TRENDS_HALF_LIFE)
+    return (math.log1p(item["volume"]) + TRENDS_VELOCITY_WEIGHT * math.log1p(item["velocity"])) * decay
+
+
+class TrendingIndex:
+    """Normalized items with a precomputed top-K per location"""
+
+    def __init__(self, k: int = TRENDS_TOP_K):
+        self.k = k
+        self._items: dict[str, dict] = {}  # "source:id" -> item
+        self._by_location: dict[str, set] = {}  # location -> item keys
+        self._top: dict[str, list] = {}  # location -> items, best first
+
+    def ingest(self, source: str, raw_items: list, now: float = None) -> int:
+        """Merge one poll's items; recomputes only the locations they touch. Returns how many changed."""
+        now = now or time.time()
+        touched = set()
+        changed = 0
+        for raw in raw_items:
+            if not raw.get("id") or not raw.get("content"):
+                continue
+            key = f"{source}:{raw['id']}"
+            location = normalize_location(raw.get("location"))
+            volume = max(0, int(raw.get("volume") or 0))
+            previous = self._items.get(key)
+            if previous is not None:
+                if (volume == previous["volume"] and not previous["velocity"] and location == previous["location"]
+                        and raw["content"] == previous["content"]):
+                    # Nothing new; recency decay is applied by rescore()
+                    previous["seen_at"] = now
+                    continue
+                hours = max((now - previous["seen_at"]) / 3600, 1 / 60)
+                velocity = max(0.0, (volume - previous["volume"]) / hours)
+                if previous["location"] != location:
+                    self._by_location.get(previous["location"], set()).discard(key)
+                    touched.add(previous["location"])
+            else:
+                velocity = 0.0
+            item = {
+                "key": key,
+                "id": str(raw["id"]),
+                "source": source,
+                "location": location,
+                "content": raw["content"],
+                "hashtags": list(raw.get("hashtags") or []),
+                "category": raw.get("category") or "general",
+                "url": raw.get("url"),
+                "volume": volume,
+                "velocity": velocity,
+                "published_at": _timestamp(raw.get("published_at")),
+                "seen_at": now,
+            }
+            item["score"] = score(item, now)
+            self._items[key] = item
+            self._by_location.setdefault(location, set()).add(key)
+            touched.add(location)
+            changed += 1
+        for location in touched:
+            self._rebuild(location)
+        return changed
+
+    def rescore(self, now: float = None):
+        """Re-apply recency decay to every item, drop expired ones and rebuild every list"""
+        now = now or time.time()
+        for key, item in list(self._items.items()):
+            if now - item["published_at"] > TRENDS_MAX_AGE:
+                del self._items[key]
+                self._by_location.get(item["location"], set()).discard(key)
+            else:
+                item["score"] = score(item, now)
+        for location in list(self._by_location):
+            if not self._by_location[location]:
+                del self._by_location[location]
+                self._top.pop(location, None)
+            else:
+                self._rebuild(location)
+
+    def _rebuild(self, location: str):
+        keys = self._by_location.get(location, ())
+        self._top[location] = heapq.nlargest(self.k, (self._items[k] for k in keys), key=lambda i: i["score"])
+
+    def top(self, location: str, limit: int = 20) -> list:
+        """Best items for a location, merged with global topics"""
+        location = normalize_location(location)
+        local = self._top.get(location)
+        if local is None and "," in location:
+            local = self._top.get(location.split(",")[0].strip())
+        lists = [local or []]
+        if location != GLOBAL:
+            lists.append(self._top.get(GLOBAL, []))
+        merged = list(islice(heapq.merge(*lists, key=lambda i: -self._rank(i)), min(limit, self.k)))
+        best = self._rank(merged[0]) if merged else 0.0
+        return [self._public(item, best) for item in merged]
+
+    @staticmethod
+    def _rank(item: dict) -> float:
+        return item["score"] * (TRENDS_LOCAL_BOOST if item["location"] != GLOBAL else 1.0)
+
+    def _public(self, item: dict, best: float) -> dict:
+        return {
+            "id": item["key"],
+            "type": "trend",
+            "content": item["content"],
+            "hashtags": item["hashtags"],
+            "trending_score": round(100 * self._rank(item) / best) if best else 0,
+            "category": item["category"],
+            "source": item["source"],
+            "url": item["url"],
+            "location": item["location"],
+        }
+
+
+class TrendingService:
+    """Polls the configured sources into a TrendingIndex"""
+
+    def __init__(self, sources: list = None):
+        self.index = TrendingIndex()
+        self.source_names = sources if sources is not None else TRENDS_SOURCES
+        self._tasks: list = []
+        self._http: httpx.AsyncClient | None = None
+
+    def start(self):
+        if self._tasks:
+            return
+        self._http = httpx.AsyncClient(timeout=TRENDS_FETCH_TIMEOUT)
+        for name in self.source_names:
+            source = SOURCES.get(name)
+            if source is None:
+                logger.warning(f"Unknown trend source: {name}")
+                continue
+            self._tasks.append(asyncio.create_task(self._poll(source)))
+        self._tasks.append(asyncio.create_task(self._rescore_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def top(self, location: str, limit: int = 20) -> list:
+        return self.index.top(location, limit)
+
+    async def refresh(self, source: TrendSource) -> int:
+        items = await source.fetch(self._http)
+        return self.index.ingest(source.name, items)
+
+    async def _poll(self, source: TrendSource):
+        while True:
+            try:
+                await self.refresh(source)
+            except Exception as e:
+                logger.error(f"Trend source {source.name} error: {e}")
+            await asyncio.sleep(source.interval)
+
+    async def _rescore_loop(self):
+        while True:
+            await asyncio.sleep(TRENDS_RESCORE_INTERVAL)
+            try:
+                self.index.rescore()
+            except Exception as e:
+                logger.error(f"Trend rescoring error: {e}")
+
+
+trending_service = TrendingService()
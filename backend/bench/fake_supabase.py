@@ -0,0 +1,393 @@
+"""
+In-process stand-in for the Supabase/PostgREST client, backed by SQLite
+
+Implements the part of the supabase-py query builder the backend uses
+(table/select/eq/neq/gt/gte/lt/lte/in_/is_/or_/order/limit/offset/range/
+insert/upsert/update/delete, count="exact", rpc) so the API can be run and
+load-tested without a Supabase project. Tables and columns are created on
+first write; dict/list values are stored as JSON and decoded on read.
+
+Every execute() sleeps for `latency` (+ up to `jitter`) seconds to model the
+network round trip to PostgREST.
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Conflict targets for upserts without on_conflict (the tables' primary/unique keys)
+UNIQUE_KEYS = {
+    "user_settings": ("user_id",),
+    "user_integrations": ("user_id", "provider"),
+    "ai_preferences": ("user_id",),
+    "user_accounts": ("email",),
+    "payment_events": ("event_id",),
+    "competitor_posts": ("competitor_id", "content_hash"),
+}
+# Tables keyed by user_id rather than a generated id
+_NO_ID_TABLES = {"user_settings", "ai_preferences"}
+
+_METHODS = {"select": "GET", "insert": "POST", "upsert": "POST", "update": "PATCH", "delete": "DELETE"}
+_OPS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_sql(column: str) -> str:
+    """Column reference, including PostgREST json paths like metadata->>key"""
+    if "->>" in column:
+        column, key = column.split("->>", 1)
+        return f"json_extract({_quote(column)}, '$.{key}')"
+    return _quote(column)
+
+
+def _to_sql(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _split_top_level(text: str) -> list:
+    """Split a PostgREST logic string on commas outside parentheses and quotes"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+class FakeSupabase:
+    """Drop-in for `database.supabase` backed by a single SQLite connection"""
+
+    def __init__(self, path: str = ":memory:", latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._columns: dict[str, dict] = {}  # table -> {column: "json" | "bool" | "scalar"}
+        self._rpcs: dict = {}
+        self.queries = 0
+
+    def table(self, name: str) -> "FakeQuery":
+        return FakeQuery(self, name)
+
+    def register_rpc(self, name: str, fn):
+        """Provide a Python implementation for supabase.rpc(name, params)"""
+        self._rpcs[name] = fn
+
+    def rpc(self, name: str, params: dict = None) -> "FakeRpc":
+        return FakeRpc(self, name, params or {})
+
+    def _sleep(self):
+        self.queries += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    # --- schema ---
+
+    def _ensure(self, table: str, row: dict = None):
+        with self._lock:
+            if table not in self._columns:
+                self._db.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} (id TEXT, created_at TEXT)")
+                self._columns[table] = {"id": "scalar", "created_at": "scalar"}
+                key = UNIQUE_KEYS.get(table, ("id",))
+                self._ensure_columns(table, dict.fromkeys(key))
+                self._unique_index(table, key)
+            if row:
+                self._ensure_columns(table, row)
+
+    def _ensure_columns(self, table: str, row: dict):
+        known = self._columns[table]
+        for column, value in row.items():
+            kind = "json" if isinstance(value, (dict, list)) else "bool" if isinstance(value, bool) else None
+            if column not in known:
+                self._db.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)}")
+                known[column] = kind or "scalar"
+            elif kind and known[column] == "scalar":
+                known[column] = kind
+
+    def _unique_index(self, table: str, columns: tuple):
+        name = _quote(f"uq_{table}_{'_'.join(columns)}")
+        self._db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {_quote(table)} ({', '.join(map(_quote, columns))})")
+
+    def _decode(self, table: str, row: sqlite3.Row, columns: list = None) -> dict:
+        kinds = self._columns.get(table, {})
+        out = {}
+        for column in columns or row.keys():
+            value = row[column] if column in row.keys() else None
+            kind = kinds.get(column)
+            if value is not None and kind == "json":
+                value = json.loads(value)
+            elif value is not None and kind == "bool":
+                value = bool(value)
+            out[column] = value
+        return out
+
+
+class FakeRpc:
+    def __init__(self, client: FakeSupabase, name: str, params: dict):
+        self.client, self.name, self.params = client, name, params
+
+    def execute(self) -> FakeResponse:
+        self.client._sleep()
+        fn = self.client._rpcs.get(self.name)
+        if fn is None:
+            from postgrest.exceptions import APIError
+            raise APIError({"code": "PGRST202", "message": f"Could not find the function public.{self.name}"})
+        return FakeResponse(fn(self.client, **self.params))
+
+
+class FakeQuery:
+    """One PostgREST request being built; every filter method returns self"""
+
+    def __init__(self, client: FakeSupabase, table: str):
+        self.client = client
+        self.table = table
+        self._action = "select"
+        self._columns = "*"
+        self._count = None
+        self._payload = None
+        self._negate = False
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._refs: set = set()  # columns referenced by filters/ordering
+        self._where: list = []
+        self._params: list = []
+        self._order: list = []
+        self._limit = None
+        self._offset = None
+
+    # --- actions ---
+
+    def select(self, columns: str = "*", count: str = None):
+        self._action, self._columns, self._count = "select", columns, count
+        return self
+
+    def insert(self, rows, **kwargs):
+        self._action, self._payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = None, ignore_duplicates: bool = False, **kwargs):
+        self._action, self._payload = "upsert", rows
+        self._ignore_duplicates = ignore_duplicates
+        self._on_conflict = tuple(c.strip() for c in on_conflict.split(",")) if on_conflict else None
+        return self
+
+    def update(self, values: dict, **kwargs):
+        self._action, self._payload = "update", values
+        return self
+
+    def delete(self, **kwargs):
+        self._action = "delete"
+        return self
+
+    def _col(self, column: str) -> str:
+        self._refs.add(column.split("->>", 1)[0])
+        return _column_sql(column)
+
+    # --- filters ---
+
+    @property
+    def not_(self):
+        """Negate the next filter"""
+        self._negate = True
+        return self
+
+    def _add_where(self, sql: str):
+        if self._negate:
+            sql, self._negate = f"NOT ({sql})", False
+        self._where.append(sql)
+
+    def _filter(self, column: str, op: str, value):
+        self._add_where(f"{self._col(column)} {_OPS[op]} ?")
+        self._params.append(_to_sql(value))
+        return self
+
+    def eq(self, column, value): return self._filter(column, "eq", value)
+    def neq(self, column, value): return self._filter(column, "neq", value)
+    def gt(self, column, value): return self._filter(column, "gt", value)
+    def gte(self, column, value): return self._filter(column, "gte", value)
+    def lt(self, column, value): return self._filter(column, "lt", value)
+    def lte(self, column, value): return self._filter(column, "lte", value)
+    def like(self, column, pattern): return self._filter(column, "like", pattern.replace("*", "%"))
+    def ilike(self, column, pattern): return self._filter(column, "ilike", pattern.replace("*", "%"))
+
+    def in_(self, column: str, values):
+        values = list(values)
+        if not values:
+            self._add_where("0")
+            return self
+        self._add_where(f"{self._col(column)} IN ({', '.join('?' * len(values))})")
+        self._params.extend(_to_sql(v) for v in values)
+        return self
+
+    def is_(self, column: str, value):
+        self._add_where(f"{self._col(column)} IS {'NULL' if value in (None, 'null') else 'NOT NULL'}")
+        return self
+
+    def or_(self, filters: str):
+        sql, params = self._logic(filters, "OR")
+        self._where.append(sql)
+        self._params.extend(params)
+        return self
+
+    def _logic(self, text: str, joiner: str) -> tuple:
+        clauses, params = [], []
+        for part in _split_top_level(text):
+            for prefix, inner_joiner in (("and(", "AND"), ("or(", "OR")):
+                if part.startswith(prefix) and part.endswith(")"):
+                    sql, inner = self._logic(part[len(prefix):-1], inner_joiner)
+                    break
+            else:
+                column, op, value = part.split(".", 2)
+                if op == "is":
+                    sql, inner = f"{self._col(column)} IS {'NULL' if value == 'null' else 'NOT NULL'}", []
+                elif op == "in":
+                    values = [_unquote(v) for v in _split_top_level(value.strip("()"))]
+                    sql, inner = f"{self._col(column)} IN ({', '.join('?' * len(values))})", values
+                else:
+                    sql, inner = f"{self._col(column)} {_OPS[op]} ?", [_unquote(value)]
+            clauses.append(f"({sql})")
+            params.extend(inner)
+        return f" {joiner} ".join(clauses), params
+
+    # --- modifiers ---
+
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self._order.append(f"{self._col(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, count: int, **kwargs):
+        self._limit = count
+        return self
+
+    def offset(self, count: int):
+        self._offset = count
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    # --- execution ---
+
+    def _where_sql(self) -> str:
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ""
+
+    def execute(self) -> FakeResponse:
+        from app.metrics import record_db
+        started = time.perf_counter()
+        self.client._sleep()
+        client = self.client
+        try:
+            with client._lock:
+                client._ensure(self.table)
+                client._ensure_columns(self.table, dict.fromkeys(self._refs))
+                return getattr(self, f"_execute_{self._action}")()
+        finally:
+            record_db(self.table, _METHODS[self._action], time.perf_counter() - started)
+
+    def _execute_select(self) -> FakeResponse:
+        client = self.client
+        columns = None if self._columns.strip() == "*" else [c.strip() for c in self._columns.split(",") if c.strip()]
+        sql = f"SELECT * FROM {_quote(self.table)}{self._where_sql()}"
+        if self._order:
+            sql += f" ORDER BY {', '.join(self._order)}"
+        if self._limit is not None or self._offset:
+            sql += f" LIMIT {self._limit if self._limit is not None else -1} OFFSET {self._offset or 0}"
+        rows = [client._decode(self.table, r, columns) for r in client._db.execute(sql, self._params)]
+        count = None
+        if self._count:
+            count = client._db.execute(f"SELECT COUNT(*) FROM {_quote(self.table)}{self._where_sql()}", self._params).fetchone()[0]
+        return FakeResponse(rows, count)
+
+    def _rows(self) -> list:
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        out = []
+        for row in rows:
+            row = dict(row)
+            if self.table not in _NO_ID_TABLES:
+                row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", _now())
+            out.append(row)
+        return out
+
+    def _insert(self, rows: list, conflict: tuple = None, ignore_duplicates: bool = False) -> FakeResponse:
+        client = self.client
+        result = []
+        for row in rows:
+            client._ensure(self.table, row)
+            columns = list(row)
+            sql = f"INSERT INTO {_quote(self.table)} ({', '.join(map(_quote, columns))}) VALUES ({', '.join('?' * len(columns))})"
+            if conflict and ignore_duplicates:
+                sql += f" ON CONFLICT ({', '.join(map(_quote, conflict))}) DO NOTHING"
+            elif conflict:
+                updates = [c for c in columns if c not in conflict and c not in ("id", "created_at")]
+                set_sql = ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in updates) or f"{_quote(conflict[0])} = excluded.{_quote(conflict[0])}"
+                sql += f" ON CONFLICT ({', '.join(map(_quote, conflict))}) DO UPDATE SET {set_sql}"
+            sql += " RETURNING *"
+            result.extend(client._decode(self.table, r) for r in client._db.execute(sql, [_to_sql(row[c]) for c in columns]))
+        return FakeResponse(result)
+
+    def _execute_insert(self) -> FakeResponse:
+        return self._insert(self._rows())
+
+    def _execute_upsert(self) -> FakeResponse:
+        conflict = self._on_conflict or UNIQUE_KEYS.get(self.table, ("id",))
+        self.client._unique_index(self.table, conflict)
+        return self._insert(self._rows(), conflict, self._ignore_duplicates)
+
+    def _execute_update(self) -> FakeResponse:
+        client = self.client
+        client._ensure(self.table, self._payload)
+        columns = list(self._payload)
+        sql = f"UPDATE {_quote(self.table)} SET {', '.join(f'{_quote(c)} = ?' for c in columns)}{self._where_sql()} RETURNING *"
+        params = [_to_sql(self._payload[c]) for c in columns] + self._params
+        return FakeResponse([client._decode(self.table, r) for r in client._db.execute(sql, params)])
+
+    def _execute_delete(self) -> FakeResponse:
+        client = self.client
+        sql = f"DELETE FROM {_quote(self.table)}{self._where_sql()} RETURNING *"
+        return FakeResponse([client._decode(self.table, r) for r in client._db.execute(sql, self._params)])
+
+
+def install(fake: FakeSupabase) -> FakeSupabase:
+    """Point the backend at the fake (database.supabase and modules that imported it)"""
+    import sys
+    import app.database
+    app.database.supabase = fake
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and getattr(module, "supabase", None) is None and hasattr(module, "supabase"):
+            module.supabase = fake
+    return fake
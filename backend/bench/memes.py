@@ -0,0 +1,107 @@
+"""
+Benchmark the meme renderer
+
+    cd backend && python -m bench.memes --renders 500 --concurrency 8 --workers 2
+
+Renders unique texts (every one a cache miss) through the process pool and
+then repeats them (LRU hits), reporting renders/sec and p50/p99 latency for
+both. Uses synthetic templates at the real templates' sizes in a temporary
+directory unless --template-dir points at downloaded ones.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+_SIZES = {"drake": (1200, 1200), "distracted": (1200, 800)}
+
+
+def synthetic_templates(directory: str):
+    from PIL import Image, ImageFilter
+    for name, size in _SIZES.items():
+        path = os.path.join(directory, f"{name}.jpg")
+        if not os.path.exists(path):
+            noise = Image.effect_noise(size, 64).filter(ImageFilter.GaussianBlur(3)).convert("RGB")
+            noise.save(path, "JPEG", quality=90)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+async def run_phase(renderer, name: str, texts: list, concurrency: int) -> dict:
+    from app.memes import MEME_TEMPLATES
+    template_ids = list(MEME_TEMPLATES)
+    latencies = []
+    remaining = iter(enumerate(texts))
+
+    async def worker():
+        for i, (top, bottom) in remaining:
+            started = time.perf_counter()
+            await renderer.render(template_ids[i % len(template_ids)], top, bottom)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "phase": name,
+        "renders": len(texts),
+        "per_sec": round(len(texts) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def main(args) -> list:
+    from app.memes import MemeRenderer
+    renderer = MemeRenderer(workers=args.workers, cache_size=args.renders * 2, out_dir=args.out_dir)
+    texts = [(f"when the build is green #{i}", f"but prod says otherwise ({i} times this week)") for i in range(args.renders)]
+    try:
+        started = time.perf_counter()
+        await renderer.render("1", "first render", "cold pool")
+        results = [{"phase": "cold", "renders": 1, "per_sec": 0.0,
+                    "p50_ms": round((time.perf_counter() - started) * 1000, 2), "p99_ms": 0.0}]
+        results.append(await run_phase(renderer, "render", texts, args.concurrency))
+        results.append(await run_phase(renderer, "cached", texts, args.concurrency))
+    finally:
+        await renderer.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Pillow meme renderer")
+    parser.add_argument("--renders", type=int, default=500, help="unique memes rendered")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2, help="render processes")
+    parser.add_argument("--template-dir", help="directory with real templates (synthetic ones otherwise)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="covalynce_meme_bench_")
+    args.out_dir = workdir
+    os.environ.setdefault("IMAGE_BASE_URL", "http://bench")
+    if args.template_dir:
+        os.environ["MEME_TEMPLATE_DIR"] = args.template_dir
+    else:
+        os.environ["MEME_TEMPLATE_DIR"] = workdir
+        synthetic_templates(workdir)
+    results = asyncio.run(main(args))
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        columns = ("phase", "renders", "per_sec", "p50_ms", "p99_ms")
+        widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+        print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+        for r in results:
+            print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
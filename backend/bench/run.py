@@ -0,0 +1,183 @@
+"""
+Benchmark the main API endpoints against the SQLite fake and stub HTTP server
+
+    cd backend && python -m bench.run --users 50 --requests 500 --concurrency 20 --db-latency-ms 5
+
+Seeds a FakeSupabase with users, cards, analytics and notifications, points
+the backend's outgoing HTTP at the stub server, then drives each scenario
+through the ASGI app in-process and reports throughput, p50/p99 latency and
+database round trips per request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# Settings the app reads at import time
+os.environ.pop("SUPABASE_URL", None)
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("METRICS_LOG_REQUESTS", "false")
+if not os.getenv("ENCRYPTION_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+
+import httpx
+
+from bench.fake_supabase import FakeSupabase, install
+from bench.stub_server import StubServer, route_external_hosts
+
+# name -> (method, path, json body)
+SCENARIOS = {
+    "profile": ("GET", "/user/profile", None),
+    "sync_github": ("GET", "/sync/github", None),
+    "cards_history": ("GET", "/cards/history?limit=50", None),
+    "analytics": ("GET", "/analytics/posts?limit=50", None),
+    "notifications": ("GET", "/notifications?limit=50", None),
+    "unread_count": ("GET", "/notifications/unread-count", None),
+    "integrations": ("GET", "/integrations/list", None),
+    "usage": ("GET", "/trends/usage", None),
+    "rephrase": ("POST", "/ai/rephrase", {"content": "We shipped a faster sync engine today.", "tone": "casual", "length": "short"}),
+}
+
+
+def seed(fake: FakeSupabase, users: int, rows_per_user: int) -> list:
+    """Populate the fake with realistic per-user rows; returns the user ids"""
+    from app.database import save_user_token
+    user_ids = [f"bench-user-{i}" for i in range(users)]
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    for n, user_id in enumerate(user_ids):
+        fake.table("user_settings").insert({
+            "user_id": user_id, "plan": "PRO" if n % 4 == 0 else "SOLO", "cards_used": 0,
+            "card_limit": 9999, "daily_ai_limit": 50, "monthly_ai_limit": 1000,
+        }).execute()
+        save_user_token(user_id, "github", "gho_bench")
+        cards, analytics, notifications = [], [], []
+        for i in range(rows_per_user):
+            created = (start + timedelta(minutes=i * 7 + n)).isoformat()
+            cards.append({
+                "user_id": user_id, "source_id": f"evt-{i}", "category": "MKT", "type": "GITHUB",
+                "title": f"Shipped: repo-{i}", "subtitle": "Ready to Publish", "content": "Shipped it. " * 20,
+                "tags": ["#ShipIt"], "color_class": "bg-gray-800 text-white",
+                "status": random.choice(["PENDING", "POSTED", "DISMISSED"]), "image_url": None, "created_at": created,
+            })
+            analytics.append({
+                "user_id": user_id, "card_id": f"card-{i}", "platform": "linkedin", "post_id": f"urn:li:share:{i}",
+                "status": "POSTED", "engagement_metrics": {"likes": i % 17}, "posted_at": created, "created_at": created,
+            })
+            notifications.append({
+                "user_id": user_id, "type": "orchestration_success", "title": "Done", "message": "Story completed",
+                "severity": "info", "read": i % 3 == 0, "action_url": None, "metadata": {}, "created_at": created,
+            })
+        fake.table("task_cards").insert(cards).execute()
+        fake.table("post_analytics").insert(analytics).execute()
+        fake.table("notifications").insert(notifications).execute()
+    return user_ids
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+async def run_scenario(client: httpx.AsyncClient, fake: FakeSupabase, name: str, user_ids: list,
+                       requests: int, concurrency: int) -> dict:
+    method, path, body = SCENARIOS[name]
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+    queries_before = fake.queries
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            headers = {"X-User-Id": random.choice(user_ids)}
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, path, headers=headers, json=body)
+                if resp.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "db_queries_per_req": round((fake.queries - queries_before) / requests, 2) if requests else 0.0,
+    }
+
+
+async def main(args) -> list:
+    fake = install(FakeSupabase(latency=args.db_latency_ms / 1000, jitter=args.db_jitter_ms / 1000))
+    stub = StubServer(latency=args.http_latency_ms / 1000).start()
+    restore = route_external_hosts(stub.url)
+
+    import app.main as api
+    api.limiter.enabled = False  # per-IP limits would throttle the benchmark itself
+    latency, fake.latency = fake.latency, 0.0
+    user_ids = seed(fake, args.users, args.rows)
+    fake.latency = latency
+
+    await api.startup_event()
+    results = []
+    try:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+            for name in args.scenarios:
+                if args.warmup:
+                    await run_scenario(client, fake, name, user_ids, args.warmup, args.concurrency)
+                results.append(await run_scenario(client, fake, name, user_ids, args.requests, args.concurrency))
+    finally:
+        await api.shutdown_event()
+        restore()
+        stub.stop()
+    return results
+
+
+def print_table(results: list):
+    columns = ("scenario", "requests", "errors", "rps", "p50_ms", "p99_ms", "db_queries_per_req")
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Covalynce API endpoints in-process")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=200, help="cards/analytics/notifications seeded per user")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="injected latency per PostgREST call")
+    parser.add_argument("--db-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--http-latency-ms", type=float, default=20.0, help="injected latency per third-party API call")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS))
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(results)
@@ -0,0 +1,205 @@
+"""
+Stub HTTP server for the third-party APIs the backend calls
+
+Serves canned GitHub, LinkedIn, Jira, Slack, OpenAI and Razorpay responses from a
+local ThreadingHTTPServer. route_external_hosts() rewrites outgoing httpx
+requests for those hosts to the stub, passing the original host in
+X-Stub-Host, and points the OpenAI SDK at it via OPENAI_BASE_URL, so no code
+path needs to know it is being benchmarked.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+STUB_HOSTS = {
+    "api.github.com", "github.com",
+    "api.linkedin.com", "www.linkedin.com",
+    "slack.com", "hooks.slack.com",
+    "api.openai.com",
+    "api.razorpay.com",
+}
+STUB_HOST_SUFFIXES = (".atlassian.net",)
+
+
+def _chat_completion(body: dict) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "🚀 Shipped something great this week. #ShipIt"}}],
+        "usage": {"prompt_tokens": 50, "completion_tokens": 20, "total_tokens": 70},
+    }
+
+
+def _github(method: str, path: str, body: dict):
+    if path.startswith("/login/oauth/access_token"):
+        return 200, {"access_token": "gho_stub", "token_type": "bearer"}
+    if path == "/user":
+        return 200, {"login": "stub-user", "id": 1}
+    if path.endswith("/events/public"):
+        return 200, [{
+            "id": str(1000 + i), "type": "PushEvent", "repo": {"name": f"stub-org/repo-{i}"},
+            "payload": {"commits": [{"message": f"Improve throughput of service {i}"}]},
+        } for i in range(5)]
+    if "/pulls/" in path:
+        return 200, {"number": int(path.rsplit("/", 1)[-1] or 0), "title": "PROJ-1 Stub PR", "body": "", "merged": True,
+                     "base": {"ref": "main"}, "head": {"ref": "feature"}, "html_url": "https://github.com/stub/pr"}
+    return 200, {}
+
+
+def _linkedin(method: str, path: str, body: dict):
+    if path.startswith("/oauth/v2/accessToken"):
+        return 200, {"access_token": "li_stub", "expires_in": 5184000}
+    if path == "/v2/userinfo":
+        return 200, {"sub": "stub", "name": "Stub User"}
+    if path == "/v2/ugcPosts":
+        return 201, {"id": "urn:li:share:1"}
+    return 200, {}
+
+
+def _jira(method: str, path: str, body: dict):
+    if path.endswith("/transitions") and method == "GET":
+        return 200, {"transitions": [{"id": "31", "name": "Dev Done"}, {"id": "41", "name": "Done"}]}
+    if "/rest/api/3/issue/" in path and method == "GET":
+        key = path.split("/rest/api/3/issue/", 1)[1].split("/", 1)[0].split("?", 1)[0]
+        return 200, {"key": key, "fields": {"status": {"name": "Done"}, "subtasks": []}}
+    return 204 if method == "POST" else 200, {}
+
+
+def _openai(method: str, path: str, body: dict):
+    if path.endswith("/chat/completions"):
+        return 200, _chat_completion(body)
+    if path.endswith("/images/generations"):
+        return 200, {"created": int(time.time()), "data": [{"url": "https://example.com/stub.png"}]}
+    return 200, {}
+
+
+def _razorpay(method: str, path: str, body: dict):
+    if path == "/v1/orders" and method == "POST":
+        return 200, {"id": f"order_stub{int(time.time() * 1000)}", "entity": "order", "status": "created",
+                     "amount": body.get("amount"), "currency": body.get("currency"), "receipt": body.get("receipt")}
+    if path.startswith("/v1/payments/"):
+        return 200, {"id": path.rsplit("/", 1)[-1], "entity": "payment", "status": "captured", "amount": 49900}
+    return 404, {"error": {"code": "BAD_REQUEST_ERROR", "description": "The requested URL was not found on the server."}}
+
+
+def _route(host: str, method: str, path: str, body: dict):
+    if host.endswith("github.com"):
+        return _github(method, path, body)
+    if host.endswith("linkedin.com"):
+        return _linkedin(method, path, body)
+    if host.endswith(STUB_HOST_SUFFIXES):
+        return _jira(method, path, body)
+    if host.endswith("slack.com"):
+        return 200, {"ok": True}
+    if host == "api.openai.com":
+        return _openai(method, path, body)
+    if host == "api.razorpay.com":
+        return _razorpay(method, path, body)
+    return 404, {"error": f"no stub for {host}"}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "CovalynceStub/1.0"
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        # OpenAI SDK requests arrive directly via OPENAI_BASE_URL
+        host = self.headers.get("X-Stub-Host") or ("api.openai.com" if self.path.startswith("/v1/") else self.headers.get("Host", ""))
+        status, payload = _route(host, self.command, self.path.split("?", 1)[0], body)
+        data = json.dumps(payload).encode() if status != 204 else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """Runs the stub on a background thread; use as a context manager"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _is_stubbed(host: str) -> bool:
+    return host in STUB_HOSTS or host.endswith(STUB_HOST_SUFFIXES)
+
+
+def _rewrite(request: httpx.Request, stub: httpx.URL):
+    if _is_stubbed(request.url.host):
+        request.headers["X-Stub-Host"] = request.url.host
+        request.url = request.url.copy_with(scheme=stub.scheme, host=stub.host, port=stub.port)
+
+
+def route_external_hosts(stub_url: str):
+    """Send every httpx request for a stubbed host to the stub server (process-wide)
+
+    OpenAI clients must be created after this call to pick up OPENAI_BASE_URL.
+    """
+    stub = httpx.URL(stub_url)
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    os.environ["OPENAI_BASE_URL"] = f"{stub_url}/v1"
+    sync_handle = httpx.HTTPTransport.handle_request
+    async_handle = httpx.AsyncHTTPTransport.handle_async_request
+
+    def handle_request(self, request):
+        _rewrite(request, stub)
+        return sync_handle(self, request)
+
+    async def handle_async_request(self, request):
+        _rewrite(request, stub)
+        return await async_handle(self, request)
+
+    httpx.HTTPTransport.handle_request = handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+    def restore():
+        httpx.HTTPTransport.handle_request = sync_handle
+        httpx.AsyncHTTPTransport.handle_async_request = async_handle
+        if base_url is None:
+            os.environ.pop("OPENAI_BASE_URL", None)
+        else:
+            os.environ["OPENAI_BASE_URL"] = base_url
+    return restore
@@ -479,20 +479,8 @@ export default function Home() {
                 body: JSON.stringify({ id, content: cardContent, platform: platform || "LINKEDIN" })
             });
 
+            // /action/execute publishes to the platform itself (including the Slack notification)
             const result = await response.json();
-
-            // If it's an Engineering card and action is execute, also notify Slack
-            if (action === 'execute' && card?.category === 'ENG' && platform === 'SLACK') {
-                try {
-                    await fetch(`${API_URL}/action/slack/notify`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json', 'x-user-id': userId || '' },
-                        body: JSON.stringify({ card_id: id })
-                    });
-                } catch (e) {
-                    console.error('Slack notification failed:', e);
-                }
-            }
         } catch (e) {
             console.error('Action failed:', e);
             // Restore card on error
@@ -558,16 +546,17 @@ export default function Home() {
     // Export functionality
     const exportData = async () => {
         try {
-            const res = await fetch(`${API_URL}/user/data/export`, {
+            const res = await fetch(`${API_URL}/user/data/export?format=zip`, {
+                method: 'POST',
                 headers: { 'x-user-id': userId || '' }
             });
-            const data = await res.json();
+            if (!res.ok) throw new Error('Export failed');
 
-            const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
+            const blob = await res.blob();
             const url = URL.createObjectURL(blob);
             const a = document.createElement('a');
             a.href = url;
-            a.download = `covalynce-export-${new Date().toISOString().split('T')[0]}.json`;
+            a.download = `covalynce-export-${new Date().toISOString().split('T')[0]}.zip`;
             document.body.appendChild(a);
             a.click();
             document.body.removeChild(a);
@@ -2032,7 +2021,7 @@ export default function Home() {
                                                 <div><span className="text-neon">POST</span> /auth/signup - Create account</div>
                                                 <div><span className="text-neon">POST</span> /auth/signin - Sign in</div>
                                                 <div><span className="text-neon">GET</span> /sync/github - Get cards</div>
-                                                <div><span className="text-neon">POST</span> /action/execute - Post to LinkedIn</div>
+                                                <div><span className="text-neon">POST</span> /action/execute - Publish to one or more platforms</div>
                                                 <div><span className="text-neon">GET</span> /notifications - Get notifications</div>
                                                 <div><span className="text-neon">POST</span> /user/data/export - Export data (GDPR)</div>
                                                 <div><span className="text-neon">DELETE</span> /user/data/delete - Delete data (GDPR)</div>
@@ -178,3 +178,149 @@ create policy "Public Access" on ai_learning_log for all using (true);
 create index if not exists idx_ai_usage_user_date on ai_usage_log(user_id, created_at);
 create index if not exists idx_ai_learning_user_action on ai_learning_log(user_id, action);
 
+
+-- 18. Keyset pagination indexes (newest-first listings on (created_at, id))
+create index if not exists idx_task_cards_user_created_id on task_cards(user_id, created_at desc, id desc);
+create index if not exists idx_post_analytics_user_created_id on post_analytics(user_id, created_at desc, id desc);
+create index if not exists idx_notifications_user_created_id on notifications(user_id, created_at desc, id desc);
+
+-- 19. Account purge: each call deletes one chunk of the user's rows in its own transaction.
+-- Tables are visited children-first so foreign keys never block; account rows go last.
+-- Call repeatedly until done = true.
+create or replace function purge_user_data_step(p_user_id text, p_chunk int default 5000)
+returns table(table_name text, deleted int, done boolean)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  t text;
+  n int;
+begin
+  foreach t in array array[
+    'post_analytics', 'task_cards', 'competitor_posts', 'competitors', 'ai_training',
+    'ai_usage_log', 'ai_learning_log', 'notifications', 'webhook_retries',
+    'payment_notifications', 'payment_events', 'user_integrations', 'ai_preferences', 'user_settings', 'user_accounts'
+  ] loop
+    execute format(
+      'delete from %I where ctid in (select ctid from %I where user_id = $1 limit $2)', t, t
+    ) using p_user_id, p_chunk;
+    get diagnostics n = row_count;
+    if n > 0 then
+      return query select t, n, false;
+      return;
+    end if;
+  end loop;
+  return query select null::text, 0, true;
+end;
+$$;
+
+-- Runs with the owner's rights: only the backend's service role may call it
+revoke execute on function purge_user_data_step(text, int) from public, anon, authenticated;
+
+create index if not exists idx_competitor_posts_user_id on competitor_posts(user_id);
+create index if not exists idx_webhook_retries_user_id on webhook_retries(user_id);
+
+-- 20. Razorpay webhook events: one row per event id (dedup) with processing state
+create table if not exists payment_events (
+  event_id text primary key,
+  event_type text not null,
+  user_id text,
+  payload jsonb not null,
+  status text not null default 'PENDING', -- PENDING, PROCESSING, DONE, FAILED
+  attempts int not null default 0,
+  last_error text,
+  locked_until timestamp with time zone,
+  received_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  processed_at timestamp with time zone
+);
+
+alter table payment_events enable row level security;
+create policy "Public Access" on payment_events for all using (true);
+
+create index if not exists idx_payment_events_status_received on payment_events(status, received_at);
+create index if not exists idx_payment_events_user_id on payment_events(user_id);
+
+-- 21. Scheduled publishing: one row per (card, platform) to publish at publish_at
+create table if not exists scheduled_posts (
+  id uuid default gen_random_uuid() primary key,
+  user_id text not null,
+  card_id uuid not null references task_cards(id) on delete cascade,
+  platform text not null,
+  content text not null,
+  publish_at timestamp with time zone not null,
+  status text not null default 'SCHEDULED', -- SCHEDULED, PUBLISHING, POSTED, FAILED, CANCELLED
+  attempts int not null default 0,
+  locked_until timestamp with time zone,
+  last_error text,
+  post_id text,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+alter table scheduled_posts enable row level security;
+create policy "Public Access" on scheduled_posts for all using (true);
+
+-- Dispatcher window scans and per-user listings
+create index if not exists idx_scheduled_posts_due on scheduled_posts(publish_at, id) where status = 'SCHEDULED';
+create index if not exists idx_scheduled_posts_stale on scheduled_posts(locked_until) where status = 'PUBLISHING';
+create index if not exists idx_scheduled_posts_user on scheduled_posts(user_id, publish_at);
+
+-- 22. OAuth token expiry for proactive refresh
+alter table user_integrations add column if not exists token_expires_at timestamp with time zone;
+alter table user_integrations add column if not exists token_refresh_locked_until timestamp with time zone;
+create index if not exists idx_user_integrations_token_expiry on user_integrations(token_expires_at) where refresh_token is not null;
+
+-- 23. Competitor crawling: per-competitor fetch schedule and cursor, deduplicated posts, engagement history
+alter table competitors add column if not exists fetch_interval int not null default 3600; -- seconds, adapts to posting rate
+alter table competitors add column if not exists next_fetch_at timestamp with time zone;
+alter table competitors add column if not exists fetch_cursor jsonb; -- since_id / etag / last_modified, per adapter
+alter table competitors add column if not exists fetch_locked_until timestamp with time zone;
+alter table competitors add column if not exists fetch_failures int not null default 0;
+alter table competitors add column if not exists last_fetched_at timestamp with time zone;
+alter table competitors add column if not exists last_error text;
+create index if not exists idx_competitors_next_fetch on competitors(next_fetch_at);
+
+alter table competitor_posts add column if not exists external_id text;
+alter table competitor_posts add column if not exists content_hash text;
+alter table competitor_posts add column if not exists url text;
+create unique index if not exists idx_competitor_posts_hash on competitor_posts(competitor_id, content_hash);
+create index if not exists idx_competitor_posts_posted on competitor_posts(competitor_id, posted_at desc);
+
+create table if not exists competitor_post_snapshots (
+  id uuid default gen_random_uuid() primary key,
+  competitor_id uuid not null references competitors(id) on delete cascade,
+  user_id text not null,
+  content_hash text not null,
+  engagement_metrics jsonb,
+  captured_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+alter table competitor_post_snapshots enable row level security;
+create policy "Public Access" on competitor_post_snapshots for all using (true);
+
+create index if not exists idx_competitor_post_snapshots_post on competitor_post_snapshots(competitor_id, content_hash, captured_at);
+
+-- 24. Keyset paging of competitor rows for data export, on non-null (time, id)
+create index if not exists idx_competitor_posts_user_fetched_id on competitor_posts(user_id, fetched_at desc, id desc);
+create index if not exists idx_competitor_post_snapshots_user_captured_id on competitor_post_snapshots(user_id, captured_at desc, id desc);
+
+-- 25. Token refresh backoff: failed refreshes are kept out of the expiry scan until token_next_refresh_at
+alter table user_integrations add column if not exists token_refresh_failures int not null default 0;
+alter table user_integrations add column if not exists token_next_refresh_at timestamp with time zone;
+
+-- 26. Card usage: increment cards_used in place so concurrent workers don't lose increments
+create or replace function increment_cards_used(p_user_id text)
+returns int
+language sql
+set search_path = public
+as $$
+  update user_settings set cards_used = coalesce(cards_used, 0) + 1
+  where user_id = p_user_id
+  returning cards_used;
+$$;
+
+-- 27. Keyset paging of payment_events for data export, on (received_at, event_id)
+create index if not exists idx_payment_events_user_received_id on payment_events(user_id, received_at desc, event_id desc);
+
+-- 28. Keyset paging of scheduled_posts for data export
+create index if not exists idx_scheduled_posts_user_created_id on scheduled_posts(user_id, created_at desc, id desc);